@@ -0,0 +1,167 @@
+# auditoria.py
+import atexit
+import os
+import queue
+import threading
+import time
+from sqlalchemy.exc import OperationalError
+from models import db, Log
+
+POLITICAS_DESBORDE = ('sincrono', 'descartar', 'bloquear')
+
+
+class EscritorLogs:
+    """Escritura diferida y por lotes de los logs de auditoría.
+
+    registrar_log deja el evento en una cola acotada y vuelve de inmediato;
+    un hilo de fondo los inserta con un INSERT multi-fila usando su propia
+    conexión, cuando junta LOGS_LOTE_MAX eventos o pasan
+    LOGS_INTERVALO_FLUSH segundos, lo que ocurra primero.
+
+    Si la cola se llena se aplica LOGS_POLITICA_DESBORDE:
+      - 'sincrono': se escribe ese evento en línea (no se pierde nada).
+      - 'descartar': se descarta el evento y se cuenta en `descartados`.
+      - 'bloquear': se espera hasta LOGS_TIMEOUT_BLOQUEO segundos por espacio.
+
+    Si el INSERT de un lote falla por una fila inválida, el lote se reintenta
+    en mitades hasta aislarla: solo se pierden las filas que fallan solas,
+    y se cuentan en `perdidos`.
+    """
+
+    def __init__(self):
+        self.app = None
+        self.asincrono = True
+        self.cola_max = 10000
+        self.lote_max = 500
+        self.intervalo = 2.0
+        self.politica = 'sincrono'
+        self.timeout_bloqueo = 1.0
+        self.descartados = 0
+        self.perdidos = 0
+        self._engine = None
+        self._cola = None
+        self._hilo = None
+        self._pid = None
+        self._detener = threading.Event()
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.app = app
+        self.asincrono = app.config.get('LOGS_ASINCRONO', self.asincrono)
+        self.cola_max = app.config.get('LOGS_COLA_MAX', self.cola_max)
+        self.lote_max = app.config.get('LOGS_LOTE_MAX', self.lote_max)
+        self.intervalo = app.config.get('LOGS_INTERVALO_FLUSH', self.intervalo)
+        self.politica = app.config.get('LOGS_POLITICA_DESBORDE', self.politica)
+        self.timeout_bloqueo = app.config.get('LOGS_TIMEOUT_BLOQUEO', self.timeout_bloqueo)
+
+        if self.politica not in POLITICAS_DESBORDE:
+            raise ValueError(f"LOGS_POLITICA_DESBORDE inválida: {self.politica!r} "
+                             f"(opciones: {', '.join(POLITICAS_DESBORDE)})")
+
+        atexit.register(self.detener)
+
+    # --- API pública ---
+    def registrar(self, evento):
+        """Encola un evento (dict con las columnas de Log) para su escritura."""
+        if not self.asincrono:
+            self._escribir([evento])
+            return
+
+        self._asegurar_hilo()
+        try:
+            self._cola.put_nowait(evento)
+            return
+        except queue.Full:
+            pass
+
+        if self.politica == 'sincrono':
+            self._escribir([evento])
+        elif self.politica == 'bloquear':
+            try:
+                self._cola.put(evento, timeout=self.timeout_bloqueo)
+            except queue.Full:
+                self.descartados += 1
+                print("Cola de logs llena: evento descartado tras esperar.")
+        else:
+            self.descartados += 1
+
+    def vaciar(self):
+        """Escribe en este momento todo lo pendiente (útil en scripts y pruebas)."""
+        if self._cola is None:
+            return
+        lote = []
+        while True:
+            try:
+                lote.append(self._cola.get_nowait())
+            except queue.Empty:
+                break
+            if len(lote) >= self.lote_max:
+                self._escribir(lote)
+                lote = []
+        if lote:
+            self._escribir(lote)
+
+    def detener(self, timeout=10):
+        """Detiene el hilo de fondo escribiendo lo que quede en la cola."""
+        self._detener.set()
+        hilo = self._hilo
+        if hilo is not None and hilo.is_alive() and self._pid == os.getpid():
+            hilo.join(timeout)
+        self.vaciar()
+
+    # --- Interno ---
+    def _asegurar_hilo(self):
+        # Se arranca en el primer uso y de nuevo tras un fork (gunicorn --preload)
+        if self._hilo is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._hilo is not None and self._pid == os.getpid():
+                return
+            self._cola = queue.Queue(maxsize=self.cola_max)
+            self._engine = None
+            self._detener.clear()
+            self._pid = os.getpid()
+            self._hilo = threading.Thread(target=self._bucle, name='escritor-logs', daemon=True)
+            self._hilo.start()
+
+    def _bucle(self):
+        while not self._detener.is_set():
+            lote = []
+            limite = time.monotonic() + self.intervalo
+            while len(lote) < self.lote_max:
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    break
+                try:
+                    lote.append(self._cola.get(timeout=restante))
+                except queue.Empty:
+                    break
+                if self._detener.is_set():
+                    break
+            if lote:
+                self._escribir(lote)
+
+    def _obtener_engine(self):
+        if self._engine is None:
+            with self.app.app_context():
+                self._engine = db.engine
+        return self._engine
+
+    def _escribir(self, lote):
+        try:
+            with self._obtener_engine().begin() as conn:
+                conn.execute(Log.__table__.insert().values(lote))
+        except Exception as e:
+            if len(lote) > 1 and not isinstance(e, OperationalError):
+                # Una fila inválida no debe arrastrar al resto: se reintenta en mitades.
+                # (Con la BD caída o bloqueada, OperationalError, partirlo solo multiplicaría las esperas)
+                mitad = len(lote) // 2
+                self._escribir(lote[:mitad])
+                self._escribir(lote[mitad:])
+                return
+            # Igual que antes: si falla el log no se cae la app, solo avisamos en consola
+            self.perdidos += len(lote)
+            print(f"Error al registrar {len(lote)} log(s): {e}")
+
+
+escritor_logs = EscritorLogs()
@@ -0,0 +1,165 @@
+# base_datos.py
+import time
+from contextlib import contextmanager
+from functools import wraps
+from flask import g, has_request_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+BIND_LECTURA = 'lectura'
+BIND_GLOBAL = 'global'   # BD de identidad global (identidad.py)
+
+# Momento (monotónico) del último flush con cambios en este proceso; ver SesionEnrutada
+_ultima_escritura = 0.0
+_retraso_replica = 5.0
+
+
+def opciones_engine(url, config, prefijo='DB_'):
+    """Opciones de create_engine para `url` según las variables DB_* de la config.
+
+    Con otro `prefijo` (p. ej. 'IDENTIDAD_') se usan esas variables y, las que falten, las DB_*.
+    """
+    def valor(nombre, defecto):
+        return config.get(prefijo + nombre, config.get('DB_' + nombre, defecto))
+
+    opciones = {'pool_pre_ping': valor('PRE_PING', True)}
+    dialecto = make_url(url).get_backend_name()
+    if dialecto == 'sqlite':
+        # SQLite en memoria usa StaticPool (sin tamaño); el timeout es la espera por bloqueos
+        opciones['connect_args'] = {'timeout': valor('TIMEOUT_CONEXION', 5)}
+        return opciones
+
+    opciones.update(
+        pool_size=valor('POOL_SIZE', 10),
+        max_overflow=valor('MAX_OVERFLOW', 10),
+        pool_timeout=valor('POOL_TIMEOUT', 10),
+        # Menor que el wait_timeout de MySQL (y que el corte de firewalls/proxys por inactividad)
+        pool_recycle=valor('POOL_RECYCLE', 280),
+    )
+    if dialecto in ('mysql', 'postgresql'):
+        opciones['connect_args'] = {'connect_timeout': valor('TIMEOUT_CONEXION', 5)}
+    return opciones
+
+
+def configurar_base_datos(app, db):
+    """Arma los engines (principal, réplica y BD global opcionales) desde la config e inicializa `db`."""
+    global _retraso_replica
+    config = app.config
+    config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        **opciones_engine(config['SQLALCHEMY_DATABASE_URI'], config),
+        **config.get('SQLALCHEMY_ENGINE_OPTIONS', {}),
+    }
+    binds = dict(config.get('SQLALCHEMY_BINDS') or {})
+    url_lectura = config.get('DATABASE_URL_LECTURA')
+    if url_lectura:
+        binds[BIND_LECTURA] = {'url': url_lectura, **opciones_engine(url_lectura, config)}
+    url_global = config.get('DATABASE_URL_GLOBAL')
+    if url_global:
+        # Pool propio (y más chico): un login lento contra la BD global no agota el pool principal
+        binds[BIND_GLOBAL] = {'url': url_global, **opciones_engine(url_global, config, 'IDENTIDAD_')}
+    if binds:
+        config['SQLALCHEMY_BINDS'] = binds
+    _retraso_replica = config.get('DB_REPLICA_RETRASO_MAX', _retraso_replica)
+
+    db.init_app(app)
+
+    with app.app_context():
+        for clave, engine in db.engines.items():
+            milisegundos = config.get('DB_TIMEOUT_CONSULTA', 0)
+            if clave == BIND_GLOBAL:
+                milisegundos = config.get('IDENTIDAD_TIMEOUT_CONSULTA', milisegundos)
+            if milisegundos:
+                _limitar_consultas(engine, milisegundos)
+
+
+def _limitar_consultas(engine, milisegundos):
+    """Fija el tiempo máximo de cada consulta en cada conexión nueva del pool."""
+    dialecto = engine.dialect.name
+    if dialecto == 'mysql':
+        # MySQL 5.7+ (solo SELECT, en ms) o MariaDB (en segundos): se usa la que exista
+        sentencias = [f'SET SESSION max_execution_time = {int(milisegundos)}',
+                      f'SET SESSION max_statement_time = {milisegundos / 1000:.3f}']
+    elif dialecto == 'postgresql':
+        sentencias = [f'SET statement_timeout = {int(milisegundos)}']
+    else:
+        return
+
+    @event.listens_for(engine, 'connect')
+    def _al_conectar(conexion_dbapi, registro):
+        cursor = conexion_dbapi.cursor()
+        try:
+            for sentencia in sentencias:
+                try:
+                    cursor.execute(sentencia)
+                    conexion_dbapi.commit()
+                    return
+                except Exception:
+                    conexion_dbapi.rollback()
+            print(f"No se pudo fijar DB_TIMEOUT_CONSULTA en {engine.url.render_as_string(hide_password=True)}")
+        finally:
+            cursor.close()
+
+
+# --- ENRUTAMIENTO LECTURA/ESCRITURA ---
+def marcar_solo_lectura():
+    """Las consultas de esta request pueden ir a la réplica (before_request de un blueprint)."""
+    g.solo_lectura = True
+
+
+def solo_lectura(f):
+    """Decorador para vistas que solo leen (listados, reportes, exportaciones)."""
+    @wraps(f)
+    def decorada(*args, **kwargs):
+        marcar_solo_lectura()
+        return f(*args, **kwargs)
+    return decorada
+
+
+@contextmanager
+def en_principal():
+    """Fuerza el servidor principal dentro del bloque (datos que no toleran atraso)."""
+    anterior = g.get('solo_lectura', False) if has_request_context() else False
+    if has_request_context():
+        g.solo_lectura = False
+    try:
+        yield
+    finally:
+        if has_request_context():
+            g.solo_lectura = anterior
+
+
+def _usar_replica():
+    if not has_request_context() or not g.get('solo_lectura'):
+        return False
+    # Tras escribir, este proceso lee del principal hasta que la réplica alcance el cambio
+    return time.monotonic() - _ultima_escritura > _retraso_replica
+
+
+def motor_lectura(db):
+    """Engine para consultas Core de solo lectura (p. ej. exportaciones en streaming)."""
+    if _usar_replica():
+        return db.engines.get(BIND_LECTURA, db.engine)
+    return db.engine
+
+
+class SesionEnrutada(Session):
+    """Sesión que manda las lecturas de las vistas marcadas con solo_lectura a la réplica.
+
+    Sin DATABASE_URL_LECTURA todo va al principal. Los flush, los
+    INSERT/UPDATE/DELETE explícitos y las vistas no marcadas siempre van
+    al principal.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and not getattr(clause, 'is_dml', False) and _usar_replica():
+            replica = self._db.engines.get(BIND_LECTURA)
+            if replica is not None:
+                return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+@event.listens_for(SesionEnrutada, 'after_flush')
+def _registrar_escritura(sesion, contexto):
+    global _ultima_escritura
+    _ultima_escritura = time.monotonic()
@@ -0,0 +1,427 @@
+# benchmarks/carga.py
+"""Recorre las rutas de la app con varios hilos y compara contra una línea base.
+
+Uso:
+    python benchmarks/datos.py --db sqlite:///bench.db                      # primero, los datos
+    python benchmarks/carga.py --db sqlite:///bench.db                      # test client, en proceso
+    python benchmarks/carga.py --db sqlite:///bench.db --http               # servidor HTTP local con hilos
+    python benchmarks/carga.py --db sqlite:///bench.db --db-global sqlite:///bench_global.db  # login global
+    python benchmarks/carga.py --db mysql+pymysql://... --url http://servidor:5000 --pid-servidor 1234
+    python benchmarks/carga.py --db sqlite:///bench.db --baseline benchmarks/baselines/pequeno.json
+    python benchmarks/carga.py --db sqlite:///bench.db --guardar-baseline benchmarks/baselines/pequeno.json
+
+Cada escenario (login, seleccion_grupo, lista_por_grupo, buscar, ver_logs,
+exportar_logs_xlsx, editar_usuario) se ejecuta --iteraciones veces repartidas
+entre --concurrencia hilos. Se informan percentiles de latencia, requests
+por segundo, consultas SQL por request (del header Server-Timing) y el pico
+de memoria (RSS) del proceso que atiende.
+
+Con --baseline el script termina con código 1 si algún escenario tiene
+errores, hace más consultas que en la línea base, o empeora su p95, sus
+requests/s o el RSS más que --tolerancia. Contra un servidor externo (--url)
+hay que arrancarlo con LIMITES_ACTIVOS=0 y la misma --db.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import re
+import resource
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from http.cookiejar import CookieJar
+from urllib.error import HTTPError
+from urllib.parse import urlencode, quote
+from urllib.request import build_opener, HTTPCookieProcessor, HTTPRedirectHandler, Request
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from sqlalchemy import select  # noqa: E402
+from app import create_app  # noqa: E402
+from models import db, Usuario, Rol, usuario_grupos, usuario_dashboards  # noqa: E402
+from datos import CLAVE, EMAIL_ADMIN, TEMAS, ACCIONES  # noqa: E402
+
+PATRON_CSRF = re.compile(r'name="csrf_token" value="([^"]+)"')
+PATRON_CONSULTAS = re.compile(r'desc="(\d+) consultas"')
+
+
+# --- CLIENTES ---
+class ClienteFlask:
+    """Test client de Flask: mide la app sin red ni servidor."""
+
+    def __init__(self, app):
+        self.cliente = app.test_client()
+
+    def pedir(self, metodo, ruta, datos=None):
+        r = self.cliente.open(ruta, method=metodo, data=datos)
+        cuerpo = r.get_data()  # Consume también las respuestas en streaming (xlsx)
+        return r.status_code, r.headers.get('Server-Timing', ''), cuerpo
+
+
+class _SinRedirecciones(HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None  # El 302 se mide como respuesta, igual que en el test client
+
+
+class ClienteHTTP:
+    """Cliente HTTP con cookies propias (una sesión por hilo)."""
+
+    def __init__(self, base):
+        self.base = base.rstrip('/')
+        self.opener = build_opener(HTTPCookieProcessor(CookieJar()), _SinRedirecciones())
+
+    def pedir(self, metodo, ruta, datos=None):
+        cuerpo = urlencode(datos, doseq=True).encode() if datos is not None else None
+        peticion = Request(self.base + ruta, data=cuerpo, method=metodo)
+        try:
+            respuesta = self.opener.open(peticion, timeout=120)
+        except HTTPError as e:
+            respuesta = e  # 3xx/4xx/5xx también traen headers y cuerpo
+        with respuesta:
+            return respuesta.status, respuesta.headers.get('Server-Timing', ''), respuesta.read()
+
+
+def _csrf(cliente, ruta):
+    _, _, cuerpo = cliente.pedir('GET', ruta)
+    coincide = PATRON_CSRF.search(cuerpo.decode('utf-8', 'replace'))
+    return coincide.group(1) if coincide else ''
+
+
+# --- CONTEXTO Y TRABAJADORES ---
+class Contexto:
+    """Datos de la base sembrada que necesitan los escenarios."""
+
+    def __init__(self, app, nuevo_cliente, clave):
+        self.nuevo_cliente = nuevo_cliente
+        self.clave = clave
+        with app.app_context():
+            lector = db.session.execute(select(Rol.id).where(Rol.nombre == 'Lector')).scalar_one()
+            usuarios = db.session.execute(
+                select(Usuario.id, Usuario.email, Usuario.nombre_completo, Usuario.rol_id)
+                .where(Usuario.activo.is_(True), Usuario.email != EMAIL_ADMIN)).all()
+            grupos, dashboards = {}, {}
+            for u, g in db.session.execute(select(usuario_grupos.c.usuario_id, usuario_grupos.c.grupo_id)):
+                grupos.setdefault(u, []).append(g)
+            for u, d in db.session.execute(select(usuario_dashboards.c.usuario_id, usuario_dashboards.c.dashboard_id)):
+                dashboards.setdefault(u, []).append(d)
+
+        # Lectores con algún grupo (para lista_por_grupo) y usuarios a editar
+        self.lectores = [(email, grupos[uid]) for uid, email, _, rol in usuarios if rol == lector and uid in grupos]
+        self.editables = [(uid, email, nombre, rol, grupos.get(uid, []), dashboards.get(uid, []))
+                          for uid, email, nombre, rol in usuarios]
+        if not self.lectores:
+            raise SystemExit('La base no tiene lectores con grupos: ejecuta primero benchmarks/datos.py')
+
+
+class Trabajador:
+    """Estado de un hilo: sus sesiones de lector y de admin, creadas al primer uso."""
+
+    def __init__(self, ctx, indice, rnd):
+        self.ctx = ctx
+        self.indice = indice
+        self.rnd = rnd
+        self._lector = None
+        self._admin = None
+        self.muestras = []   # (ms, status_ok, consultas)
+
+    def iniciar_sesion(self, email):
+        cliente = self.ctx.nuevo_cliente()
+        token = _csrf(cliente, '/login')
+        status, _, _ = cliente.pedir('POST', '/login', {'email': email, 'password': self.ctx.clave,
+                                                       'csrf_token': token})
+        if status != 302:
+            raise SystemExit(f'No se pudo iniciar sesión como {email} (HTTP {status}).')
+        return cliente
+
+    def lector(self):
+        if self._lector is None:
+            self.email_lector, self.grupos_lector = self.rnd.choice(self.ctx.lectores)
+            self._lector = self.iniciar_sesion(self.email_lector)
+        return self._lector
+
+    def admin(self):
+        if self._admin is None:
+            self._admin = self.iniciar_sesion(EMAIL_ADMIN)
+            self.token_admin = _csrf(self._admin, '/admin/panel')
+        return self._admin
+
+    def medir(self, cliente, metodo, ruta, datos=None, esperado=(200,)):
+        inicio = time.perf_counter()
+        status, server_timing, _ = cliente.pedir(metodo, ruta, datos)
+        ms = (time.perf_counter() - inicio) * 1000
+        consultas = PATRON_CONSULTAS.search(server_timing)
+        self.muestras.append((ms, status in esperado, int(consultas.group(1)) if consultas else None))
+
+
+# --- ESCENARIOS ---
+# Cada uno hace una request medida; lo que prepara (token CSRF, sesión) no se cuenta.
+ESCENARIOS = {}
+
+
+def escenario(nombre):
+    def registrar(funcion):
+        ESCENARIOS[nombre] = funcion
+        return funcion
+    return registrar
+
+
+@escenario('login')
+def _login(t):
+    cliente = t.ctx.nuevo_cliente()
+    token = _csrf(cliente, '/login')
+    email, _ = t.rnd.choice(t.ctx.lectores)
+    t.medir(cliente, 'POST', '/login', {'email': email, 'password': t.ctx.clave, 'csrf_token': token},
+            esperado=(302,))
+
+
+@escenario('seleccion_grupo')
+def _seleccion_grupo(t):
+    t.medir(t.lector(), 'GET', '/estadisticas/')
+
+
+@escenario('lista_por_grupo')
+def _lista_por_grupo(t):
+    cliente = t.lector()
+    t.medir(cliente, 'GET', f'/estadisticas/grupo/{t.rnd.choice(t.grupos_lector)}')
+
+
+@escenario('buscar')
+def _buscar(t):
+    termino = t.rnd.choice(TEMAS).split()[0].lower()
+    t.medir(t.lector(), 'GET', f'/estadisticas/buscar?q={quote(termino)}')
+
+
+@escenario('ver_logs')
+def _ver_logs(t):
+    cliente = t.admin()
+    filtros = t.rnd.choice([
+        {},
+        {'accion': t.rnd.choice(ACCIONES)},
+        {'usuario_id': t.rnd.choice(t.ctx.editables)[0]},
+        {'entidad': 'usuario', 'entidad_id': t.rnd.choice(t.ctx.editables)[0]},
+        {'fecha_desde': (date.today() - timedelta(days=30)).isoformat()},
+    ])
+    t.medir(cliente, 'GET', '/admin/ver_logs?' + urlencode(filtros))
+
+
+@escenario('exportar_logs_xlsx')
+def _exportar_logs_xlsx(t):
+    # Dos días de logs: el tamaño crece con el volumen sembrado, como en producción
+    desde = (date.today() - timedelta(days=2)).isoformat()
+    t.medir(t.admin(), 'GET', f'/admin/exportar_logs_xlsx?fecha_desde={desde}')
+
+
+@escenario('editar_usuario')
+def _editar_usuario(t):
+    cliente = t.admin()
+    # Cada hilo edita sus propios usuarios para no pisarse; se alterna quitar/devolver un panel
+    editables = t.ctx.editables[t.indice::t.concurrencia] or t.ctx.editables
+    uid, email, nombre, rol, grupos, dashboards = t.rnd.choice(editables)
+    if dashboards and t.rnd.random() < 0.5:
+        dashboards = dashboards[:-1]
+    t.medir(cliente, 'POST', f'/admin/editar_usuario/{uid}',
+            {'nombre_completo': nombre, 'email': email, 'rol_id': rol, 'csrf_token': t.token_admin,
+             'permisos_grupos': grupos, 'permisos_dashboards': dashboards}, esperado=(302,))
+
+
+# --- EJECUCIÓN ---
+def percentil(valores, p):
+    if not valores:
+        return 0.0
+    return valores[min(len(valores) - 1, int(round(p * (len(valores) - 1))))]
+
+
+def ejecutar(ctx, nombres, iteraciones, concurrencia, calentamiento, semilla):
+    trabajadores = [Trabajador(ctx, i, random.Random(semilla + i)) for i in range(concurrencia)]
+    for t in trabajadores:
+        t.concurrencia = concurrencia
+
+    resultados = {}
+    for nombre in nombres:
+        funcion = ESCENARIOS[nombre]
+        for t in trabajadores:
+            for _ in range(calentamiento):
+                funcion(t)
+            t.muestras = []
+
+        def correr(t, n):
+            for _ in range(n):
+                funcion(t)
+
+        reparto = [iteraciones // concurrencia + (1 if i < iteraciones % concurrencia else 0)
+                   for i in range(concurrencia)]
+        inicio = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrencia) as hilos:
+            list(hilos.map(correr, trabajadores, reparto))
+        duracion = time.perf_counter() - inicio
+
+        muestras = [m for t in trabajadores for m in t.muestras]
+        latencias = sorted(m[0] for m in muestras)
+        consultas = [m[2] for m in muestras if m[2] is not None]
+        resultados[nombre] = {
+            'requests': len(muestras),
+            'errores': sum(1 for m in muestras if not m[1]),
+            'rps': round(len(muestras) / duracion, 1),
+            'p50_ms': round(percentil(latencias, 0.50), 2),
+            'p90_ms': round(percentil(latencias, 0.90), 2),
+            'p95_ms': round(percentil(latencias, 0.95), 2),
+            'p99_ms': round(percentil(latencias, 0.99), 2),
+            'max_ms': round(latencias[-1], 2) if latencias else 0.0,
+            'consultas_media': round(sum(consultas) / len(consultas), 2) if consultas else None,
+            'consultas_max': max(consultas) if consultas else None,
+        }
+    return resultados
+
+
+def rss_pico_mb(pid=None):
+    """Pico de memoria residente: del servidor externo (/proc) o de este proceso."""
+    if pid:
+        with open(f'/proc/{pid}/status') as f:
+            for linea in f:
+                if linea.startswith('VmHWM:'):
+                    return round(int(linea.split()[1]) / 1024, 1)
+        return None
+    maximo = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(maximo / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def comparar(actual, base, tolerancia):
+    """Lista de regresiones (vacía si todo está dentro de la tolerancia)."""
+    regresiones = []
+    for nombre, r in actual['escenarios'].items():
+        if r['errores']:
+            regresiones.append(f"{nombre}: {r['errores']} respuestas con error")
+        b = base['escenarios'].get(nombre)
+        if not b:
+            continue
+        if r['consultas_max'] is not None and b.get('consultas_max') is not None \
+                and r['consultas_max'] > b['consultas_max']:
+            regresiones.append(f"{nombre}: {r['consultas_max']} consultas por request (línea base {b['consultas_max']})")
+        if r['p95_ms'] > b['p95_ms'] * (1 + tolerancia):
+            regresiones.append(f"{nombre}: p95 {r['p95_ms']} ms (línea base {b['p95_ms']} ms)")
+        if r['rps'] < b['rps'] * (1 - tolerancia):
+            regresiones.append(f"{nombre}: {r['rps']} req/s (línea base {b['rps']} req/s)")
+    if actual.get('rss_mb') and base.get('rss_mb') and actual['rss_mb'] > base['rss_mb'] * (1 + tolerancia):
+        regresiones.append(f"RSS pico {actual['rss_mb']} MB (línea base {base['rss_mb']} MB)")
+    return regresiones
+
+
+def imprimir(resultado, base=None):
+    print(f"{'escenario':<20}{'req':>6}{'err':>5}{'req/s':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}{'sql':>7}")
+    for nombre, r in resultado['escenarios'].items():
+        sql = '-' if r['consultas_max'] is None else r['consultas_max']
+        print(f"{nombre:<20}{r['requests']:>6}{r['errores']:>5}{r['rps']:>9.1f}{r['p50_ms']:>9.1f}"
+              f"{r['p95_ms']:>9.1f}{r['p99_ms']:>9.1f}{r['max_ms']:>9.1f}{sql:>7}")
+        b = (base or {}).get('escenarios', {}).get(nombre)
+        if b:
+            print(f"{'  línea base':<20}{'':>6}{'':>5}{b['rps']:>9.1f}{b['p50_ms']:>9.1f}{b['p95_ms']:>9.1f}"
+                  f"{b['p99_ms']:>9.1f}{b['max_ms']:>9.1f}{b['consultas_max'] if b['consultas_max'] is not None else '-':>7}")
+    print(f"Latencias en ms; sql = máximo de consultas por request. RSS pico: {resultado['rss_mb']} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', required=True, help='URL de SQLAlchemy de la base sembrada con datos.py.')
+    parser.add_argument('--db-global', help='BD de identidad global (la de datos.py --db-global).')
+    parser.add_argument('--db-lectura', help='Réplica para las vistas de solo lectura (p. ej. una copia del .db).')
+    destino = parser.add_mutually_exclusive_group()
+    destino.add_argument('--http', action='store_true', help='Levanta un servidor HTTP con hilos en este proceso.')
+    destino.add_argument('--url', help='Servidor ya arrancado (p. ej. http://localhost:5000).')
+    parser.add_argument('--pid-servidor', type=int, help='PID del servidor externo, para leer su RSS.')
+    parser.add_argument('--escenarios', default=','.join(ESCENARIOS),
+                        help='Lista separada por comas (por defecto, todos).')
+    parser.add_argument('--iteraciones', type=int, default=200, help='Requests medidas por escenario (200).')
+    parser.add_argument('--concurrencia', type=int, default=8, help='Hilos simultáneos (8).')
+    parser.add_argument('--calentamiento', type=int, default=3, help='Requests sin medir por hilo (3).')
+    parser.add_argument('--semilla', type=int, default=42)
+    parser.add_argument('--clave', default=CLAVE, help='Clave de los usuarios sembrados.')
+    parser.add_argument('--metodo', default='pbkdf2:sha256:1000',
+                        help='HASH_METODO de la app; el mismo de datos.py para que el login no recalcule hashes.')
+    parser.add_argument('--baseline', help='JSON con la línea base a comparar.')
+    parser.add_argument('--guardar-baseline', help='Guarda el resultado como línea base en este JSON.')
+    parser.add_argument('--tolerancia', type=float, default=0.25,
+                        help='Empeoramiento aceptado en p95, req/s y RSS (0.25 = 25%%).')
+    args = parser.parse_args()
+
+    nombres = [n.strip() for n in args.escenarios.split(',') if n.strip()]
+    desconocidos = [n for n in nombres if n not in ESCENARIOS]
+    if desconocidos:
+        parser.error(f"Escenarios desconocidos: {', '.join(desconocidos)}")
+
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': args.db,
+        'DATABASE_URL_LECTURA': args.db_lectura,
+        'DATABASE_URL_GLOBAL': args.db_global,
+        'SECRET_KEY': os.getenv('SECRET_KEY') or 'benchmark',
+        'LIMITES_ACTIVOS': False,          # Todos los logins salen de la misma IP
+        'HASH_METODO': args.metodo,
+        'HASH_PROCESOS': 0,
+        'USUARIOS_CACHE_TTL': 300,         # Un solo proceso: invalidar() ya llega a todas las requests
+        'METRICAS_ACTIVAS': True,          # De aquí sale el conteo de consultas (Server-Timing)
+    })
+
+    modo = 'test_client'
+    if args.url:
+        modo = 'http_externo'
+        nuevo_cliente = lambda: ClienteHTTP(args.url)  # noqa: E731
+    elif args.http:
+        from werkzeug.serving import make_server, WSGIRequestHandler
+
+        class SinLog(WSGIRequestHandler):
+            def log_request(self, *args, **kwargs):
+                pass
+
+        modo = 'http'
+        servidor = make_server('127.0.0.1', 0, app, threaded=True, request_handler=SinLog)
+        threading.Thread(target=servidor.serve_forever, daemon=True).start()
+        base = f'http://127.0.0.1:{servidor.server_port}'
+        nuevo_cliente = lambda: ClienteHTTP(base)  # noqa: E731
+    else:
+        nuevo_cliente = lambda: ClienteFlask(app)  # noqa: E731
+
+    ctx = Contexto(app, nuevo_cliente, args.clave)
+    print(f'Modo {modo}, {args.concurrencia} hilos, {args.iteraciones} requests por escenario, '
+          f'{len(ctx.editables) + 1} usuarios en la base.')
+    escenarios = ejecutar(ctx, nombres, args.iteraciones, args.concurrencia, args.calentamiento, args.semilla)
+
+    resultado = {
+        'entorno': {'modo': modo, 'concurrencia': args.concurrencia, 'iteraciones': args.iteraciones,
+                    'motor': args.db.split(':', 1)[0], 'replica': bool(args.db_lectura),
+                    'identidad_global': bool(args.db_global), 'python': platform.python_version(),
+                    'plataforma': platform.platform(), 'nucleos': os.cpu_count()},
+        'escenarios': escenarios,
+        'rss_mb': rss_pico_mb(args.pid_servidor) if (args.pid_servidor or modo != 'http_externo') else None,
+    }
+
+    base = None
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            base = json.load(f)
+        distintos = {k: (v, resultado['entorno'].get(k)) for k, v in base.get('entorno', {}).items()
+                     if k in ('modo', 'concurrencia', 'iteraciones', 'motor') and resultado['entorno'].get(k) != v}
+        if distintos:
+            print(f'Aviso: la línea base se tomó con otra configuración: {distintos}')
+    imprimir(resultado, base)
+
+    if args.guardar_baseline:
+        os.makedirs(os.path.dirname(os.path.abspath(args.guardar_baseline)), exist_ok=True)
+        with open(args.guardar_baseline, 'w', encoding='utf-8') as f:
+            json.dump(resultado, f, indent=2, ensure_ascii=False)
+            f.write('\n')
+        print(f'Línea base guardada en {args.guardar_baseline}')
+
+    if base is not None:
+        regresiones = comparar(resultado, base, args.tolerancia)
+        if regresiones:
+            print('\nREGRESIONES:')
+            for r in regresiones:
+                print(f'  - {r}')
+            sys.exit(1)
+        print('\nSin regresiones respecto de la línea base.')
+
+
+if __name__ == '__main__':
+    main()
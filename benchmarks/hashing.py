@@ -0,0 +1,62 @@
+# benchmarks/hashing.py
+"""Logins por segundo (verificación de contraseña) en el hilo vs. en el pool de procesos.
+
+Uso:
+    python benchmarks/hashing.py                      # política por defecto (scrypt)
+    python benchmarks/hashing.py --metodo pbkdf2:sha256:600000 --logins 200
+    python benchmarks/hashing.py --procesos 4
+
+No necesita base de datos: mide solo el costo de check_password, que es
+lo que domina un login.
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from werkzeug.security import generate_password_hash, check_password_hash  # noqa: E402
+from hashing import ProcesadorHash  # noqa: E402
+
+
+def medir(funcion, logins, concurrencia):
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrencia) as hilos:
+        resultados = list(hilos.map(lambda _: funcion(), range(logins)))
+    duracion = time.perf_counter() - inicio
+    assert all(resultados), 'alguna verificación falló'
+    return logins / duracion
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--metodo', default='scrypt', help='Política de hash de Werkzeug (scrypt).')
+    parser.add_argument('--logins', type=int, default=100, help='Verificaciones por escenario (100).')
+    parser.add_argument('--procesos', type=int, default=os.cpu_count() or 1, help='Procesos del pool (núcleos).')
+    parser.add_argument('--concurrencia', type=int, default=32, help='Requests simultáneas simuladas (32).')
+    args = parser.parse_args()
+
+    clave = 'ClaveDePrueba123'
+    hash_ = generate_password_hash(clave, args.metodo)
+    print(f"Política: {hash_.split('$', 1)[0]} | núcleos: {os.cpu_count()} | "
+          f"procesos del pool: {args.procesos} | logins: {args.logins}")
+
+    # 1. En el hilo de la request (como antes): el GIL serializa casi todo
+    en_hilo = medir(lambda: check_password_hash(hash_, clave), args.logins, args.concurrencia)
+    print(f"En el hilo:        {en_hilo:8.1f} logins/s")
+
+    # 2. En el pool de procesos
+    procesador = ProcesadorHash()
+    procesador.init_app(SimpleNamespace(config={'HASH_PROCESOS': args.procesos, 'HASH_METODO': args.metodo,
+                                                'HASH_COLA_MAX': args.concurrencia * 2}))
+    procesador.verificar(hash_, clave)  # Arranque de los procesos fuera de la medición
+    en_pool = medir(lambda: procesador.verificar(hash_, clave), args.logins, args.concurrencia)
+    procesador.cerrar()
+    print(f"Pool de procesos:  {en_pool:8.1f} logins/s  "
+          f"({en_pool / max(args.procesos, 1):.1f} por núcleo, x{en_pool / en_hilo:.2f})")
+
+
+if __name__ == '__main__':
+    main()
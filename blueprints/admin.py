@@ -1,15 +1,34 @@
 import os
-import io
-from openpyxl import Workbook
-from openpyxl.styles import Font
-from flask import Blueprint, render_template, request, redirect, url_for, flash, current_app, make_response
+import tempfile
+from flask import (Blueprint, render_template, request, redirect, url_for, flash, Response, abort, send_file,
+                   jsonify, stream_with_context)
 from flask_login import login_required, current_user
 from sqlalchemy import or_
-from werkzeug.security import generate_password_hash
+from sqlalchemy.orm import joinedload
 from werkzeug.utils import secure_filename
-from datetime import datetime
-from models import db, Usuario, Rol, Log, Dashboard, Grupo
+from datetime import datetime, timedelta
+from models import (db, Usuario, Rol, Log, Dashboard, Grupo, CorreoPendiente, ExportacionLogs,
+                    ProgramacionExportacion, obtener_hora_chile)
 from utils import registrar_log, admin_required
+from cache_usuarios import cache_usuarios
+from permisos import sincronizar_permisos
+from importacion_usuarios import leer_archivo, validar, importar, ErrorArchivo
+from buscador import indice_busqueda
+from fragmentos import cache_fragmentos
+from exportacion_logs import leer_filtros, filtrar_logs, iterar_filas, escribir_xlsx
+from paginacion import paginar_por_cursor
+from uso_dashboards import consultar_uso
+from retencion_logs import meses_archivados, paginar_archivo, iterar_filas_archivo
+from correos import despachador_correos, ESTADOS as ESTADOS_CORREO
+from exportaciones import gestor_exportaciones, proxima_ejecucion, FORMATOS, FRECUENCIAS
+from imagenes import procesador_imagenes, ErrorImagen
+from metricas import metricas as metricas_app
+from auditoria import escritor_logs
+from cambios_logs import cambios_logs, FORMATOS as FORMATOS_CAMBIOS
+from base_datos import solo_lectura
+from identidad import proveedor_identidad, ErrorIdentidad
+from hashing import HashOcupado
+from eventos import acciones_registradas, ENTIDADES
 
 admin_bp = Blueprint('admin', __name__, template_folder='../templates', url_prefix='/admin')
 
@@ -81,24 +100,38 @@ def crear_usuario():
         # Checkbox devuelve '1' si está marcado, o nada si no
         forzar_cambio = request.form.get('forzar_cambio_clave') == '1'
 
+        # Guardamos lo que el usuario escribió para devolverlo si algo falla
+        datos_previos = {
+            'nombre_completo': nombre,
+            'email': email,
+            'rol_id': int(rol_id) if rol_id else None,
+            'permisos_grupos': [int(x) for x in request.form.getlist('permisos_grupos')], # Lista de IDs
+            'permisos_dashboards': [int(x) for x in request.form.getlist('permisos_dashboards')]
+        }
+
         # 1. VALIDACIÓN: Correo Duplicado
         if Usuario.query.filter_by(email=email).first():
             flash('Error: El correo electrónico ya está registrado en el sistema.', 'danger')
-            # Guardamos lo que el usuario escribió para devolverlo
-            datos_previos = {
-                'nombre_completo': nombre,
-                'email': email,
-                'rol_id': int(rol_id) if rol_id else None,
-                'permisos_grupos': [int(x) for x in request.form.getlist('permisos_grupos')], # Lista de IDs
-                'permisos_dashboards': [int(x) for x in request.form.getlist('permisos_dashboards')]
-            }
-            
             return render_template('crear_usuario.html', 
                                    roles=roles, 
                                    grupos=todos_grupos, 
                                    dashboards=todos_dashboards,
                                    datos_previos=datos_previos)
 
+        # Con identidad global la clave no se define aquí: la persona ya existe allá y entra con esa
+        identidad = None
+        if proveedor_identidad.global_:
+            try:
+                identidad = proveedor_identidad.buscar(email)
+            except ErrorIdentidad:
+                flash('No fue posible consultar la BD de identidad global. Intenta nuevamente en unos minutos.', 'warning')
+                return render_template('crear_usuario.html', roles=roles, grupos=todos_grupos,
+                                       dashboards=todos_dashboards, datos_previos=datos_previos), 503
+            if identidad is None:
+                flash(f'Error: {email} no existe en la BD de identidad global. Créalo allí primero.', 'danger')
+                return render_template('crear_usuario.html', roles=roles, grupos=todos_grupos,
+                                       dashboards=todos_dashboards, datos_previos=datos_previos)
+
         # 2. Crear Usuario
         nuevo_usuario = Usuario(
             nombre_completo=nombre,
@@ -107,25 +140,30 @@ def crear_usuario():
             cambio_clave_requerido=forzar_cambio,
             activo=True
         )
-        nuevo_usuario.set_password(password)
-        
-        # 3. ASIGNAR PERMISOS (Solo si es rol Lector, aunque el admin ve todo por defecto en el código)
-        grupos_ids = request.form.getlist('permisos_grupos')
-        dashboards_ids = request.form.getlist('permisos_dashboards')
-
-        for gid in grupos_ids:
-            grupo = Grupo.query.get(int(gid))
-            if grupo: nuevo_usuario.grupos_permitidos.append(grupo)
-        
-        for did in dashboards_ids:
-            dash = Dashboard.query.get(int(did))
-            if dash: nuevo_usuario.dashboards_permitidos.append(dash)
+        if identidad is not None:
+            # Copia local de la clave global (la sincronización la mantiene al día)
+            nuevo_usuario.password_hash = identidad.password_hash
+        else:
+            try:
+                nuevo_usuario.set_password(password)
+            except HashOcupado as e:
+                flash('El sistema está ocupado. Intenta nuevamente en unos segundos.', 'warning')
+                return render_template('crear_usuario.html', roles=roles, grupos=todos_grupos,
+                                       dashboards=todos_dashboards, datos_previos=datos_previos), \
+                    503, {'Retry-After': str(e.reintentar_en)}
         
         try:
             db.session.add(nuevo_usuario)
+            db.session.flush()  # Necesitamos el ID para las tablas de permisos
+
+            # 3. ASIGNAR PERMISOS (Solo si es rol Lector, aunque el admin ve todo por defecto en el código)
+            sincronizar_permisos(nuevo_usuario,
+                                 request.form.getlist('permisos_grupos'),
+                                 request.form.getlist('permisos_dashboards'))
             db.session.commit()
 
-            registrar_log("Creación de Usuario", f"Creó al usuario {nombre} ({email}) con permisos asignados.")
+            registrar_log("usuario.creacion", f"Creó al usuario {nombre} ({email}) con permisos asignados.",
+                          entidad='usuario', entidad_id=nuevo_usuario.id, datos={'rol_id': nuevo_usuario.rol_id})
             flash('Usuario creado con éxito.', 'success')
             return redirect(url_for('admin.panel'))
         except Exception as e:
@@ -134,6 +172,54 @@ def crear_usuario():
 
     return render_template('crear_usuario.html', roles=roles, grupos=todos_grupos, dashboards=todos_dashboards)
 
+@admin_bp.route('/importar_usuarios', methods=['GET', 'POST'])
+@login_required
+@admin_required
+def importar_usuarios():
+    if request.method == 'POST':
+        archivo = request.files.get('archivo')
+        clave_inicial = request.form.get('clave_inicial', '').strip() or None
+        solo_validar = request.form.get('solo_validar') == '1'
+
+        if not archivo or archivo.filename == '':
+            flash('Selecciona un archivo CSV o XLSX.', 'danger')
+            return redirect(url_for('admin.importar_usuarios'))
+
+        # 1. Leer y validar todo en memoria (una consulta IN por tipo de dato)
+        try:
+            registros = leer_archivo(archivo.filename, archivo.read())
+        except ErrorArchivo as e:
+            flash(f'Error: {e}', 'danger')
+            return redirect(url_for('admin.importar_usuarios'))
+        except Exception as e:
+            flash(f'No se pudo leer el archivo: {str(e)}', 'danger')
+            return redirect(url_for('admin.importar_usuarios'))
+
+        listos, errores = validar(registros, clave_inicial)
+
+        # 2. Si hay errores no se importa nada: se muestra el reporte por fila
+        if errores or solo_validar:
+            if not errores:
+                flash(f'Archivo válido: {len(listos)} usuarios listos para importar.', 'success')
+            return render_template('importar_usuarios.html', errores=errores,
+                                   total=len(registros), validos=len(listos))
+
+        # 3. Inserción masiva en una sola transacción
+        try:
+            usuarios, n_grupos, n_dashboards = importar(listos, clave_inicial)
+        except Exception as e:
+            flash(f'Error al importar: {str(e)}', 'danger')
+            return redirect(url_for('admin.importar_usuarios'))
+
+        registrar_log("usuario.importacion",
+                      f"Importó {usuarios} usuarios desde '{secure_filename(archivo.filename)}' "
+                      f"({n_grupos} permisos de grupo, {n_dashboards} de panel).",
+                      datos={'usuarios': usuarios, 'permisos_grupo': n_grupos, 'permisos_dashboard': n_dashboards})
+        flash(f'Se importaron {usuarios} usuarios con éxito.', 'success')
+        return redirect(url_for('admin.panel'))
+
+    return render_template('importar_usuarios.html')
+
 @admin_bp.route('/editar_usuario/<int:id>', methods=['GET', 'POST'])
 @login_required
 def editar_usuario(id):
@@ -162,29 +248,32 @@ def editar_usuario(id):
         # 3. Actualizar Contraseña (Si aplica)
         password = request.form.get('password')
         if password and password.strip():
-            usuario_a_editar.set_password(password)
+            # Con identidad global se escribe allá: es donde se valida el login
+            try:
+                proveedor_identidad.cambiar_clave(usuario_a_editar, password)
+            except ErrorIdentidad:
+                db.session.rollback()
+                flash('No fue posible guardar la nueva contraseña en este momento. Intenta nuevamente en unos minutos.', 'warning')
+                return render_template('editar_usuario.html', usuario=usuario_a_editar, roles=roles,
+                                       grupos=todos_grupos, dashboards=todos_dashboards), 503
+            except HashOcupado as e:
+                db.session.rollback()
+                flash('El sistema está ocupado. Intenta nuevamente en unos segundos.', 'warning')
+                return render_template('editar_usuario.html', usuario=usuario_a_editar, roles=roles,
+                                       grupos=todos_grupos, dashboards=todos_dashboards), \
+                    503, {'Retry-After': str(e.reintentar_en)}
             flash('Contraseña actualizada.', 'info')
 
-        # 4. ACTUALIZAR PERMISOS
-        # Limpiamos todo primero
-        usuario_a_editar.grupos_permitidos = []
-        usuario_a_editar.dashboards_permitidos = []
-
-        # Obtenemos lo nuevo del form
-        grupos_ids = request.form.getlist('permisos_grupos')
-        dashboards_ids = request.form.getlist('permisos_dashboards')
-
-        for gid in grupos_ids:
-            grupo = Grupo.query.get(int(gid))
-            if grupo: usuario_a_editar.grupos_permitidos.append(grupo)
-        
-        for did in dashboards_ids:
-            dash = Dashboard.query.get(int(did))
-            if dash: usuario_a_editar.dashboards_permitidos.append(dash)
-
         try:
+            # 4. ACTUALIZAR PERMISOS (solo se agregan/quitan las diferencias)
+            cambios = sincronizar_permisos(usuario_a_editar,
+                                           request.form.getlist('permisos_grupos'),
+                                           request.form.getlist('permisos_dashboards'))
             db.session.commit()
-            registrar_log("Edición de Usuario", f"Editó datos y permisos de {usuario_a_editar.nombre_completo}")
+            cache_usuarios.invalidar(usuario_a_editar.id)
+            detalle = f"permisos: {cambios.resumen()}" if cambios.hay_cambios else "sin cambios de permisos"
+            registrar_log("usuario.edicion", f"Editó datos de {usuario_a_editar.nombre_completo} ({detalle})",
+                          entidad='usuario', entidad_id=usuario_a_editar.id)
             flash('Usuario actualizado con éxito.', 'success')
             return redirect(url_for('admin.panel'))
             
@@ -206,12 +295,14 @@ def toggle_activo(id):
         
     usuario.activo = not usuario.activo
     db.session.commit()
+    cache_usuarios.invalidar(usuario.id)
     
     estado = "activado" if usuario.activo else "desactivado"
 
     registrar_log(
-        accion="Cambio de Estado",
-        detalles=f"Usuario {usuario.nombre_completo} fue {estado}."
+        accion="usuario.estado",
+        detalles=f"Usuario {usuario.nombre_completo} fue {estado}.",
+        entidad='usuario', entidad_id=usuario.id, datos={'activo': usuario.activo}
     )
 
     flash(f'Usuario {usuario.nombre_completo} {estado}.', 'success')
@@ -219,52 +310,285 @@ def toggle_activo(id):
 
 @admin_bp.route('/ver_logs')
 @login_required
+@solo_lectura
 def ver_logs():
-    page = request.args.get('page', 1, type=int)
-    
-    # Capturamos los filtros de la URL
-    usuario_filtro_id = request.args.get('usuario_id', '')
-    accion_filtro = request.args.get('accion', '')
-
-    # Ordenamos por fecha descendente (lo más nuevo primero)
-    query = Log.query.order_by(Log.timestamp.desc())
-
-    # Aplicamos filtros si existen
-    if usuario_filtro_id:
-        query = query.filter(Log.usuario_id == usuario_filtro_id)
-    if accion_filtro:
-        query = query.filter(Log.accion == accion_filtro)
-        
-    # Paginación
-    pagination = query.paginate(page=page, per_page=15, error_out=False)
+    # Capturamos los filtros de la URL (los mismos que usa la exportación)
+    filtros = leer_filtros(request.args)
+    meses_archivo = meses_archivados()
+    mes_archivo = request.args.get('archivo', '')
+    opciones_pagina = dict(
+        por_pagina=15,
+        siguiente=request.args.get('siguiente'),
+        anterior=request.args.get('anterior'),
+        contar=request.args.get('contar') == '1'
+    )
+
+    # Paginación por cursor sobre (timestamp, id): lo más nuevo primero y sin OFFSET.
+    # El total exacto es opcional porque obliga a contar toda la tabla filtrada.
+    if mes_archivo in meses_archivo:
+        # Mes que ya salió de la tabla: se lee desde su archivo comprimido
+        pagination = paginar_archivo(mes_archivo, filtros, **opciones_pagina)
+    else:
+        mes_archivo = ''
+        pagination = paginar_por_cursor(filtrar_logs(Log.query, filtros), Log.timestamp, Log.id, **opciones_pagina)
     
-    # Datos para los selectores (Dropdowns)
-    todos_los_usuarios = Usuario.query.all()
-    todos_los_usuarios.sort(key=lambda u: u.nombre_completo)
+    # Datos para los selectores (Dropdowns): solo id y nombre, sin cargar objetos completos
+    todos_los_usuarios = db.session.query(Usuario.id, Usuario.nombre_completo) \
+                                   .order_by(Usuario.nombre_completo).all()
     
-    # Lista manual de las acciones que hemos programado en este sistema
-    acciones_posibles = [
-        "Inicio de Sesión",
-        "Cierre de Sesión",
-        "Creación de Usuario",
-        "Edición de Usuario",
-        "Cambio de Estado" # (Activar/Desactivar)
-    ]
+    # Las acciones que ya aparecen en los logs (DISTINCT sobre el índice de acción, en caché)
+    acciones_posibles = acciones_registradas()
     
     # Pasamos los filtros actuales para mantener seleccionada la opción en el HTML
     filtros_actuales = {
-        'usuario_id': usuario_filtro_id,
-        'accion': accion_filtro
+        'usuario_id': request.args.get('usuario_id', ''),
+        'accion': filtros['accion'] or '',
+        'entidad': filtros['entidad'] or '',
+        'entidad_id': filtros['entidad_id'] if filtros['entidad_id'] is not None else '',
+        'fecha_desde': request.args.get('fecha_desde', ''),
+        'fecha_hasta': request.args.get('fecha_hasta', ''),
+        'archivo': mes_archivo
     }
 
     return render_template('ver_logs.html',
                         pagination=pagination,
                         todos_los_usuarios=todos_los_usuarios,
                         acciones_posibles=acciones_posibles,
+                        entidades=ENTIDADES,
+                        meses_archivo=meses_archivo,
                         filtros=filtros_actuales)
 
+@admin_bp.route('/uso_paneles')
+@login_required
+@admin_required
+@solo_lectura
+def uso_paneles():
+    # Rango de fechas (por defecto, los últimos 30 días)
+    hoy = obtener_hora_chile().date()
+    try:
+        hasta = datetime.strptime(request.args.get('fecha_hasta', ''), '%Y-%m-%d').date()
+    except ValueError:
+        hasta = hoy
+    try:
+        desde = datetime.strptime(request.args.get('fecha_desde', ''), '%Y-%m-%d').date()
+    except ValueError:
+        desde = hasta - timedelta(days=29)
+    if desde > hasta:
+        desde, hasta = hasta, desde
+
+    # Solo se leen los contadores pre-agregados, nunca la tabla de logs
+    uso = consultar_uso(desde, hasta)
+
+    # Cruzamos con el catálogo para mostrar también los paneles sin vistas
+    dashboards = Dashboard.query.options(joinedload(Dashboard.grupo)).all()
+    filas = [(d, *uso.get(d.id, (0, 0))) for d in dashboards]
+    filas.sort(key=lambda f: (-f[1], f[0].titulo))
+
+    return render_template('admin_uso_paneles.html',
+                           filas=filas,
+                           total_vistas=sum(f[1] for f in filas),
+                           fecha_desde=desde.isoformat(),
+                           fecha_hasta=hasta.isoformat())
+
+# --- MÉTRICAS (formato Prometheus) ---
+
+@admin_bp.route('/metricas')
+def metricas():
+    # Un admin con sesión, o Prometheus con 'Authorization: Bearer <METRICAS_TOKEN>'
+    if not metricas_app.token_valido(request.headers.get('Authorization')):
+        if not current_user.is_authenticated or current_user.rol.nombre != 'Admin':
+            abort(403)
+
+    extras = [
+        ('sistema_fragmentos_aciertos_total', 'counter', 'Aciertos de la caché de fragmentos HTML.',
+         cache_fragmentos.aciertos),
+        ('sistema_fragmentos_fallos_total', 'counter', 'Fallos de la caché de fragmentos HTML.',
+         cache_fragmentos.fallos),
+        ('sistema_logs_descartados_total', 'counter', 'Logs de auditoría descartados con la cola llena.',
+         escritor_logs.descartados),
+        ('sistema_logs_perdidos_total', 'counter', 'Logs de auditoría que no se pudieron insertar.',
+         escritor_logs.perdidos),
+    ]
+    return Response(metricas_app.exportar(extras), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+# --- API INCREMENTAL DE LOGS (BI) ---
+
+@admin_bp.route('/api/logs')
+@solo_lectura
+def api_logs():
+    # Un admin con sesión, o la carga de BI con 'Authorization: Bearer <LOGS_CAMBIOS_TOKEN>'
+    if not cambios_logs.token_valido(request.headers.get('Authorization')):
+        if not current_user.is_authenticated or current_user.rol.nombre != 'Admin':
+            abort(403)
+
+    formato = request.args.get('formato', 'ndjson')
+    if formato not in FORMATOS_CAMBIOS:
+        return jsonify(error=f"Formato no soportado; usa {' o '.join(FORMATOS_CAMBIOS)}."), 400
+    try:
+        tramo = cambios_logs.preparar(request.args.get('desde'), request.args.get('limite', type=int))
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+
+    # El cursor va en headers porque se conoce antes de empezar a transmitir las filas
+    response = Response(stream_with_context(cambios_logs.transmitir(tramo, formato)),
+                        mimetype=FORMATOS_CAMBIOS[formato])
+    response.headers['X-Cursor-Siguiente'] = cambios_logs.cursor_siguiente(tramo)
+    response.headers['X-Hay-Mas'] = '1' if tramo.hay_mas else '0'
+    return response
+
+# --- COLA DE CORREOS ---
+
+@admin_bp.route('/correos')
+@login_required
+@admin_required
+def ver_correos():
+    estado = request.args.get('estado', '')
+    consulta = CorreoPendiente.query
+    if estado in ESTADOS_CORREO:
+        consulta = consulta.filter(CorreoPendiente.estado == estado)
+    # Los últimos 100 bastan para revisar; la cola completa se ve en los conteos
+    correos = consulta.order_by(CorreoPendiente.id.desc()).limit(100).all()
+
+    return render_template('admin_correos.html',
+                           correos=correos,
+                           resumen=despachador_correos.resumen(),
+                           estados=ESTADOS_CORREO,
+                           estado_actual=estado)
+
+@admin_bp.route('/correos/<int:id>/reintentar', methods=['POST'])
+@login_required
+@admin_required
+def reintentar_correo(id):
+    if despachador_correos.reintentar(id):
+        registrar_log("correo.reintento", f"Reencoló el correo #{id}.", entidad='correo', entidad_id=id)
+        flash('Correo puesto en cola nuevamente.', 'success')
+    else:
+        flash('Solo se pueden reintentar correos fallidos.', 'warning')
+    return redirect(url_for('admin.ver_correos', estado=request.args.get('estado', '')))
+
+# --- EXPORTACIONES EN SEGUNDO PLANO ---
+
+@admin_bp.route('/exportaciones')
+@login_required
+@admin_required
+def ver_exportaciones():
+    exportaciones = ExportacionLogs.query.options(joinedload(ExportacionLogs.usuario)) \
+                                         .order_by(ExportacionLogs.id.desc()).limit(50).all()
+    programaciones = ProgramacionExportacion.query.order_by(ProgramacionExportacion.nombre).all()
+    # Último archivo listo de cada programación, para descargarlo directo
+    ultimas = {}
+    for exportacion in ExportacionLogs.query.filter(ExportacionLogs.programacion_id.isnot(None),
+                                                    ExportacionLogs.estado == 'lista') \
+                                            .order_by(ExportacionLogs.id):
+        ultimas[exportacion.programacion_id] = exportacion
+    en_curso = any(e.estado in ('pendiente', 'procesando') for e in exportaciones)
+
+    return render_template('admin_exportaciones.html',
+                           exportaciones=exportaciones,
+                           programaciones=programaciones,
+                           ultimas=ultimas,
+                           en_curso=en_curso,
+                           resumen=gestor_exportaciones.resumen(),
+                           formatos=FORMATOS,
+                           frecuencias=FRECUENCIAS,
+                           todos_los_usuarios=db.session.query(Usuario.id, Usuario.nombre_completo)
+                                                        .order_by(Usuario.nombre_completo).all())
+
+@admin_bp.route('/exportaciones', methods=['POST'])
+@login_required
+@admin_required
+def solicitar_exportacion():
+    formato = request.form.get('formato', 'xlsx')
+    if formato not in FORMATOS:
+        flash('Formato de exportación no válido.', 'danger')
+        return redirect(url_for('admin.ver_logs'))
+    # Los mismos filtros que ver_logs y exportar_logs_xlsx
+    exportacion_id = gestor_exportaciones.solicitar(formato, request.form.to_dict(), usuario_id=current_user.id)
+    registrar_log("exportacion.solicitud", f"Solicitó la exportación #{exportacion_id} ({formato.upper()}).",
+                  entidad='exportacion', entidad_id=exportacion_id, datos={'formato': formato})
+    flash('El reporte se está generando. Puedes seguir su avance y descargarlo desde aquí.', 'info')
+    return redirect(url_for('admin.ver_exportaciones'))
+
+@admin_bp.route('/exportaciones/<int:id>/descargar')
+@login_required
+@admin_required
+def descargar_exportacion(id):
+    exportacion = ExportacionLogs.query.get_or_404(id)
+    ruta = gestor_exportaciones.ruta(exportacion)
+    if ruta is None:
+        flash('El archivo no está disponible (aún no termina o ya venció).', 'warning')
+        return redirect(url_for('admin.ver_exportaciones'))
+    return send_file(ruta, mimetype=FORMATOS[exportacion.formato][1], as_attachment=True,
+                     download_name=f'reporte_logs_{exportacion.id}.{exportacion.formato}')
+
+@admin_bp.route('/exportaciones/programaciones', methods=['POST'])
+@login_required
+@admin_required
+def crear_programacion():
+    nombre = request.form.get('nombre', '').strip()
+    frecuencia = request.form.get('frecuencia', 'mensual')
+    formato = request.form.get('formato', 'xlsx')
+    hora = request.form.get('hora', 3, type=int)
+    usuario_id = request.form.get('usuario_id', type=int)
+    if not nombre or frecuencia not in FRECUENCIAS or formato not in FORMATOS or hora is None or not 0 <= hora <= 23:
+        flash('Revisa los datos de la programación.', 'danger')
+        return redirect(url_for('admin.ver_exportaciones'))
+
+    programacion = ProgramacionExportacion(
+        nombre=nombre, frecuencia=frecuencia, formato=formato, hora=hora,
+        accion=request.form.get('accion', '').strip() or None, usuario_id=usuario_id or None,
+        proxima_ejecucion=proxima_ejecucion(frecuencia, hora, obtener_hora_chile()),
+    )
+    db.session.add(programacion)
+    db.session.commit()
+    registrar_log("programacion.creacion", f"Programó el reporte '{nombre}' ({frecuencia}, {formato.upper()}).",
+                  entidad='programacion', entidad_id=programacion.id,
+                  datos={'frecuencia': frecuencia, 'formato': formato})
+    flash(f"Reporte programado. Primera ejecución: {programacion.proxima_ejecucion.strftime('%d-%m-%Y %H:%M')}.",
+          'success')
+    return redirect(url_for('admin.ver_exportaciones'))
+
+@admin_bp.route('/exportaciones/programaciones/<int:id>/estado', methods=['POST'])
+@login_required
+@admin_required
+def cambiar_estado_programacion(id):
+    programacion = ProgramacionExportacion.query.get_or_404(id)
+    programacion.activa = not programacion.activa
+    if programacion.activa:
+        # Al reactivarla no se generan los períodos que pasaron mientras estuvo pausada
+        programacion.proxima_ejecucion = proxima_ejecucion(programacion.frecuencia, programacion.hora,
+                                                           obtener_hora_chile())
+    db.session.commit()
+    estado = 'activada' if programacion.activa else 'pausada'
+    registrar_log("programacion.edicion", f"Programación '{programacion.nombre}' {estado}.",
+                  entidad='programacion', entidad_id=id, datos={'activa': programacion.activa})
+    flash(f'Programación {estado}.', 'success')
+    return redirect(url_for('admin.ver_exportaciones'))
+
+@admin_bp.route('/exportaciones/programaciones/<int:id>/eliminar', methods=['POST'])
+@login_required
+@admin_required
+def eliminar_programacion(id):
+    programacion = ProgramacionExportacion.query.get_or_404(id)
+    nombre = programacion.nombre
+    # Los reportes ya generados se conservan hasta su vencimiento
+    ExportacionLogs.query.filter_by(programacion_id=id).update({'programacion_id': None})
+    db.session.delete(programacion)
+    db.session.commit()
+    registrar_log("programacion.eliminacion", f"Eliminó la programación '{nombre}'.",
+                  entidad='programacion', entidad_id=id)
+    flash('Programación eliminada.', 'success')
+    return redirect(url_for('admin.ver_exportaciones'))
+
 # --- GESTIÓN DE DASHBOARDS ---
 
+def _guardar_imagen_subida():
+    """Guarda la imagen del formulario si viene una. Devuelve su nombre en static/ o None."""
+    file = request.files.get('imagen')
+    if not file or file.filename == '':
+        return None
+    return procesador_imagenes.guardar(file)
+
 @admin_bp.route('/dashboards')
 @login_required
 @admin_required
@@ -283,15 +607,12 @@ def crear_dashboard():
         grupo_id = request.form.get('grupo_id')
         orden = request.form.get('orden')
         
-        # Manejo de Imagen
-        imagen_filename = None
-        if 'imagen' in request.files:
-            file = request.files['imagen']
-            if file and file.filename != '':
-                filename = secure_filename(file.filename)
-                # Guardamos en static
-                file.save(os.path.join(current_app.root_path, 'static', filename))
-                imagen_filename = filename
+        # Manejo de Imagen (se guarda por hash; las variantes se generan en segundo plano)
+        try:
+            imagen_filename = _guardar_imagen_subida()
+        except ErrorImagen as e:
+            flash(f'Error en la imagen: {e}', 'danger')
+            return redirect(url_for('admin.crear_dashboard'))
 
         nuevo_dash = Dashboard(
             titulo=titulo,
@@ -305,8 +626,11 @@ def crear_dashboard():
         
         db.session.add(nuevo_dash)
         db.session.commit()
+        indice_busqueda.actualizar_dashboard(nuevo_dash)
+        cache_fragmentos.invalidar()
         
-        registrar_log("Creación Dashboard", f"Creó el dashboard '{titulo}'")
+        registrar_log("dashboard.creacion", f"Creó el dashboard '{titulo}'",
+                      entidad='dashboard', entidad_id=nuevo_dash.id)
         flash('Dashboard creado con éxito.', 'success')
         return redirect(url_for('admin.admin_dashboards'))
 
@@ -320,6 +644,12 @@ def editar_dashboard(id):
     dashboard = Dashboard.query.get_or_404(id)
     
     if request.method == 'POST':
+        try:
+            imagen_filename = _guardar_imagen_subida()
+        except ErrorImagen as e:
+            flash(f'Error en la imagen: {e}', 'danger')
+            return redirect(url_for('admin.editar_dashboard', id=id))
+
         dashboard.titulo = request.form.get('titulo')
         dashboard.descripcion = request.form.get('descripcion')
         dashboard.url_iframe = request.form.get('url_iframe')
@@ -327,15 +657,14 @@ def editar_dashboard(id):
         dashboard.orden = request.form.get('orden')
         
         # Manejo de Imagen (Solo si se sube una nueva)
-        if 'imagen' in request.files:
-            file = request.files['imagen']
-            if file and file.filename != '':
-                filename = secure_filename(file.filename)
-                file.save(os.path.join(current_app.root_path, 'static', filename))
-                dashboard.imagen_preview = filename
+        if imagen_filename:
+            dashboard.imagen_preview = imagen_filename
 
         db.session.commit()
-        registrar_log("Edición Dashboard", f"Editó el dashboard '{dashboard.titulo}'")
+        indice_busqueda.actualizar_dashboard(dashboard)
+        cache_fragmentos.invalidar()
+        registrar_log("dashboard.edicion", f"Editó el dashboard '{dashboard.titulo}'",
+                      entidad='dashboard', entidad_id=dashboard.id)
         flash('Dashboard actualizado.', 'success')
         return redirect(url_for('admin.admin_dashboards'))
 
@@ -349,9 +678,12 @@ def toggle_dashboard(id):
     dashboard = Dashboard.query.get_or_404(id)
     dashboard.activo = not dashboard.activo
     db.session.commit()
+    indice_busqueda.actualizar_dashboard(dashboard)
+    cache_fragmentos.invalidar()
     
     estado = "activado" if dashboard.activo else "desactivado"
-    registrar_log("Cambio Estado Dashboard", f"El dashboard '{dashboard.titulo}' fue {estado}.")
+    registrar_log("dashboard.estado", f"El dashboard '{dashboard.titulo}' fue {estado}.",
+                  entidad='dashboard', entidad_id=dashboard.id, datos={'activo': dashboard.activo})
     
     flash(f'Dashboard "{dashboard.titulo}" {estado}.', 'success')
     return redirect(url_for('admin.admin_dashboards'))
@@ -373,15 +705,12 @@ def crear_grupo():
         nombre = request.form.get('nombre')
         orden = request.form.get('orden')
         
-        # Manejo de Imagen
-        imagen_filename = None
-        if 'imagen' in request.files:
-            file = request.files['imagen']
-            if file and file.filename != '':
-                filename = secure_filename(file.filename)
-                # Guardamos en static
-                file.save(os.path.join(current_app.root_path, 'static', filename))
-                imagen_filename = filename
+        # Manejo de Imagen (se guarda por hash; las variantes se generan en segundo plano)
+        try:
+            imagen_filename = _guardar_imagen_subida()
+        except ErrorImagen as e:
+            flash(f'Error en la imagen: {e}', 'danger')
+            return redirect(url_for('admin.crear_grupo'))
 
         nuevo_grupo = Grupo(
             nombre=nombre,
@@ -392,8 +721,10 @@ def crear_grupo():
         
         db.session.add(nuevo_grupo)
         db.session.commit()
+        indice_busqueda.actualizar_grupo(nuevo_grupo)
+        cache_fragmentos.invalidar()
         
-        registrar_log("Creación Grupo", f"Creó el grupo '{nombre}'")
+        registrar_log("grupo.creacion", f"Creó el grupo '{nombre}'", entidad='grupo', entidad_id=nuevo_grupo.id)
         flash('Grupo creado con éxito.', 'success')
         return redirect(url_for('admin.admin_grupos'))
 
@@ -406,19 +737,23 @@ def editar_grupo(id):
     grupo = Grupo.query.get_or_404(id)
     
     if request.method == 'POST':
+        try:
+            imagen_filename = _guardar_imagen_subida()
+        except ErrorImagen as e:
+            flash(f'Error en la imagen: {e}', 'danger')
+            return redirect(url_for('admin.editar_grupo', id=id))
+
         grupo.nombre = request.form.get('nombre')
         grupo.orden = request.form.get('orden')
         
         # Manejo de Imagen (Solo si suben una nueva)
-        if 'imagen' in request.files:
-            file = request.files['imagen']
-            if file and file.filename != '':
-                filename = secure_filename(file.filename)
-                file.save(os.path.join(current_app.root_path, 'static', filename))
-                grupo.imagen = filename
+        if imagen_filename:
+            grupo.imagen = imagen_filename
 
         db.session.commit()
-        registrar_log("Edición Grupo", f"Editó el grupo '{grupo.nombre}'")
+        indice_busqueda.actualizar_grupo(grupo)
+        cache_fragmentos.invalidar()
+        registrar_log("grupo.edicion", f"Editó el grupo '{grupo.nombre}'", entidad='grupo', entidad_id=grupo.id)
         flash('Grupo actualizado.', 'success')
         return redirect(url_for('admin.admin_grupos'))
 
@@ -431,9 +766,12 @@ def toggle_grupo(id):
     grupo = Grupo.query.get_or_404(id)
     grupo.activo = not grupo.activo
     db.session.commit()
+    indice_busqueda.actualizar_grupo(grupo)
+    cache_fragmentos.invalidar()
     
     estado = "activado" if grupo.activo else "desactivado"
-    registrar_log("Cambio Estado Grupo", f"El grupo '{grupo.nombre}' fue {estado}.")
+    registrar_log("grupo.estado", f"El grupo '{grupo.nombre}' fue {estado}.",
+                  entidad='grupo', entidad_id=grupo.id, datos={'activo': grupo.activo})
     
     flash(f'Grupo "{grupo.nombre}" {estado}.', 'success')
     return redirect(url_for('admin.admin_grupos'))
@@ -441,57 +779,47 @@ def toggle_grupo(id):
 @admin_bp.route('/exportar_logs_xlsx')
 @login_required
 @admin_required
+@solo_lectura
 def exportar_logs_xlsx():
-    # 1. Obtenemos todos los logs ordenados por fecha (más reciente primero)
-    logs = Log.query.order_by(Log.timestamp.desc()).all()
-
-    # 2. Creamos un libro de Excel en memoria
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Logs"
-
-    # 3. Definimos los encabezados de la hoja
-    headers = ['ID', 'Fecha y Hora', 'Usuario', 'Acción', 'Detalles']
-    ws.append(headers)
-
-    # 4. Aplicamos estilo en negrita a la fila de encabezados
-    for cell in ws[1]:
-        cell.font = Font(bold=True)
-
-    # 5. Escribimos los datos de cada log en la hoja
-    for log in logs:
-        ws.append([
-            log.id,
-            log.timestamp.strftime('%d-%m-%Y %H:%M:%S'),
-            log.usuario_nombre,
-            log.accion,
-            log.detalles
-        ])
-
-    # 6. Ajustamos automáticamente el ancho de las columnas
-    for column_cells in ws.columns:
-        max_length = 0
-        column_letter = column_cells[0].column_letter
-
-        for cell in column_cells:
-            if cell.value:
-                max_length = max(max_length, len(str(cell.value)))
-
-        ws.column_dimensions[column_letter].width = max_length + 2
-
-    # 7. Guardamos el archivo Excel en un buffer en memoria
-    output = io.BytesIO()
-    wb.save(output)
-    output.seek(0)
-
-    # 8. Preparamos la respuesta HTTP para descargar el archivo XLSX
-    response = make_response(output.getvalue())
-    response.headers[
-        'Content-Disposition'
-    ] = 'attachment; filename=reporte_logs.xlsx'
-    response.headers[
-        'Content-Type'
-    ] = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-
-    # 9. Retornamos el archivo para su descarga
-    return response
\ No newline at end of file
+    # 1. Filtros opcionales (rango de fechas, usuario, acción) para acotar el reporte
+    filtros = leer_filtros(request.args)
+    mes_archivo = request.args.get('archivo', '')
+    if mes_archivo and mes_archivo in meses_archivados():
+        # Mes archivado: se lee del archivo comprimido, en orden cronológico
+        filas = iterar_filas_archivo(mes_archivo, filtros)
+    else:
+        filas = iterar_filas(filtros)
+
+    # 2. Escribimos el Excel en un archivo temporal, leyendo la BD por lotes
+    #    (modo write-only: la memoria no crece con la cantidad de logs)
+    archivo = tempfile.NamedTemporaryFile(suffix='.xlsx', delete=False)
+    archivo.close()
+    try:
+        escribir_xlsx(filas, archivo.name)
+    except Exception:
+        os.remove(archivo.name)
+        raise
+
+    # 3. Enviamos el archivo por partes; se borra al cerrar la respuesta
+    #    (también si el generador nunca arranca: HEAD o cliente que se desconecta)
+    def transmitir():
+        with open(archivo.name, 'rb') as f:
+            while True:
+                bloque = f.read(64 * 1024)
+                if not bloque:
+                    break
+                yield bloque
+
+    def borrar_temporal():
+        try:
+            os.remove(archivo.name)
+        except FileNotFoundError:
+            pass
+
+    response = Response(transmitir(), mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+    response.headers['Content-Disposition'] = 'attachment; filename=reporte_logs.xlsx'
+    response.headers['Content-Length'] = str(os.path.getsize(archivo.name))
+    response.call_on_close(borrar_temporal)
+
+    # 4. Retornamos el archivo para su descarga
+    return response
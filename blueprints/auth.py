@@ -3,24 +3,17 @@ from flask_login import login_user, logout_user, login_required, current_user
 from datetime import datetime, timedelta
 import pytz
 import secrets
-import re
 
 # Importamos modelos y utilidades
 from models import db, Usuario
-from utils import registrar_log, enviar_correo_reseteo
+from utils import registrar_log, enviar_correo_reseteo, es_password_segura
+from cache_usuarios import cache_usuarios
+from hashing import HashOcupado
+from identidad import proveedor_identidad, ErrorIdentidad
+from limites import limitador
 
 auth_bp = Blueprint('auth', __name__, template_folder='../templates')
 
-# --- Función Auxiliar de Validación ---
-def es_password_segura(password):
-    """Valida que la contraseña cumpla con los requisitos de seguridad."""
-    if len(password) < 8:
-        return False
-    if not re.search(r"[A-Z]", password): # Busca al menos una mayúscula
-        return False
-    if not re.search(r"[0-9]", password): # Busca al menos un número
-        return False
-    return True
 
 # --- Lógica de Redirección ---
 def obtener_ruta_redireccion(usuario):
@@ -48,21 +41,39 @@ def login():
     if request.method == 'POST':
         email = request.form.get('email')
         password = request.form.get('password')
+
+        # Límite de intentos por IP y por correo, antes de tocar la BD o calcular hashes
+        espera = limitador.verificar('login', ip=request.remote_addr, email=email)
+        if espera:
+            flash(f'Demasiados intentos de inicio de sesión. Intenta nuevamente en {espera} segundos.', 'danger')
+            return render_template('login.html'), 429
         
-        # Buscamos el usuario
-        usuario = Usuario.query.filter_by(email=email).first()
+        # Validamos contra la identidad local o la global (identidad.py) y autorizamos localmente
+        try:
+            usuario, motivo = proveedor_identidad.autenticar(email, password)
+        except HashOcupado as e:
+            flash('El sistema está recibiendo muchos inicios de sesión. Intenta nuevamente en unos segundos.', 'warning')
+            return render_template('login.html'), 503, {'Retry-After': str(e.reintentar_en)}
+        except ErrorIdentidad:
+            flash('No fue posible validar tus credenciales en este momento. Intenta nuevamente en unos minutos.', 'warning')
+            return render_template('login.html'), 503
 
         # Verificaciones
+        if motivo == 'inactivo':
+            flash('Tu cuenta está desactivada. Contacta al administrador.', 'danger')
+            return redirect(url_for('auth.login'))
+        if motivo == 'sin_acceso':
+            flash('Tu cuenta no tiene acceso a este sistema. Contacta al administrador.', 'danger')
+            return redirect(url_for('auth.login'))
+
         if usuario:
-            if not usuario.activo:
-                flash('Tu cuenta está desactivada. Contacta al administrador.', 'danger')
-                return redirect(url_for('auth.login'))
-        
-        if usuario and usuario.check_password(password):
+            # Forzamos una foto fresca del usuario para la nueva sesión
+            cache_usuarios.invalidar(usuario.id)
             login_user(usuario)
 
             # Log
-            registrar_log("Inicio de Sesión", f"Usuario {usuario.nombre_completo} inició sesión.")
+            registrar_log("sesion.inicio", f"Usuario {usuario.nombre_completo} inició sesión.",
+                          entidad='usuario', entidad_id=usuario.id)
 
             # Verificar si requiere cambio de clave INMEDIATAMENTE
             if usuario.cambio_clave_requerido:
@@ -79,7 +90,8 @@ def login():
 @auth_bp.route('/logout')
 @login_required
 def logout():
-    registrar_log("Cierre de Sesión", f"Usuario {current_user.nombre_completo} cerró sesión.")
+    registrar_log("sesion.cierre", f"Usuario {current_user.nombre_completo} cerró sesión.",
+                  entidad='usuario', entidad_id=current_user.id)
     logout_user()
     flash('Has cerrado sesión correctamente.', 'success')
     return redirect(url_for('auth.login'))
@@ -100,12 +112,24 @@ def cambiar_clave():
             flash('Error: La contraseña debe tener al menos 8 caracteres, una mayúscula y un número.', 'danger')
             return render_template('cambiar_clave.html')
         
-        # Cambiamos la clave
-        current_user.set_password(nueva_password)
-        current_user.cambio_clave_requerido = False # Quitamos el bloqueo
+        # Cambiamos la clave (current_user es una foto inmutable, editamos el modelo real)
+        usuario = db.session.get(Usuario, current_user.id)
+        try:
+            proveedor_identidad.cambiar_clave(usuario, nueva_password)
+        except ErrorIdentidad:
+            db.session.rollback()
+            flash('No fue posible guardar tu nueva contraseña en este momento. Intenta nuevamente en unos minutos.', 'warning')
+            return render_template('cambiar_clave.html'), 503
+        except HashOcupado as e:
+            db.session.rollback()
+            flash('El sistema está ocupado. Intenta nuevamente en unos segundos.', 'warning')
+            return render_template('cambiar_clave.html'), 503, {'Retry-After': str(e.reintentar_en)}
+        usuario.cambio_clave_requerido = False # Quitamos el bloqueo
         db.session.commit()
+        cache_usuarios.invalidar(usuario.id)
         
-        registrar_log("Cambio de Clave", "El usuario actualizó su contraseña obligatoria.")
+        registrar_log("clave.cambio", "El usuario actualizó su contraseña obligatoria.",
+                      entidad='usuario', entidad_id=usuario.id)
         
         flash('Contraseña actualizada. ¡Gracias!', 'success')
         return redirect(obtener_ruta_redireccion(current_user))
@@ -119,6 +143,13 @@ def solicitar_reseteo():
 
     if request.method == 'POST':
         email = request.form.get('email')
+
+        # Cada solicitud puede terminar en un correo: se limita por IP y por destinatario
+        espera = limitador.verificar('reseteo', ip=request.remote_addr, email=email)
+        if espera:
+            flash(f'Demasiadas solicitudes de recuperación. Intenta nuevamente en {espera} segundos.', 'danger')
+            return render_template('solicitar_reseteo.html'), 429
+
         usuario = Usuario.query.filter_by(email=email).first()
         
         if usuario:
@@ -170,15 +201,26 @@ def resetear_clave(token):
             flash('Error: La contraseña debe tener al menos 8 caracteres, una mayúscula y un número.', 'danger')
             return render_template('resetear_clave.html')
         
-        # Cambiamos la clave
-        usuario.set_password(nueva_password)
+        # Cambiamos la clave (en la BD global si el login se valida allá)
+        try:
+            proveedor_identidad.cambiar_clave(usuario, nueva_password)
+        except ErrorIdentidad:
+            db.session.rollback()
+            flash('No fue posible guardar tu nueva contraseña en este momento. Intenta nuevamente en unos minutos.', 'warning')
+            return render_template('resetear_clave.html'), 503
+        except HashOcupado as e:
+            db.session.rollback()
+            flash('El sistema está ocupado. Intenta nuevamente en unos segundos.', 'warning')
+            return render_template('resetear_clave.html'), 503, {'Retry-After': str(e.reintentar_en)}
         
         # Limpiar token
         usuario.reset_token = None
         usuario.reset_token_expiracion = None
         db.session.commit()
+        cache_usuarios.invalidar(usuario.id)
         
-        registrar_log("Recuperación Clave", f"El usuario {usuario.nombre_completo} reseteó su clave vía correo.")
+        registrar_log("clave.recuperacion", f"El usuario {usuario.nombre_completo} reseteó su clave vía correo.",
+                      entidad='usuario', entidad_id=usuario.id)
         
         flash('Tu contraseña ha sido restablecida. Inicia sesión.', 'success')
         return redirect(url_for('auth.login'))
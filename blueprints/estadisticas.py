@@ -1,47 +1,61 @@
 # blueprints/estadisticas.py
-from flask import Blueprint, render_template, abort, request, redirect, url_for
+from flask import Blueprint, render_template, abort, request, redirect, url_for, current_app, jsonify
 from flask_login import login_required, current_user
 from models import Dashboard, Grupo
+from permisos import indice_permisos, filtrar_grupos_permitidos, filtrar_dashboards_permitidos
+from buscador import indice_busqueda, PaginacionResultados
+from uso_dashboards import contador_vistas
+from fragmentos import cache_fragmentos
+from base_datos import marcar_solo_lectura
 
 estadisticas_bp = Blueprint('estadisticas', __name__, template_folder='../templates', url_prefix='/estadisticas')
+# Todo este blueprint solo lee: sus consultas pueden ir a la réplica
+estadisticas_bp.before_request(marcar_solo_lectura)
 
 # Ruta 1: Mostrar los Grupos (Tarjetas)
 @estadisticas_bp.route('/')
 @login_required
 def seleccion_grupo():
-    if current_user.rol.nombre == 'Admin':
-        # El admin ve todos los grupos
-        grupos = Grupo.query.order_by(Grupo.orden).all()
-    elif current_user.rol.nombre == 'Lector':
-        # El lector ve SOLO los grupos asignados
-        grupos = current_user.grupos_permitidos
-        # Ordenamos manualmente porque la relación many-to-many no siempre respeta el orden
-        grupos.sort(key=lambda x: x.orden)
-    else:
+    if current_user.rol.nombre not in ('Admin', 'Lector'):
         abort(403)
-    
-    return render_template('estadisticas/seleccion_grupo.html', grupos=grupos)
+    permisos = indice_permisos()
+
+    def _render():
+        if permisos.es_admin:
+            # El admin ve todos los grupos
+            grupos = Grupo.query.order_by(Grupo.orden).all()
+        else:
+            # El lector ve SOLO los grupos asignados (JOIN contra usuario_grupos, ya ordenado)
+            grupos = filtrar_grupos_permitidos(Grupo.query, current_user.id).order_by(Grupo.orden).all()
+        return render_template('estadisticas/_tarjetas_grupos.html', grupos=grupos)
+
+    # Los lectores con los mismos permisos comparten las tarjetas ya renderizadas
+    tarjetas = cache_fragmentos.obtener('seleccion_grupo', None, permisos.huella, _render)
+    return render_template('estadisticas/seleccion_grupo.html', tarjetas=tarjetas)
 
 # Ruta 2: Mostrar la Lista de Paneles de UN Grupo (ACORDEONES)
 @estadisticas_bp.route('/grupo/<int:grupo_id>')
 @login_required
 def lista_por_grupo(grupo_id):
-    grupo = Grupo.query.get_or_404(grupo_id)
-    
+    permisos = indice_permisos()
+
     # Validar permiso de Grupo (Si no es admin y no tiene el grupo, fuera)
-    if current_user.rol.nombre != 'Admin' and grupo not in current_user.grupos_permitidos:
+    if not permisos.puede_ver_grupo(grupo_id):
         abort(403)
 
-    # Filtrar Dashboards
-    if current_user.rol.nombre == 'Admin':
-        dashboards = Dashboard.query.filter_by(grupo_id=grupo_id, activo=True).order_by(Dashboard.orden).all()
-    else:
-        # Filtramos los dashboards del grupo que TAMBIÉN estén en la lista de permitidos del usuario
-        # Usamos un conjunto (set) para intersección rápida o una lista por comprensión
-        dashboards_grupo = Dashboard.query.filter_by(grupo_id=grupo_id, activo=True).order_by(Dashboard.orden).all()
-        dashboards = [d for d in dashboards_grupo if d in current_user.dashboards_permitidos]
-    
-    return render_template('estadisticas/lista.html', dashboards=dashboards, grupo=grupo)
+    def _render():
+        grupo = Grupo.query.get_or_404(grupo_id)
+
+        # Filtrar Dashboards
+        query = Dashboard.query.filter_by(grupo_id=grupo_id, activo=True)
+        if not permisos.es_admin:
+            # Solo los dashboards del grupo que TAMBIÉN estén permitidos (resuelto en SQL)
+            query = filtrar_dashboards_permitidos(query, current_user.id)
+        dashboards = query.order_by(Dashboard.orden).all()
+        return grupo.nombre, render_template('estadisticas/_lista_dashboards.html', dashboards=dashboards, grupo=grupo)
+
+    titulo, contenido = cache_fragmentos.obtener('lista_por_grupo', grupo_id, permisos.huella, _render)
+    return render_template('estadisticas/lista.html', titulo=titulo, contenido=contenido)
 
 # Ruta 3: Ver el PowerBI en pantalla completa
 @estadisticas_bp.route('/ver/<int:id>')
@@ -52,35 +66,52 @@ def ver_dashboard(id):
         abort(404)
 
     # Validar permiso de Dashboard
-    if current_user.rol.nombre != 'Admin' and dashboard not in current_user.dashboards_permitidos:
+    if not indice_permisos().puede_ver_dashboard(dashboard.id):
         abort(403)
 
+    # Auditoría de uso: solo suma en memoria, se guarda por lotes en segundo plano
+    contador_vistas.registrar(dashboard.id, current_user.id)
+
     return render_template('estadisticas/ver.html', dashboard=dashboard)
 
 @estadisticas_bp.route('/buscar')
 @login_required
 def buscar():
     query = request.args.get('q', '').strip()
+    page = request.args.get('page', 1, type=int)
     
     if not query:
         return redirect(url_for('estadisticas.seleccion_grupo'))
 
-    # 1. Buscamos TODOS los dashboards que coincidan con el texto (título o descripción)
-    # ilike hace que no importen mayúsculas/minúsculas
-    coincidencias = Dashboard.query.filter(
-        (Dashboard.titulo.ilike(f'%{query}%')) | 
-        (Dashboard.descripcion.ilike(f'%{query}%')),
-        Dashboard.activo == True
-    ).all()
-
-    # 2. FILTRADO DE SEGURIDAD (Permisos)
-    if current_user.rol.nombre == 'Admin':
-        resultados = coincidencias
-    else:
-        # Solo mostramos los que el usuario tiene permitidos
-        # Hacemos la intersección entre "lo que encontró" y "lo que puede ver"
-        resultados = [d for d in coincidencias if d in current_user.dashboards_permitidos]
+    # 1. Buscamos en el índice en memoria (sin acentos, con raíces y tolerante a errores)
+    # 2. FILTRADO DE SEGURIDAD: el lector solo recibe IDs que tiene permitidos
+    permisos = indice_permisos()
+    ids = indice_busqueda.buscar(query, permitidos=None if permisos.es_admin else permisos.dashboards)
+
+    # 3. Solo la página actual se carga desde la BD, respetando el orden por relevancia
+    pagination = PaginacionResultados(page=page, per_page=current_app.config.get('BUSQUEDA_POR_PAGINA', 20),
+                                      error_out=False, ids=ids)
 
     return render_template('estadisticas/resultados_busqueda.html', 
-                           resultados=resultados, 
-                           busqueda=query)
\ No newline at end of file
+                           resultados=pagination.items,
+                           pagination=pagination,
+                           busqueda=query)
+
+# Sugerencias mientras se escribe en el buscador (desde memoria; la BD solo confirma que sigan activos)
+@estadisticas_bp.route('/sugerir')
+@login_required
+def sugerir():
+    prefijo = request.args.get('q', '').strip()
+    limite = max(1, min(request.args.get('limite', 8, type=int), 20))
+
+    sugerencias = []
+    for tipo, id_, texto, grupo_id in indice_busqueda.sugerir(prefijo, indice_permisos(), limite):
+        if tipo == 'grupo':
+            url = url_for('estadisticas.lista_por_grupo', grupo_id=id_)
+            detalle = 'Área'
+        else:
+            url = url_for('estadisticas.ver_dashboard', id=id_)
+            detalle = indice_busqueda.nombre_grupo(grupo_id) or 'Panel'
+        sugerencias.append({'tipo': tipo, 'id': id_, 'texto': texto, 'detalle': detalle, 'url': url})
+
+    return jsonify(sugerencias=sugerencias)
@@ -0,0 +1,342 @@
+# buscador.py
+import bisect
+import math
+import re
+import threading
+import time
+import unicodedata
+from collections import Counter, defaultdict
+from flask_sqlalchemy.pagination import Pagination
+from sqlalchemy import select, or_
+from sqlalchemy.orm import joinedload
+from models import db, Dashboard, Grupo
+
+# --- NORMALIZACIÓN EN ESPAÑOL ---
+PALABRAS_VACIAS = frozenset("""
+a al ante con de del desde e el en entre la las lo los o para por segun sin
+sobre su sus u un una unas unos y
+""".split())
+
+# Sufijos ordenados de más largo a más corto; se quita el primero que calce
+SUFIJOS = (
+    'amientos', 'imientos', 'aciones', 'iciones', 'amiento', 'imiento',
+    'idades', 'ciones', 'acion', 'icion', 'mente', 'idad', 'ismos', 'istas',
+    'ables', 'ibles', 'cion', 'ismo', 'ista', 'able', 'ible', 'ores', 'ador',
+    'ados', 'adas', 'idos', 'idas', 'ado', 'ada', 'ido', 'ida',
+    'es', 'os', 'as', 's', 'o', 'a', 'e',
+)
+
+PESO_TITULO = 3.0
+SIMILITUD_MINIMA = 0.35    # Jaccard de trigramas para aceptar una palabra parecida
+MAX_PARECIDAS = 5
+MAX_CLAVES_REVISADAS = 2000  # tope de claves recorridas por sugerencia (prefijos muy cortos)
+
+# Dashboard visible en el buscador: activo y sin grupo o con su grupo activo
+DASHBOARD_VIGENTE = (Dashboard.activo == True) & \
+    or_(Dashboard.grupo_id.is_(None), Dashboard.grupo.has(Grupo.activo == True))
+
+
+def quitar_acentos(texto):
+    descompuesto = unicodedata.normalize('NFKD', texto)
+    return ''.join(c for c in descompuesto if not unicodedata.combining(c))
+
+
+def raiz(palabra):
+    """Stemmer liviano: quita un sufijo flexivo/derivativo dejando al menos 3 letras."""
+    if len(palabra) <= 4:
+        return palabra
+    for sufijo in SUFIJOS:
+        if palabra.endswith(sufijo) and len(palabra) - len(sufijo) >= 3:
+            return palabra[:-len(sufijo)]
+    return palabra
+
+
+def tokenizar(texto):
+    """'Población Inscrita' -> ['pobl', 'inscrit']"""
+    if not texto:
+        return []
+    texto = re.sub(r'<[^>]+>', ' ', texto)  # las descripciones pueden traer HTML
+    texto = quitar_acentos(texto.lower())
+    return [raiz(p) for p in re.findall(r'[a-z0-9]+', texto) if p not in PALABRAS_VACIAS]
+
+
+def normalizar(texto):
+    """Minúsculas, sin acentos ni signos: 'Población (Per Cápita)' -> 'poblacion per capita'"""
+    return ' '.join(re.findall(r'[a-z0-9]+', quitar_acentos((texto or '').lower())))
+
+
+def trigramas(palabra):
+    relleno = f'  {palabra} '
+    return {relleno[i:i + 3] for i in range(len(relleno) - 2)}
+
+
+# --- ÍNDICE INVERTIDO ---
+class IndiceBusqueda:
+    """Índice invertido en memoria del catálogo de dashboards activos.
+
+    Se construye completo en el primer uso (y cada BUSQUEDA_TTL segundos,
+    para recoger cambios hechos desde otros procesos) y se actualiza de a
+    un dashboard cuando se crea o edita desde el panel de admin.
+
+    Además mantiene una lista ordenada de claves (títulos de dashboards y
+    nombres de grupos, desde el inicio de cada palabra) para responder
+    sugerencias por prefijo con búsqueda binaria.
+    """
+
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self._lock = threading.RLock()
+        self._construido_en = None
+        self._docs = {}                        # dashboard_id -> {termino: peso}
+        self._postings = defaultdict(dict)     # termino -> {dashboard_id: peso}
+        self._trigramas = defaultdict(set)     # trigrama -> {termino}
+        self._titulos = {}                     # dashboard_id -> titulo (desempate)
+        self._etiquetas = {}                   # (tipo, id) -> (texto, grupo_id)
+        self._claves = []                      # [(clave, tipo, id)] ordenada
+        self._claves_sucias = True
+
+    def init_app(self, app):
+        self.ttl = app.config.get('BUSQUEDA_TTL', self.ttl)
+
+    # --- Mantenimiento ---
+    def reconstruir(self):
+        filas = db.session.execute(
+            select(Dashboard.id, Dashboard.titulo, Dashboard.descripcion, Dashboard.grupo_id)
+            .where(DASHBOARD_VIGENTE)
+        ).all()
+        grupos = db.session.execute(
+            select(Grupo.id, Grupo.nombre).where(Grupo.activo == True)
+        ).all()
+        with self._lock:
+            self._docs.clear()
+            self._postings.clear()
+            self._trigramas.clear()
+            self._titulos.clear()
+            self._etiquetas.clear()
+            for id_, titulo, descripcion, grupo_id in filas:
+                self._agregar(id_, titulo, descripcion, grupo_id)
+            for id_, nombre in grupos:
+                self._etiquetas[('grupo', id_)] = (nombre, id_)
+            self._claves_sucias = True
+            self._construido_en = time.monotonic()
+
+    def asegurar(self):
+        with self._lock:
+            vigente = self._construido_en is not None and \
+                time.monotonic() - self._construido_en < self.ttl
+        if not vigente:
+            self.reconstruir()
+
+    def actualizar_dashboard(self, dashboard):
+        """Refleja en el índice un dashboard recién creado, editado o (des)activado."""
+        with self._lock:
+            if self._construido_en is None:
+                return  # Aún no se construye; se hará completo en la primera búsqueda
+            self._quitar(dashboard.id)
+            if dashboard.activo:
+                self._agregar(dashboard.id, dashboard.titulo, dashboard.descripcion, dashboard.grupo_id)
+            self._claves_sucias = True
+
+    def actualizar_grupo(self, grupo):
+        """Refleja en las sugerencias un grupo recién creado, editado o (des)activado."""
+        with self._lock:
+            if self._construido_en is None:
+                return
+            if (('grupo', grupo.id) in self._etiquetas) != bool(grupo.activo):
+                # Cambió el estado: sus dashboards entran o salen; se reconstruye en la próxima búsqueda
+                self._construido_en = None
+                return
+            self._etiquetas.pop(('grupo', grupo.id), None)
+            if grupo.activo:
+                self._etiquetas[('grupo', grupo.id)] = (grupo.nombre, grupo.id)
+            self._claves_sucias = True
+
+    def descartar(self, tipo, ids):
+        """Quita del índice grupos o dashboards que la BD ya no muestra (desactivados desde otro proceso)."""
+        with self._lock:
+            for id_ in ids:
+                if tipo == 'grupo':
+                    self._etiquetas.pop(('grupo', id_), None)
+                else:
+                    self._quitar(id_)
+            self._claves_sucias = True
+
+    def _agregar(self, id_, titulo, descripcion, grupo_id):
+        pesos = Counter()
+        for termino in tokenizar(titulo):
+            pesos[termino] += PESO_TITULO
+        for termino in tokenizar(descripcion):
+            pesos[termino] += 1.0
+
+        self._docs[id_] = pesos
+        self._titulos[id_] = quitar_acentos((titulo or '').lower())
+        self._etiquetas[('dashboard', id_)] = (titulo, int(grupo_id) if grupo_id else None)
+        for termino, peso in pesos.items():
+            if not self._postings.get(termino):
+                for tri in trigramas(termino):
+                    self._trigramas[tri].add(termino)
+            self._postings[termino][id_] = peso
+
+    def _quitar(self, id_):
+        pesos = self._docs.pop(id_, None)
+        self._titulos.pop(id_, None)
+        self._etiquetas.pop(('dashboard', id_), None)
+        if not pesos:
+            return
+        for termino in pesos:
+            posting = self._postings.get(termino)
+            if posting is None:
+                continue
+            posting.pop(id_, None)
+            if not posting:
+                del self._postings[termino]
+                for tri in trigramas(termino):
+                    self._trigramas[tri].discard(termino)
+
+    # --- Consulta ---
+    def _parecidas(self, termino):
+        """Palabras del vocabulario con trigramas similares (tolerancia a errores de tipeo)."""
+        propios = trigramas(termino)
+        comunes = Counter()
+        for tri in propios:
+            for candidato in self._trigramas.get(tri, ()):
+                comunes[candidato] += 1
+        similares = []
+        for candidato, n in comunes.items():
+            similitud = n / (len(propios) + len(trigramas(candidato)) - n)
+            if similitud >= SIMILITUD_MINIMA:
+                similares.append((similitud, candidato))
+        similares.sort(reverse=True)
+        return similares[:MAX_PARECIDAS]
+
+    def buscar(self, texto, permitidos=None):
+        """Devuelve los IDs de dashboards ordenados por relevancia.
+
+        `permitidos` es un conjunto de IDs visibles para el usuario (None = todos).
+        """
+        self.asegurar()
+        terminos = list(dict.fromkeys(tokenizar(texto)))
+        if not terminos:
+            return []
+
+        with self._lock:
+            total_docs = len(self._docs) or 1
+            puntajes = defaultdict(float)
+            aciertos = defaultdict(int)
+
+            for termino in terminos:
+                if termino in self._postings:
+                    variantes = [(1.0, termino)]
+                else:
+                    variantes = self._parecidas(termino)
+
+                vistos = set()
+                for similitud, variante in variantes:
+                    posting = self._postings.get(variante, {})
+                    idf = math.log(1 + total_docs / len(posting)) if posting else 0
+                    for id_, peso in posting.items():
+                        if permitidos is not None and id_ not in permitidos:
+                            continue
+                        puntajes[id_] += similitud * peso * idf
+                        vistos.add(id_)
+                for id_ in vistos:
+                    aciertos[id_] += 1
+
+            # Primero los que calzan con más palabras de la búsqueda, luego por puntaje
+            return sorted(puntajes, key=lambda i: (-aciertos[i], -puntajes[i], self._titulos.get(i, '')))
+
+    def _ordenar_claves(self):
+        claves = []
+        for (tipo, id_), (texto, _) in self._etiquetas.items():
+            palabras = normalizar(texto).split()
+            # Una clave por cada palabra, así 'inscr' encuentra 'Población Inscrita'
+            for i in range(len(palabras)):
+                claves.append((' '.join(palabras[i:]), tipo, id_))
+        claves.sort()
+        self._claves = claves
+        self._claves_sucias = False
+
+    def sugerir(self, prefijo, permisos, limite=8):
+        """Hasta `limite` grupos/dashboards visibles cuyo nombre tenga una palabra que empiece con `prefijo`.
+
+        Devuelve tuplas (tipo, id, texto, grupo_id); grupos primero.
+        """
+        self.asegurar()
+        prefijo = normalizar(prefijo)
+        if not prefijo:
+            return []
+
+        with self._lock:
+            if self._claves_sucias:
+                self._ordenar_claves()
+
+            encontrados = []
+            vistos = set()
+            inicio = bisect.bisect_left(self._claves, (prefijo,))
+            for clave, tipo, id_ in self._claves[inicio:inicio + MAX_CLAVES_REVISADAS]:
+                if not clave.startswith(prefijo):
+                    break
+                if (tipo, id_) in vistos:
+                    continue
+                visible = permisos.puede_ver_grupo(id_) if tipo == 'grupo' else permisos.puede_ver_dashboard(id_)
+                if not visible:
+                    continue
+                vistos.add((tipo, id_))
+                texto, grupo_id = self._etiquetas[(tipo, id_)]
+                encontrados.append((tipo, id_, texto, grupo_id))
+
+        encontrados.sort(key=lambda s: (s[0] != 'grupo', normalizar(s[2])))
+        return self._vigentes(encontrados, limite)
+
+    def _vigentes(self, encontrados, limite):
+        """Los primeros `limite` encontrados que siguen activos en la BD.
+
+        Otro proceso pudo desactivar un grupo o dashboard que este índice
+        aún tiene; se confirma con una consulta por tipo sobre los IDs y
+        los que ya no están activos se descartan del índice.
+        """
+        encontrados = encontrados[:limite * 2]
+        grupos = {id_ for tipo, id_, _, _ in encontrados if tipo == 'grupo'}
+        dashboards = {id_ for tipo, id_, _, _ in encontrados if tipo == 'dashboard'}
+        if grupos:
+            activos = set(db.session.execute(
+                select(Grupo.id).where(Grupo.id.in_(grupos), Grupo.activo == True)).scalars())
+            self.descartar('grupo', grupos - activos)
+            grupos = activos
+        if dashboards:
+            activos = set(db.session.execute(
+                select(Dashboard.id).where(Dashboard.id.in_(dashboards), DASHBOARD_VIGENTE)).scalars())
+            self.descartar('dashboard', dashboards - activos)
+            dashboards = activos
+        return [s for s in encontrados if s[1] in (grupos if s[0] == 'grupo' else dashboards)][:limite]
+
+    def nombre_grupo(self, grupo_id):
+        etiqueta = self._etiquetas.get(('grupo', grupo_id))
+        return etiqueta[0] if etiqueta else None
+
+
+class PaginacionResultados(Pagination):
+    """Paginación sobre la lista ya ordenada de IDs que devuelve el índice."""
+
+    def _query_items(self):
+        ids = self._query_args['ids']
+        while True:
+            pagina = ids[self._query_offset:self._query_offset + self.per_page]
+            if not pagina:
+                return []
+            # Solo se cargan de la BD los dashboards de la página actual
+            por_id = {d.id: d for d in Dashboard.query.options(joinedload(Dashboard.grupo))
+                      .filter(Dashboard.id.in_(pagina), DASHBOARD_VIGENTE)}
+            if len(por_id) == len(pagina):
+                return [por_id[i] for i in pagina]
+            # La BD manda: los desactivados desde otro proceso salen del índice
+            # y de la lista (así el total cuadra) y la página se completa
+            faltantes = set(pagina) - set(por_id)
+            indice_busqueda.descartar('dashboard', faltantes)
+            ids[:] = [i for i in ids if i not in faltantes]
+
+    def _query_count(self):
+        return len(self._query_args['ids'])
+
+
+indice_busqueda = IndiceBusqueda()
@@ -0,0 +1,146 @@
+# cache_usuarios.py
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from flask_login import UserMixin
+from sqlalchemy.orm import joinedload
+from models import Usuario
+from permisos import compilar_indice
+from base_datos import en_principal
+
+RolSesion = namedtuple('RolSesion', ['id', 'nombre'])
+
+
+class UsuarioSesion(UserMixin):
+    """Foto inmutable de la identidad, rol y permisos de un usuario.
+
+    Es lo que recibe Flask-Login como current_user en cada request; para
+    modificar datos del usuario hay que cargar el modelo Usuario real.
+    """
+    __slots__ = ('id', 'nombre_completo', 'email', 'activo',
+                 'cambio_clave_requerido', 'rol', 'permisos')
+
+    def __init__(self, usuario, permisos):
+        valores = {
+            'id': usuario.id,
+            'nombre_completo': usuario.nombre_completo,
+            'email': usuario.email,
+            'activo': usuario.activo,
+            'cambio_clave_requerido': usuario.cambio_clave_requerido,
+            'rol': RolSesion(usuario.rol.id, usuario.rol.nombre) if usuario.rol else None,
+            'permisos': permisos,
+        }
+        for nombre, valor in valores.items():
+            object.__setattr__(self, nombre, valor)
+
+    def __setattr__(self, nombre, valor):
+        raise AttributeError('UsuarioSesion es inmutable; edita el modelo Usuario')
+
+
+class CacheUsuarios:
+    """Caché LRU con TTL de UsuarioSesion, local a cada proceso.
+
+    invalidar() borra la entrada en este proceso; para que llegue a los
+    demás workers hay dos opciones:
+      - USUARIOS_CACHE_REDIS: cada usuario tiene un sello de versión en
+        Redis que invalidar() incrementa y que se compara en cada acierto
+        (un GET). Así el TTL puede ser largo.
+      - Sin Redis, el TTL corto (USUARIOS_CACHE_TTL, 5 s por defecto) es
+        lo más que otro worker sigue usando una foto vieja.
+
+    Si se invalida mientras otra request carga la foto, esa foto no se
+    guarda (para no dejar datos viejos en caché).
+    """
+
+    def __init__(self, ttl=5, max_entradas=5000):
+        self.ttl = ttl
+        self.max_entradas = max_entradas
+        self.redis = None
+        self._entradas = OrderedDict()  # usuario_id -> (snapshot, version, expira)
+        self._generacion = 0            # se incrementa con cada invalidar()
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.ttl = app.config.get('USUARIOS_CACHE_TTL', self.ttl)
+        self.max_entradas = app.config.get('USUARIOS_CACHE_MAX', self.max_entradas)
+        url = app.config.get('USUARIOS_CACHE_REDIS')
+        if url:
+            try:
+                import redis
+            except ImportError:
+                raise RuntimeError('USUARIOS_CACHE_REDIS está configurado pero el paquete redis no está instalado '
+                                   '(pip install redis).')
+            self.redis = redis.Redis.from_url(url)
+
+    def obtener(self, usuario_id):
+        """Devuelve la foto del usuario, consultando la BD solo si no está en caché."""
+        ahora = time.monotonic()
+        version = self._version(usuario_id)
+        with self._lock:
+            generacion = self._generacion
+            entrada = self._entradas.get(usuario_id)
+            if entrada:
+                snapshot, version_entrada, expira = entrada
+                if version is not None and version_entrada == version and expira > ahora:
+                    self._entradas.move_to_end(usuario_id)
+                    return snapshot
+                del self._entradas[usuario_id]
+
+        snapshot = self._cargar(usuario_id)
+        if snapshot is None:
+            return None
+
+        with self._lock:
+            # Si alguien invalidó mientras cargábamos, no guardamos la foto vieja
+            if version is not None and self._generacion == generacion:
+                self._entradas[usuario_id] = (snapshot, version, ahora + self.ttl)
+                self._entradas.move_to_end(usuario_id)
+                while len(self._entradas) > self.max_entradas:
+                    self._entradas.popitem(last=False)
+        return snapshot
+
+    def invalidar(self, usuario_id):
+        """Descarta la foto del usuario en todos los workers (tras editar datos, estado, clave o permisos)."""
+        with self._lock:
+            self._generacion += 1
+            self._entradas.pop(usuario_id, None)
+        if self.redis is not None:
+            try:
+                pipe = self.redis.pipeline()
+                pipe.incr(_clave(usuario_id))
+                # Basta con que dure más que cualquier entrada creada antes del incremento
+                pipe.expire(_clave(usuario_id), max(int(self.ttl) * 2, 60))
+                pipe.execute()
+            except Exception as e:
+                print(f"No se pudo invalidar el usuario {usuario_id} en Redis: {e}")
+
+    def limpiar(self):
+        with self._lock:
+            self._generacion += 1
+            self._entradas.clear()
+
+    def _version(self, usuario_id):
+        """Sello compartido del usuario (0 sin Redis); None si Redis no responde (no se usa la caché)."""
+        if self.redis is None:
+            return 0
+        try:
+            return int(self.redis.get(_clave(usuario_id)) or 0)
+        except Exception as e:
+            print(f"Redis no disponible para la caché de usuarios: {e}")
+            return None
+
+    def _cargar(self, usuario_id):
+        # Siempre del principal: una foto atrasada de la réplica quedaría en caché por todo el TTL
+        with en_principal():
+            usuario = Usuario.query.options(joinedload(Usuario.rol)).filter_by(id=usuario_id).first()
+            if usuario is None:
+                return None
+            es_admin = usuario.rol is not None and usuario.rol.nombre == 'Admin'
+            return UsuarioSesion(usuario, compilar_indice(usuario.id, es_admin))
+
+
+def _clave(usuario_id):
+    return f'usuario_version:{usuario_id}'
+
+
+cache_usuarios = CacheUsuarios()
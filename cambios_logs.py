@@ -0,0 +1,124 @@
+# cambios_logs.py
+import csv
+import hmac
+import io
+import json
+from collections import namedtuple
+from datetime import timedelta
+from sqlalchemy import select, func
+from models import db, Log, obtener_hora_chile
+from paginacion import codificar_cursor, decodificar_cursor
+from base_datos import motor_lectura
+
+COLUMNAS = ('id', 'timestamp', 'usuario_id', 'usuario_nombre', 'accion', 'detalles',
+            'entidad_tipo', 'entidad_id', 'ip', 'datos')
+FORMATOS = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+
+# Lo que se entrega en una respuesta: filas con desde < id <= hasta; `ultima` es (timestamp, id) de la última
+Tramo = namedtuple('Tramo', ['desde', 'hasta', 'ultima', 'hay_mas'])
+
+
+class CambiosLogs:
+    """Logs posteriores a un cursor, para que BI cargue solo lo nuevo.
+
+    Cada respuesta entrega a lo más `limite` filas en orden de id y devuelve
+    el cursor de la última en el header X-Cursor-Siguiente; la próxima carga
+    lo manda en ?desde= y recibe solo lo que vino después.
+
+    Se avanza por id y no por timestamp: el id lo asigna la base al
+    insertar, así una fila que llega tarde (cola de auditoria.py atrasada,
+    base caída un rato) o con hora repetida (fin del horario de verano, el
+    timestamp es hora local de Chile) igual queda después del cursor. El
+    timestamp solo viaja dentro del cursor, que es opaco para el cliente.
+
+    Para no saltarse inserciones que aún no se confirman con un id menor,
+    el tramo termina antes de la primera fila de los últimos
+    LOGS_CAMBIOS_RETRASO segundos (se busca con el índice de timestamp).
+
+    El tramo se fija antes de transmitir (un SELECT con OFFSET sobre la
+    clave primaria) y las filas se leen por lotes de LOGS_CAMBIOS_LOTE con
+    consultas cortas: entre lote y lote no queda ninguna conexión tomada,
+    así un cliente lento solo frena su propio generador. Los meses
+    archivados (retencion_logs.py) ya no están en la tabla.
+    """
+
+    def __init__(self):
+        self.token = None
+        self.retraso = 60
+        self.limite = 50000
+        self.tam_lote = 2000
+
+    def init_app(self, app):
+        self.token = app.config.get('LOGS_CAMBIOS_TOKEN')
+        self.retraso = app.config.get('LOGS_CAMBIOS_RETRASO', self.retraso)
+        self.limite = app.config.get('LOGS_CAMBIOS_LIMITE', self.limite)
+        self.tam_lote = app.config.get('LOGS_CAMBIOS_LOTE', self.tam_lote)
+
+    def token_valido(self, cabecera):
+        """Permite leer la API con 'Authorization: Bearer <LOGS_CAMBIOS_TOKEN>' (sin sesión)."""
+        if not self.token or not cabecera or not cabecera.startswith('Bearer '):
+            return False
+        return hmac.compare_digest(cabecera[7:].encode(), self.token.encode())
+
+    def preparar(self, cursor, limite=None):
+        """Tramo a entregar después de `cursor` (None = desde el inicio). ValueError si el cursor no es válido."""
+        posicion = decodificar_cursor(cursor)
+        if cursor and posicion is None:
+            raise ValueError('Cursor no válido.')
+        desde = posicion[1] if posicion else 0
+        limite = min(max(limite or self.limite, 1), self.limite)
+        corte = obtener_hora_chile() - timedelta(seconds=self.retraso)
+
+        consulta = select(Log.id, Log.timestamp).where(Log.id > desde)
+        with motor_lectura(db).connect() as conn:
+            reciente = conn.execute(select(func.min(Log.id)).where(Log.timestamp > corte, Log.id > desde)).scalar()
+            if reciente is not None:
+                consulta = consulta.where(Log.id < reciente)
+            # La fila número `limite` cierra el tramo; si hay otra después, quedan más
+            filas = conn.execute(consulta.order_by(Log.id).offset(limite - 1).limit(2)).all()
+            if not filas:
+                filas = conn.execute(consulta.order_by(Log.id.desc()).limit(1)).all()
+        if not filas:
+            return Tramo(desde, desde, posicion, False)
+        return Tramo(desde, filas[0].id, (filas[0].timestamp, filas[0].id), len(filas) == 2)
+
+    def cursor_siguiente(self, tramo):
+        return codificar_cursor(*tramo.ultima) if tramo.ultima else ''
+
+    def iterar(self, tramo):
+        """Filas del tramo en orden de id, leídas por lotes (una consulta corta por lote)."""
+        posicion = tramo.desde
+        while posicion < tramo.hasta:
+            consulta = select(*(getattr(Log, c) for c in COLUMNAS)) \
+                .where(Log.id > posicion, Log.id <= tramo.hasta).order_by(Log.id).limit(self.tam_lote)
+            with motor_lectura(db).connect() as conn:
+                lote = conn.execute(consulta).all()
+            if not lote:
+                return
+            yield lote
+            posicion = lote[-1].id
+
+    def transmitir(self, tramo, formato):
+        """Generador con el cuerpo de la respuesta: un bloque de texto por lote."""
+        if formato == 'csv':
+            buffer = io.StringIO()
+            escritor = csv.writer(buffer)
+            escritor.writerow(COLUMNAS)
+            for lote in self.iterar(tramo):
+                escritor.writerows((f.id, f.timestamp.isoformat(), f.usuario_id, f.usuario_nombre, f.accion,
+                                    f.detalles, f.entidad_tipo, f.entidad_id, f.ip,
+                                    json.dumps(f.datos, ensure_ascii=False) if f.datos is not None else None)
+                                   for f in lote)
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+            if buffer.tell():
+                yield buffer.getvalue()  # Solo el encabezado, si no hubo filas
+            return
+
+        for lote in self.iterar(tramo):
+            yield ''.join(json.dumps(dict(f._asdict(), timestamp=f.timestamp.isoformat()), ensure_ascii=False) + '\n'
+                          for f in lote)
+
+
+cambios_logs = CambiosLogs()
@@ -0,0 +1,159 @@
+# comandos.py
+import os
+import subprocess
+import time
+import click
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateColumn
+from models import db, Grupo, Dashboard
+from retencion_logs import archivar_logs
+from correos import despachador_correos
+from exportaciones import gestor_exportaciones
+from estaticos import manifiesto_estaticos
+from imagenes import procesador_imagenes, ErrorImagen
+from fragmentos import cache_fragmentos
+from identidad import proveedor_identidad
+from eventos import completar_logs
+
+
+def registrar_comandos(app):
+    """Comandos de mantenimiento disponibles con `flask --app app <comando>`."""
+
+    @app.cli.command('crear-indices')
+    def crear_indices():
+        """Crea las tablas, columnas e índices que falten (db.create_all no toca tablas existentes)."""
+        db.create_all()
+        inspector = inspect(db.engine)
+        for tabla in db.metadata.sorted_tables:
+            # Columnas nuevas de un modelo (siempre opcionales, así no hay que dar un valor a las filas viejas)
+            columnas = {c['name'] for c in inspector.get_columns(tabla.name)}
+            for columna in tabla.columns:
+                if columna.name in columnas:
+                    continue
+                if not columna.nullable:
+                    raise click.ClickException(f'{tabla.name}.{columna.name} es obligatoria: agrégala a mano.')
+                click.echo(f'Agregando columna {columna.name} a {tabla.name}...')
+                with db.engine.begin() as conn:
+                    ddl = CreateColumn(columna).compile(dialect=db.engine.dialect)
+                    conn.execute(text(f'ALTER TABLE {tabla.name} ADD COLUMN {ddl}'))
+
+            existentes = {i['name'] for i in inspector.get_indexes(tabla.name)}
+            for indice in tabla.indexes:
+                if indice.name in existentes:
+                    continue
+                click.echo(f'Creando índice {indice.name} en {tabla.name}...')
+                indice.create(db.engine)
+        click.echo('Índices al día.')
+
+    @app.cli.command('migrar-logs')
+    @click.option('--lote', type=int, default=5000, help='Logs revisados por transacción (5000).')
+    def migrar_logs(lote):
+        """Pasa los logs antiguos a códigos de acción y completa la entidad afectada (después de crear-indices)."""
+        revisadas, actualizadas = completar_logs(lote, salida=click.echo)
+        click.echo(f'{revisadas} logs revisados, {actualizadas} actualizados.')
+
+    @app.cli.command('archivar-logs')
+    @click.option('--meses', type=int, default=None,
+                  help='Meses que se mantienen en la tabla (por defecto LOGS_MESES_CALIENTES).')
+    def archivar_logs_cmd(meses):
+        """Mueve los logs más antiguos que la ventana caliente a archivos .jsonl.gz mensuales."""
+        resumen = archivar_logs(meses)
+        if not resumen:
+            click.echo('No hay logs fuera de la ventana caliente.')
+        for mes, escritas, borradas in resumen:
+            click.echo(f'{mes}: {escritas} archivados, {borradas} borrados de la tabla.')
+
+    @app.cli.command('enviar-correos')
+    def enviar_correos():
+        """Envía ahora los correos en cola que ya tocan (útil si MAIL_ASINCRONO=0 o para vaciar reintentos)."""
+        procesados = despachador_correos.procesar_pendientes()
+        resumen = despachador_correos.resumen()['por_estado']
+        click.echo(f'{procesados} correos procesados. Estado de la cola: '
+                   + ', '.join(f'{estado}={n}' for estado, n in resumen.items()))
+
+    @app.cli.command('procesar-exportaciones')
+    @click.option('--continuo', is_flag=True, help='No termina: repite cada EXPORTACIONES_INTERVALO segundos.')
+    def procesar_exportaciones(continuo):
+        """Encola los reportes programados que tocan, genera los pendientes y borra los vencidos.
+
+        Para generar los reportes en un proceso aparte de los web (EXPORTACIONES_HILOS=0),
+        desde cron o como servicio con --continuo.
+        """
+        while True:
+            programados = gestor_exportaciones.ejecutar_programaciones()
+            generados = gestor_exportaciones.procesar_pendientes()
+            vencidos = gestor_exportaciones.limpiar_vencidas()
+            if programados or generados or vencidos or not continuo:
+                click.echo(f'{programados} programados, {generados} generados, {vencidos} archivos vencidos borrados.')
+            if not continuo:
+                break
+            time.sleep(gestor_exportaciones.intervalo)
+
+    @app.cli.command('construir-estaticos')
+    def construir_estaticos():
+        """Escribe static/manifest.json con los hashes y las variantes .gz/.br (brotli es opcional)."""
+        archivos, comprimidos = manifiesto_estaticos.construir()
+        click.echo(f'{archivos} archivos en el manifiesto, {comprimidos} variantes comprimidas.')
+
+    @app.cli.command('construir-css')
+    @click.option('--tailwind', 'binario', default=None,
+                  help='Ruta al ejecutable tailwindcss (por defecto TAILWIND_BIN o el del PATH).')
+    def construir_css(binario):
+        """Compila el CSS de Tailwind usado en las plantillas a static/css/app.css y actualiza el manifiesto."""
+        try:
+            salida = manifiesto_estaticos.compilar_css(binario)
+        except (RuntimeError, OSError, subprocess.CalledProcessError) as e:
+            raise click.ClickException(str(e))
+        click.echo(f'CSS generado: {os.path.relpath(salida, app.root_path)} '
+                   f'({os.path.getsize(salida) // 1024} KB).')
+        archivos, comprimidos = manifiesto_estaticos.construir()
+        click.echo(f'{archivos} archivos en el manifiesto, {comprimidos} variantes comprimidas.')
+
+    @app.cli.command('procesar-imagenes')
+    @click.option('--regenerar', is_flag=True, help='Vuelve a generar las variantes aunque ya existan.')
+    def procesar_imagenes(regenerar):
+        """Pasa las imágenes de grupos y dashboards a static/previews y genera sus variantes."""
+        procesador_imagenes.asincrono = False  # Aquí sí se espera cada imagen
+        registros = [(g, 'imagen') for g in Grupo.query.filter(Grupo.imagen.isnot(None))] + \
+                    [(d, 'imagen_preview') for d in Dashboard.query.filter(Dashboard.imagen_preview.isnot(None))]
+        movidas, generadas = 0, set()
+        for registro, campo in registros:
+            nombre = getattr(registro, campo)
+            if not nombre.startswith('previews/'):
+                # Imagen subida antes del pipeline: se copia con nombre por hash (el original queda en static/)
+                ruta = os.path.join(app.static_folder, nombre)
+                try:
+                    with open(ruta, 'rb') as f:
+                        nuevo = procesador_imagenes.guardar_bytes(f.read())
+                except (OSError, ErrorImagen) as e:
+                    click.echo(f'Se omite {nombre}: {e}')
+                    continue
+                setattr(registro, campo, nuevo)
+                movidas += 1
+                nombre = nuevo
+            if nombre not in generadas and (regenerar or procesador_imagenes.procesada(nombre) is None):
+                procesador_imagenes.procesar(nombre)
+            generadas.add(nombre)
+        db.session.commit()
+        cache_fragmentos.invalidar()
+        click.echo(f'{movidas} imágenes movidas a static/previews, {len(generadas)} con variantes al día.')
+
+    @app.cli.command('sincronizar-identidades')
+    @click.option('--lote', type=int, default=500, help='Identidades leídas de la BD global por consulta (500).')
+    def sincronizar_identidades(lote):
+        """Copia nombre y hash de clave de la BD global a la tabla usuarios local, por lotes."""
+        if not proveedor_identidad.global_:
+            raise click.ClickException('DATABASE_URL_GLOBAL no está configurada.')
+        revisados, copiados = proveedor_identidad.sincronizar_todo(lote, salida=click.echo)
+        click.echo(f'{revisados} identidades revisadas, {copiados} copiadas a la tabla local.')
+
+    @app.cli.command('poblar-identidad-local')
+    def poblar_identidad_local():
+        """Crea una BD global de pruebas (SQLite en DATABASE_URL_GLOBAL) con los usuarios locales."""
+        if not proveedor_identidad.global_:
+            raise click.ClickException('DATABASE_URL_GLOBAL no está configurada.')
+        try:
+            copiados = proveedor_identidad.poblar_desde_local()
+        except RuntimeError as e:
+            raise click.ClickException(str(e))
+        click.echo(f'{copiados} usuarios copiados a la BD global de pruebas.')
@@ -0,0 +1,313 @@
+# correos.py
+import atexit
+import os
+import random
+import smtplib
+import threading
+import time
+from collections import Counter
+from datetime import timedelta
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from email.utils import formataddr
+from sqlalchemy import select, update, func
+from models import db, CorreoPendiente, obtener_hora_chile
+
+ESTADOS = ('pendiente', 'enviando', 'enviado', 'fallido')
+tabla = CorreoPendiente.__table__
+
+
+def _es_permanente(error):
+    """Errores que no se arreglan reintentando (p. ej. destinatario rechazado)."""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return True
+    if isinstance(error, smtplib.SMTPAuthenticationError):
+        return False  # Se corrige la clave en el .env y el reintento funciona
+    return isinstance(error, smtplib.SMTPResponseException) and 500 <= error.smtp_code < 600
+
+
+class ConexionSMTP:
+    """Conexión SMTP autenticada que un hilo reutiliza entre correos.
+
+    Se abre con el primer envío y se cierra si queda MAIL_MAX_INACTIVO
+    segundos sin uso; si el servidor la cortó, se reconecta una vez.
+    """
+
+    def __init__(self, despachador):
+        self.despachador = despachador
+        self.smtp = None
+        self.ultimo_uso = 0.0
+
+    def abrir(self):
+        d = self.despachador
+        smtp = smtplib.SMTP(d.servidor, d.puerto, timeout=d.timeout)
+        try:
+            if d.starttls:
+                smtp.starttls()
+            if d.usuario and d.contrasena:
+                smtp.login(d.usuario, d.contrasena)
+        except Exception:
+            smtp.close()
+            raise
+        self.smtp = smtp
+        d.estadisticas['conexiones'] += 1
+
+    def enviar(self, mensaje):
+        if self.smtp is not None and self.inactiva():
+            self.cerrar()
+        for intento in (1, 2):
+            if self.smtp is None:
+                self.abrir()
+            try:
+                self.smtp.send_message(mensaje)
+                self.ultimo_uso = time.monotonic()
+                return
+            except smtplib.SMTPServerDisconnected:
+                self.smtp = None
+                if intento == 2:
+                    raise
+
+    def inactiva(self):
+        return time.monotonic() - self.ultimo_uso > self.despachador.max_inactivo
+
+    def cerrar(self):
+        if self.smtp is None:
+            return
+        try:
+            self.smtp.quit()
+        except Exception:
+            self.smtp.close()
+        self.smtp = None
+
+
+class DespachadorCorreos:
+    """Cola persistente de correos salientes atendida por un grupo de hilos.
+
+    encolar() solo inserta una fila en correos_pendientes y vuelve; los
+    hilos la toman, la envían por una conexión SMTP ya autenticada y la
+    marcan como enviada. Si falla se reintenta con espera exponencial
+    (MAIL_ESPERA_BASE, el doble en cada intento) hasta MAIL_MAX_INTENTOS.
+
+    Un hilo toma un correo con un UPDATE condicionado al número de
+    intentos que leyó, así dos hilos (o dos procesos) nunca envían el
+    mismo. Mientras se envía, proximo_intento hace de plazo: si el proceso
+    muere, al vencer otro hilo lo retoma.
+    """
+
+    def __init__(self):
+        self.app = None
+        self.servidor = 'smtp.gmail.com'
+        self.puerto = 587
+        self.starttls = True
+        self.usuario = None
+        self.contrasena = None
+        self.remitente = None
+        self.nombre_remitente = 'Sistema Estadísticas'
+        self.asincrono = True
+        self.num_hilos = 2
+        self.max_intentos = 5
+        self.espera_base = 30.0
+        self.espera_max = 3600.0
+        self.intervalo = 10.0
+        self.max_inactivo = 60.0
+        self.timeout = 30
+        self.plazo_envio = 300
+        self.estadisticas = Counter()   # enviados, reintentos, fallidos, conexiones
+        self._hilos = []
+        self._pid = None
+        self._engine = None
+        self._lock = threading.Lock()
+        self._despertar = threading.Event()
+        self._detener = threading.Event()
+
+    def init_app(self, app):
+        self.app = app
+        config = app.config
+        self.servidor = config.get('MAIL_SERVIDOR', self.servidor)
+        self.puerto = config.get('MAIL_PUERTO', self.puerto)
+        self.starttls = config.get('MAIL_STARTTLS', self.starttls)
+        self.usuario = config.get('MAIL_USUARIO', self.usuario)
+        self.contrasena = config.get('MAIL_CONTRASENA', self.contrasena)
+        self.remitente = config.get('MAIL_REMITENTE') or self.usuario
+        self.asincrono = config.get('MAIL_ASINCRONO', self.asincrono)
+        self.num_hilos = config.get('MAIL_HILOS', self.num_hilos)
+        self.max_intentos = config.get('MAIL_MAX_INTENTOS', self.max_intentos)
+        self.espera_base = config.get('MAIL_ESPERA_BASE', self.espera_base)
+        self.max_inactivo = config.get('MAIL_MAX_INACTIVO', self.max_inactivo)
+        if self.asincrono and self.num_hilos:
+            # Tras un reinicio quedan pendientes y reintentos en la tabla aunque nadie encole uno nuevo
+            app.before_request(self._asegurar_hilos)
+        atexit.register(self.detener)
+
+    # --- API pública ---
+    def encolar(self, destinatario, asunto, cuerpo_html):
+        """Guarda el correo para envío y devuelve su ID (None si falta configuración).
+
+        Usa su propia transacción, así no confirma lo que haya pendiente
+        en db.session de quien llama.
+        """
+        if not self.remitente:
+            print("ERROR: Credenciales de correo faltantes en .env")
+            return None
+
+        ahora = obtener_hora_chile()
+        with self._obtener_engine().begin() as conn:
+            correo_id = conn.execute(tabla.insert().values(
+                destinatario=destinatario, asunto=asunto, cuerpo_html=cuerpo_html,
+                estado='pendiente', intentos=0, proximo_intento=ahora, creado_en=ahora,
+            )).inserted_primary_key[0]
+
+        if self.asincrono:
+            self._asegurar_hilos()
+            self._despertar.set()
+        else:
+            self.procesar_pendientes()
+        return correo_id
+
+    def procesar_pendientes(self, conexion=None, limite=None):
+        """Envía los correos que ya tocan; devuelve cuántos se intentaron."""
+        propia = conexion is None
+        conexion = conexion or ConexionSMTP(self)
+        procesados = 0
+        try:
+            while limite is None or procesados < limite:
+                fila = self._reclamar()
+                if fila is None:
+                    break
+                self._enviar(conexion, fila)
+                procesados += 1
+        finally:
+            if propia:
+                conexion.cerrar()
+        return procesados
+
+    def reintentar(self, correo_id):
+        """Vuelve a poner en cola un correo fallido. Devuelve True si estaba fallido."""
+        with self._obtener_engine().begin() as conn:
+            resultado = conn.execute(
+                update(tabla).where(tabla.c.id == correo_id, tabla.c.estado == 'fallido')
+                .values(estado='pendiente', intentos=0, proximo_intento=obtener_hora_chile())
+            )
+        if resultado.rowcount and self.asincrono:
+            self._asegurar_hilos()
+            self._despertar.set()
+        return bool(resultado.rowcount)
+
+    def resumen(self):
+        """Cantidad de correos por estado y contadores de este proceso."""
+        conteo = dict(db.session.execute(
+            select(tabla.c.estado, func.count()).group_by(tabla.c.estado)
+        ).all())
+        return {
+            'por_estado': {estado: conteo.get(estado, 0) for estado in ESTADOS},
+            'hilos_vivos': sum(1 for h in self._hilos if h.is_alive()) if self._pid == os.getpid() else 0,
+            'proceso': dict(self.estadisticas),
+        }
+
+    def detener(self, timeout=5):
+        self._detener.set()
+        self._despertar.set()
+        if self._pid == os.getpid():
+            for hilo in self._hilos:
+                hilo.join(timeout)
+
+    # --- Interno ---
+    def _asegurar_hilos(self):
+        # Se arrancan en el primer uso y de nuevo tras un fork (gunicorn --preload)
+        if self._hilos and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._hilos and self._pid == os.getpid():
+                return
+            self._engine = None
+            self._detener.clear()
+            self._pid = os.getpid()
+            self._hilos = [
+                threading.Thread(target=self._bucle, name=f'correos-{i}', daemon=True)
+                for i in range(self.num_hilos)
+            ]
+            for hilo in self._hilos:
+                hilo.start()
+
+    def _bucle(self):
+        conexion = ConexionSMTP(self)
+        try:
+            while not self._detener.is_set():
+                try:
+                    self.procesar_pendientes(conexion)
+                except Exception as e:
+                    print(f"Error en el despacho de correos: {e}")
+                if conexion.smtp is not None and conexion.inactiva():
+                    conexion.cerrar()
+                self._despertar.wait(self.intervalo)
+                self._despertar.clear()
+        finally:
+            conexion.cerrar()
+
+    def _obtener_engine(self):
+        if self._engine is None:
+            with self.app.app_context():
+                self._engine = db.engine
+        return self._engine
+
+    def _reclamar(self):
+        """Toma el próximo correo listo para enviar, o None si no hay."""
+        ahora = obtener_hora_chile()
+        with self._obtener_engine().begin() as conn:
+            candidatos = conn.execute(
+                select(tabla.c.id, tabla.c.intentos)
+                .where(tabla.c.estado.in_(('pendiente', 'enviando')), tabla.c.proximo_intento <= ahora)
+                .order_by(tabla.c.proximo_intento).limit(self.num_hilos + 1)
+            ).all()
+
+        for correo_id, intentos in candidatos:
+            with self._obtener_engine().begin() as conn:
+                tomado = conn.execute(
+                    update(tabla)
+                    .where(tabla.c.id == correo_id, tabla.c.intentos == intentos,
+                           tabla.c.estado.in_(('pendiente', 'enviando')))
+                    .values(estado='enviando', intentos=intentos + 1,
+                            proximo_intento=ahora + timedelta(seconds=self.plazo_envio))
+                ).rowcount
+                if tomado:
+                    return conn.execute(select(tabla).where(tabla.c.id == correo_id)).one()
+        return None
+
+    def _mensaje(self, fila):
+        mensaje = MIMEMultipart()
+        mensaje['Subject'] = fila.asunto
+        # formataddr genera un header estándar RFC 2822 que los clientes respetan más
+        mensaje['From'] = formataddr((self.nombre_remitente, self.remitente))
+        mensaje['To'] = fila.destinatario
+        mensaje.attach(MIMEText(fila.cuerpo_html, 'html'))
+        return mensaje
+
+    def _enviar(self, conexion, fila):
+        error = None
+        try:
+            conexion.enviar(self._mensaje(fila))
+        except Exception as e:
+            error = e
+
+        ahora = obtener_hora_chile()
+        if error is None:
+            valores = dict(estado='enviado', enviado_en=ahora, ultimo_error=None)
+            self.estadisticas['enviados'] += 1
+        elif _es_permanente(error) or fila.intentos >= self.max_intentos:
+            valores = dict(estado='fallido', ultimo_error=str(error))
+            self.estadisticas['fallidos'] += 1
+            print(f"Correo {fila.id} a {fila.destinatario} falló definitivamente: {error}")
+        else:
+            espera = min(self.espera_base * 2 ** (fila.intentos - 1), self.espera_max)
+            espera *= random.uniform(0.8, 1.2)  # para que los reintentos no lleguen todos juntos
+            valores = dict(estado='pendiente', ultimo_error=str(error),
+                           proximo_intento=ahora + timedelta(seconds=espera))
+            self.estadisticas['reintentos'] += 1
+
+        # Condicionado a los intentos: si otro hilo lo retomó por plazo vencido, no lo pisamos
+        with self._obtener_engine().begin() as conn:
+            conn.execute(update(tabla).where(tabla.c.id == fila.id, tabla.c.intentos == fila.intentos)
+                         .values(**valores))
+
+
+despachador_correos = DespachadorCorreos()
@@ -0,0 +1,217 @@
+# estaticos.py
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import shutil
+import subprocess
+import threading
+from flask import abort, request, send_file
+from werkzeug.security import safe_join
+
+# 'style.css' -> 'style.3f2a9c1b04d7.css'
+PATRON_VERSIONADO = re.compile(r'^(?P<base>.+)\.(?P<hash>[0-9a-f]{12})(?P<ext>\.[^./]+)$')
+COMPRIMIBLES = {'.css', '.js', '.svg', '.json', '.txt', '.html', '.xml', '.map', '.ico'}
+VARIANTES = (('br', '.br'), ('gzip', '.gz'))  # en orden de preferencia
+ARCHIVO_MANIFIESTO = 'manifest.json'
+
+# CSS de Tailwind compilado por `flask construir-css` (si no existe, base.html usa el CDN)
+CSS_COMPILADO = 'css/app.css'
+ENTRADA_CSS = os.path.join('assets', 'tailwind.css')
+CONFIG_TAILWIND = 'tailwind.config.js'
+
+CACHE_INMUTABLE = 'public, max-age=31536000, immutable'
+CACHE_REVALIDAR = 'no-cache'  # se puede guardar, pero se valida con el ETag
+
+
+def hash_archivo(ruta):
+    digest = hashlib.blake2b(digest_size=6)
+    with open(ruta, 'rb') as f:
+        for bloque in iter(lambda: f.read(65536), b''):
+            digest.update(bloque)
+    return digest.hexdigest()
+
+
+def nombre_versionado(archivo, hash_):
+    base, ext = os.path.splitext(archivo)
+    return f'{base}.{hash_}{ext}'
+
+
+class ManifiestoEstaticos:
+    """URLs con hash de contenido para /static y la vista que las sirve.
+
+    url_for('static', filename='style.css') genera /static/style.<hash>.css.
+    Como la URL cambia cuando cambia el archivo, esas respuestas se marcan
+    'immutable' por un año y el navegador no vuelve a pedirlas; las URLs
+    sin hash (o con un hash viejo) se sirven con 'no-cache' + ETag.
+
+    Los hashes salen de static/manifest.json (lo escribe el comando
+    `construir-estaticos`) y, para archivos nuevos o modificados después,
+    se calculan al vuelo y se guardan en memoria validando mtime y tamaño
+    (así una imagen subida desde el admin obtiene su propia URL).
+
+    Si existen style.css.br / style.css.gz (también los genera el comando)
+    se entregan según el Accept-Encoding del navegador.
+    """
+
+    def __init__(self):
+        self.app = None
+        self.activo = True
+        self._hashes = {}   # archivo -> (mtime_ns, tamano, hash)
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.app = app
+        self.activo = app.config.get('ESTATICOS_VERSIONADOS', self.activo)
+        self._hashes = self._leer_manifiesto(app.static_folder)
+
+        # Reemplazamos la vista 'static' de Flask por una que entiende los nombres versionados
+        app.view_functions['static'] = self.servir
+        app.jinja_env.globals['estatico_existe'] = lambda archivo: self.hash_de(archivo) is not None
+        if self.activo:
+            app.url_defaults(self._versionar_url)
+
+    # --- Generación de URLs ---
+    def _versionar_url(self, endpoint, values):
+        if endpoint == 'static' and 'filename' in values:
+            values['filename'] = self.ruta_versionada(values['filename'])
+
+    def ruta_versionada(self, archivo):
+        hash_ = self.hash_de(archivo)
+        return nombre_versionado(archivo, hash_) if hash_ else archivo
+
+    def hash_de(self, archivo):
+        """Hash del contenido actual del archivo, o None si no existe."""
+        ruta = safe_join(self.app.static_folder, archivo)
+        try:
+            st = os.stat(ruta) if ruta else None
+        except OSError:
+            st = None
+        if st is None:
+            return None
+
+        entrada = self._hashes.get(archivo)
+        if entrada and entrada[0] == st.st_mtime_ns and entrada[1] == st.st_size:
+            return entrada[2]
+        hash_ = hash_archivo(ruta)
+        with self._lock:
+            self._hashes[archivo] = (st.st_mtime_ns, st.st_size, hash_)
+        return hash_
+
+    # --- Vista ---
+    def servir(self, filename):
+        archivo, hash_pedido = filename, None
+        coincide = PATRON_VERSIONADO.match(filename)
+        if coincide:
+            original = coincide.group('base') + coincide.group('ext')
+            ruta_original = safe_join(self.app.static_folder, original)
+            if ruta_original and os.path.isfile(ruta_original):
+                archivo, hash_pedido = original, coincide.group('hash')
+
+        ruta = safe_join(self.app.static_folder, archivo)
+        if ruta is None or not os.path.isfile(ruta):
+            abort(404)
+
+        # Variante precomprimida, si el navegador la acepta y no quedó desactualizada
+        enviar, codificacion = ruta, None
+        compresible = os.path.splitext(archivo)[1].lower() in COMPRIMIBLES
+        if compresible:
+            mtime = os.path.getmtime(ruta)
+            for nombre, extension in VARIANTES:
+                variante = ruta + extension
+                if request.accept_encodings[nombre] and os.path.isfile(variante) \
+                        and os.path.getmtime(variante) >= mtime:
+                    enviar, codificacion = variante, nombre
+                    break
+
+        mimetype = mimetypes.guess_type(archivo)[0] or 'application/octet-stream'
+        respuesta = send_file(enviar, mimetype=mimetype, conditional=True, etag=True, max_age=None)
+        if codificacion:
+            respuesta.headers['Content-Encoding'] = codificacion
+        if compresible:
+            respuesta.vary.add('Accept-Encoding')
+
+        # Solo es inmutable si el hash de la URL corresponde al contenido actual
+        inmutable = hash_pedido is not None and hash_pedido == self.hash_de(archivo)
+        respuesta.headers['Cache-Control'] = CACHE_INMUTABLE if inmutable else CACHE_REVALIDAR
+        return respuesta
+
+    # --- Manifiesto y precompresión ---
+    def _leer_manifiesto(self, directorio):
+        ruta = os.path.join(directorio, ARCHIVO_MANIFIESTO)
+        if not os.path.exists(ruta):
+            return {}
+        try:
+            with open(ruta, encoding='utf-8') as f:
+                datos = json.load(f)
+            return {archivo: (e['mtime_ns'], e['tamano'], e['hash']) for archivo, e in datos.items()}
+        except (ValueError, KeyError, OSError) as e:
+            print(f"manifest.json de estáticos inválido, se ignora: {e}")
+            return {}
+
+    def construir(self):
+        """Calcula los hashes, escribe manifest.json y las variantes .gz/.br.
+
+        Brotli es opcional (paquete `brotli`); sin él solo se genera gzip.
+        Devuelve (archivos, comprimidos).
+        """
+        try:
+            import brotli
+        except ImportError:
+            brotli = None
+
+        directorio = self.app.static_folder
+        manifiesto, comprimidos = {}, 0
+        for raiz, _, nombres in os.walk(directorio):
+            for nombre in sorted(nombres):
+                if nombre == ARCHIVO_MANIFIESTO or nombre.endswith(('.gz', '.br')):
+                    continue
+                ruta = os.path.join(raiz, nombre)
+                archivo = os.path.relpath(ruta, directorio).replace(os.sep, '/')
+                st = os.stat(ruta)
+                manifiesto[archivo] = {'hash': hash_archivo(ruta), 'mtime_ns': st.st_mtime_ns, 'tamano': st.st_size}
+
+                if os.path.splitext(nombre)[1].lower() not in COMPRIMIBLES:
+                    continue
+                with open(ruta, 'rb') as f:
+                    contenido = f.read()
+                variantes = [('.gz', gzip.compress(contenido, compresslevel=9, mtime=0))]
+                if brotli is not None:
+                    variantes.append(('.br', brotli.compress(contenido, quality=11)))
+                for extension, datos in variantes:
+                    if len(datos) < len(contenido):  # Solo si de verdad ahorra bytes
+                        with open(ruta + extension, 'wb') as f:
+                            f.write(datos)
+                        comprimidos += 1
+
+        with open(os.path.join(directorio, ARCHIVO_MANIFIESTO), 'w', encoding='utf-8') as f:
+            json.dump(manifiesto, f, indent=1, sort_keys=True)
+        with self._lock:
+            self._hashes = {a: (e['mtime_ns'], e['tamano'], e['hash']) for a, e in manifiesto.items()}
+        return len(manifiesto), comprimidos
+
+    def compilar_css(self, binario=None):
+        """Genera static/css/app.css con el CLI standalone de Tailwind.
+
+        Tailwind recorre las rutas de `content` en tailwind.config.js
+        (plantillas y JS) y emite solo las clases que se usan, minificado.
+        Devuelve la ruta del archivo generado.
+        """
+        binario = binario or self.app.config.get('TAILWIND_BIN') or shutil.which('tailwindcss')
+        if not binario:
+            raise RuntimeError('No se encontró el ejecutable tailwindcss. Descárgalo desde '
+                               'https://github.com/tailwindlabs/tailwindcss/releases (versión 3.x, '
+                               'archivo standalone para tu sistema) y déjalo en el PATH o en TAILWIND_BIN.')
+
+        raiz = self.app.root_path
+        salida = os.path.join(self.app.static_folder, CSS_COMPILADO)
+        os.makedirs(os.path.dirname(salida), exist_ok=True)
+        subprocess.run([binario, '--config', os.path.join(raiz, CONFIG_TAILWIND),
+                        '--input', os.path.join(raiz, ENTRADA_CSS), '--output', salida, '--minify'],
+                       cwd=raiz, check=True)
+        return salida
+
+
+manifiesto_estaticos = ManifiestoEstaticos()
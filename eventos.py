@@ -0,0 +1,183 @@
+# eventos.py
+import re
+import threading
+import time
+from sqlalchemy import select, update, bindparam
+from models import db, Log, Usuario, Dashboard, Grupo, ProgramacionExportacion
+from base_datos import motor_lectura
+
+# Código guardado en logs.accion -> texto que se muestra. Los códigos son
+# cortos y fijos, así el índice (accion, timestamp, id) sirve para filtrar
+# y para listar las acciones sin depender de cómo se redactó cada mensaje.
+ACCIONES = {
+    'sesion.inicio': 'Inicio de Sesión',
+    'sesion.cierre': 'Cierre de Sesión',
+    'clave.cambio': 'Cambio de Clave',
+    'clave.recuperacion': 'Recuperación Clave',
+    'usuario.creacion': 'Creación de Usuario',
+    'usuario.importacion': 'Importación de Usuarios',
+    'usuario.edicion': 'Edición de Usuario',
+    'usuario.estado': 'Cambio de Estado',
+    'correo.reintento': 'Reintento de Correo',
+    'exportacion.solicitud': 'Exportación de Logs',
+    'programacion.creacion': 'Creación Programación',
+    'programacion.edicion': 'Edición Programación',
+    'programacion.eliminacion': 'Eliminación Programación',
+    'dashboard.creacion': 'Creación Dashboard',
+    'dashboard.edicion': 'Edición Dashboard',
+    'dashboard.estado': 'Cambio Estado Dashboard',
+    'grupo.creacion': 'Creación Grupo',
+    'grupo.edicion': 'Edición Grupo',
+    'grupo.estado': 'Cambio Estado Grupo',
+}
+
+# Tipo de entidad afectada (logs.entidad_tipo) -> texto que se muestra
+ENTIDADES = {
+    'usuario': 'Usuario',
+    'dashboard': 'Dashboard',
+    'grupo': 'Grupo',
+    'correo': 'Correo',
+    'exportacion': 'Exportación',
+    'programacion': 'Programación',
+}
+
+# Los logs anteriores a los códigos guardaban el texto; se aceptan ambos
+CODIGOS_POR_ETIQUETA = {etiqueta: codigo for codigo, etiqueta in ACCIONES.items()}
+
+DURACION_ACCIONES = 300  # segundos que se reutiliza la lista de acciones registradas
+TAM_LOTE = 5000
+
+
+def codigo_accion(accion):
+    """Código de una acción, aceptando también el texto antiguo ('Inicio de Sesión' -> 'sesion.inicio')."""
+    return CODIGOS_POR_ETIQUETA.get(accion, accion)
+
+
+def etiqueta_accion(accion):
+    """Texto para mostrar una acción (filtro de Jinja); los códigos desconocidos se muestran tal cual."""
+    return ACCIONES.get(accion, accion)
+
+
+def describir_entidad(tipo, id_):
+    """'Dashboard #12', o '' si el log no apunta a ninguna entidad."""
+    if not tipo:
+        return ''
+    texto = ENTIDADES.get(tipo, tipo)
+    return f'{texto} #{id_}' if id_ is not None else texto
+
+
+# --- ACCIONES REGISTRADAS ---
+_acciones = (0.0, [])
+_lock_acciones = threading.Lock()
+
+
+def acciones_registradas():
+    """Códigos de acción presentes en la tabla de logs, ordenados por su texto.
+
+    El SELECT DISTINCT se resuelve con el índice (accion, timestamp, id)
+    (en MySQL, recorriendo solo un valor por grupo) y se reutiliza durante
+    DURACION_ACCIONES segundos.
+    """
+    global _acciones
+    momento, codigos = _acciones
+    if time.monotonic() - momento < DURACION_ACCIONES:
+        return codigos
+    with _lock_acciones:
+        momento, codigos = _acciones
+        if time.monotonic() - momento < DURACION_ACCIONES:
+            return codigos
+        with motor_lectura(db).connect() as conn:
+            codigos = conn.execute(select(Log.accion).distinct()).scalars().all()
+        codigos = sorted(codigos, key=etiqueta_accion)
+        _acciones = (time.monotonic(), codigos)
+    return codigos
+
+
+# --- MIGRACIÓN DE LOGS ANTIGUOS ---
+_PATRON_EMAIL = re.compile(r'\(([^()\s]+@[^()\s]+)\)')
+_PATRON_COMILLAS = re.compile(r"'(.*)'")
+_PATRON_NUMERO = re.compile(r'#(\d+)')
+_PATRON_NOMBRE = {
+    'usuario.edicion': re.compile(r'^Editó datos de (.*) \('),
+    'usuario.estado': re.compile(r'^Usuario (.*) fue '),
+}
+
+
+def _unicos(pares):
+    """Diccionario texto -> id solo con los textos que identifican a una sola fila."""
+    ids = {}
+    for texto, id_ in pares:
+        ids[texto] = None if texto in ids else id_
+    return {texto: id_ for texto, id_ in ids.items() if id_ is not None}
+
+
+def _entidad_antigua(codigo, fila, tablas):
+    """(entidad_tipo, entidad_id) deducidos del texto de un log anterior a estas columnas."""
+    tipo = codigo.split('.')[0] if codigo in ACCIONES else None
+    if tipo in ('sesion', 'clave'):
+        return 'usuario', fila.usuario_id
+    if tipo not in ENTIDADES:
+        return None, None
+    detalles = fila.detalles or ''
+
+    if codigo == 'usuario.creacion':
+        encontrado = _PATRON_EMAIL.search(detalles)
+        return tipo, encontrado and tablas['email'].get(encontrado.group(1))
+    if codigo in _PATRON_NOMBRE:
+        encontrado = _PATRON_NOMBRE[codigo].search(detalles)
+        return tipo, encontrado and tablas['usuario'].get(encontrado.group(1))
+    if tipo in ('dashboard', 'grupo', 'programacion'):
+        encontrado = _PATRON_COMILLAS.search(detalles)
+        return tipo, encontrado and tablas[tipo].get(encontrado.group(1))
+    if tipo in ('correo', 'exportacion'):
+        encontrado = _PATRON_NUMERO.search(detalles)
+        return tipo, encontrado and int(encontrado.group(1))
+    return tipo, None
+
+
+def completar_logs(tam_lote=TAM_LOTE, salida=None):
+    """Pasa los logs antiguos a códigos de acción y completa la entidad afectada.
+
+    Recorre la tabla por id en lotes; el texto de la acción se cambia por su
+    código y la entidad se deduce de 'detalles' cuando el nombre o email
+    identifica a una sola fila (si no, queda solo el tipo). Las filas que ya
+    tienen código y entidad no se tocan, así se puede volver a ejecutar.
+    Devuelve (revisadas, actualizadas).
+    """
+    tablas = {
+        'email': _unicos(db.session.execute(select(Usuario.email, Usuario.id)).all()),
+        'usuario': _unicos(db.session.execute(select(Usuario.nombre_completo, Usuario.id)).all()),
+        'dashboard': _unicos(db.session.execute(select(Dashboard.titulo, Dashboard.id)).all()),
+        'grupo': _unicos(db.session.execute(select(Grupo.nombre, Grupo.id)).all()),
+        'programacion': _unicos(db.session.execute(
+            select(ProgramacionExportacion.nombre, ProgramacionExportacion.id)).all()),
+    }
+    sentencia = update(Log.__table__).where(Log.__table__.c.id == bindparam('_id')) \
+        .values(accion=bindparam('_accion'), entidad_tipo=bindparam('_tipo'), entidad_id=bindparam('_entidad_id'))
+
+    revisadas = actualizadas = 0
+    ultimo = 0
+    while True:
+        lote = db.session.execute(
+            select(Log.id, Log.usuario_id, Log.accion, Log.detalles, Log.entidad_tipo, Log.entidad_id)
+            .where(Log.id > ultimo).order_by(Log.id).limit(tam_lote)
+        ).all()
+        if not lote:
+            break
+        cambios = []
+        for fila in lote:
+            codigo = codigo_accion(fila.accion)
+            tipo, entidad_id = fila.entidad_tipo, fila.entidad_id
+            if tipo is None:
+                tipo, entidad_id = _entidad_antigua(codigo, fila, tablas)
+            if (codigo, tipo, entidad_id) != (fila.accion, fila.entidad_tipo, fila.entidad_id):
+                cambios.append({'_id': fila.id, '_accion': codigo, '_tipo': tipo, '_entidad_id': entidad_id})
+        if cambios:
+            db.session.execute(sentencia, cambios)
+            db.session.commit()
+        revisadas += len(lote)
+        actualizadas += len(cambios)
+        ultimo = lote[-1].id
+        if salida:
+            salida(f'{revisadas} logs revisados, {actualizadas} actualizados...')
+    return revisadas, actualizadas
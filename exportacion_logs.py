@@ -0,0 +1,134 @@
+# exportacion_logs.py
+import csv
+from datetime import datetime, timedelta
+from itertools import chain, islice
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font
+from openpyxl.utils import get_column_letter
+from sqlalchemy import select, func
+from models import db, Log
+from base_datos import motor_lectura
+from eventos import ENTIDADES, codigo_accion, etiqueta_accion, describir_entidad
+
+COLUMNAS = ['ID', 'Fecha y Hora', 'Usuario', 'Acción', 'Entidad', 'Detalles']
+FORMATO_FECHA = '%d-%m-%Y %H:%M:%S'
+
+TAM_LOTE = 2000          # filas por viaje al servidor (cursor del lado del servidor)
+FILAS_MUESTRA = 500      # filas usadas para estimar el ancho de columnas
+ANCHO_MAXIMO = 80        # para que un 'detalles' larguísimo no deforme la hoja
+
+
+# --- FILTROS ---
+def leer_filtros(args):
+    """Convierte los parámetros GET (usuario_id, accion, entidad, entidad_id, fecha_desde, fecha_hasta) en filtros."""
+    def _fecha(nombre):
+        valor = args.get(nombre, '').strip()
+        if not valor:
+            return None
+        try:
+            return datetime.strptime(valor, '%Y-%m-%d')
+        except ValueError:
+            return None
+
+    usuario_id = args.get('usuario_id', '').strip()
+    entidad = args.get('entidad', '').strip()
+    entidad_id = args.get('entidad_id', '').strip()
+    hasta = _fecha('fecha_hasta')
+    return {
+        'usuario_id': int(usuario_id) if usuario_id.isdigit() else None,
+        # Los enlaces guardados con el texto antiguo de la acción siguen sirviendo
+        'accion': codigo_accion(args.get('accion', '').strip()) or None,
+        'entidad': entidad if entidad in ENTIDADES else None,
+        # El id solo tiene sentido junto al tipo (así la búsqueda usa el índice de entidad)
+        'entidad_id': int(entidad_id) if entidad in ENTIDADES and entidad_id.isdigit() else None,
+        'desde': _fecha('fecha_desde'),
+        # La fecha 'hasta' es inclusiva: todo lo anterior al día siguiente
+        'hasta': hasta + timedelta(days=1) if hasta else None,
+    }
+
+
+def filtrar_logs(consulta, filtros):
+    """Aplica los filtros a una Query del ORM o a un select() de Core."""
+    if filtros.get('usuario_id'):
+        consulta = consulta.filter(Log.usuario_id == filtros['usuario_id'])
+    if filtros.get('accion'):
+        consulta = consulta.filter(Log.accion == filtros['accion'])
+    if filtros.get('entidad'):
+        consulta = consulta.filter(Log.entidad_tipo == filtros['entidad'])
+    if filtros.get('entidad_id') is not None:
+        consulta = consulta.filter(Log.entidad_id == filtros['entidad_id'])
+    if filtros.get('desde'):
+        consulta = consulta.filter(Log.timestamp >= filtros['desde'])
+    if filtros.get('hasta'):
+        consulta = consulta.filter(Log.timestamp < filtros['hasta'])
+    return consulta
+
+
+# --- LECTURA ---
+def iterar_filas(filtros, tam_lote=TAM_LOTE):
+    """Genera tuplas (id, timestamp, usuario, accion, entidad_tipo, entidad_id, detalles) sin cargar objetos ORM.
+
+    Usa un cursor del lado del servidor, así la memoria no depende del
+    tamaño de la tabla.
+    """
+    consulta = filtrar_logs(
+        select(Log.id, Log.timestamp, Log.usuario_nombre, Log.accion, Log.entidad_tipo, Log.entidad_id, Log.detalles),
+        filtros
+    ).order_by(Log.timestamp.desc(), Log.id.desc())
+
+    with motor_lectura(db).connect() as conn:
+        resultado = conn.execution_options(stream_results=True, yield_per=tam_lote).execute(consulta)
+        for particion in resultado.partitions():
+            for fila in particion:
+                yield fila
+
+
+def contar_filas(filtros):
+    """Cantidad de logs que cumplen los filtros (para mostrar el avance de una exportación)."""
+    with motor_lectura(db).connect() as conn:
+        return conn.execute(filtrar_logs(select(func.count()).select_from(Log), filtros)).scalar()
+
+
+def formatear_fila(fila):
+    id_, timestamp, usuario_nombre, accion, entidad_tipo, entidad_id, detalles = fila
+    return [id_, timestamp.strftime(FORMATO_FECHA), usuario_nombre, etiqueta_accion(accion),
+            describir_entidad(entidad_tipo, entidad_id), detalles]
+
+
+# --- ESCRITURA ---
+def escribir_xlsx(filas, destino, muestra=FILAS_MUESTRA):
+    """Escribe el reporte en modo write-only de openpyxl (memoria constante).
+
+    En este modo los anchos deben fijarse antes de la primera fila, por eso
+    se estiman con una muestra inicial en vez de recorrer todas las celdas.
+    """
+    filas = (formatear_fila(f) for f in filas)
+    primeras = list(islice(filas, muestra))
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet('Logs')
+
+    for i, encabezado in enumerate(COLUMNAS):
+        largo = max([len(encabezado)] + [len(str(f[i])) for f in primeras if f[i] is not None])
+        ws.column_dimensions[get_column_letter(i + 1)].width = min(largo, ANCHO_MAXIMO) + 2
+
+    encabezados = []
+    for texto in COLUMNAS:
+        celda = WriteOnlyCell(ws, value=texto)
+        celda.font = Font(bold=True)
+        encabezados.append(celda)
+    ws.append(encabezados)
+
+    for fila in chain(primeras, filas):
+        ws.append(fila)
+
+    wb.save(destino)
+
+
+def escribir_csv(filas, destino):
+    """Escribe el reporte como CSV UTF-8 con BOM (Excel lo abre con tildes correctas)."""
+    with open(destino, 'w', encoding='utf-8-sig', newline='') as f:
+        escritor = csv.writer(f)
+        escritor.writerow(COLUMNAS)
+        escritor.writerows(formatear_fila(fila) for fila in filas)
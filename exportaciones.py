@@ -0,0 +1,328 @@
+# exportaciones.py
+import atexit
+import json
+import os
+import threading
+from datetime import timedelta
+from sqlalchemy import select, update, func, or_, and_
+from models import db, ExportacionLogs, ProgramacionExportacion, obtener_hora_chile
+from exportacion_logs import leer_filtros, iterar_filas, contar_filas, escribir_xlsx, escribir_csv
+from retencion_logs import meses_archivados, iterar_filas_archivo, inicio_mes, sumar_meses
+from eventos import etiqueta_accion, describir_entidad
+
+FORMATOS = {
+    'xlsx': (escribir_xlsx, 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+    'csv': (escribir_csv, 'text/csv'),
+}
+ESTADOS = ('pendiente', 'procesando', 'lista', 'fallida', 'vencida')
+FRECUENCIAS = ('diaria', 'semanal', 'mensual')
+CLAVES_FILTRO = ('usuario_id', 'accion', 'entidad', 'entidad_id', 'fecha_desde', 'fecha_hasta', 'archivo')
+CADA_FILAS = 5000   # cada cuántas filas se guarda el avance y se renueva el plazo
+
+tabla = ExportacionLogs.__table__
+tabla_programaciones = ProgramacionExportacion.__table__
+
+
+# --- CALENDARIO ---
+def proxima_ejecucion(frecuencia, hora, desde):
+    """Primer momento posterior a `desde` en que toca la programación (a la `hora` indicada)."""
+    base = desde.replace(hour=hora, minute=0, second=0, microsecond=0)
+    if frecuencia == 'diaria':
+        candidato = base
+        paso = lambda f: f + timedelta(days=1)  # noqa: E731
+    elif frecuencia == 'semanal':
+        candidato = base - timedelta(days=base.weekday())  # Lunes
+        paso = lambda f: f + timedelta(days=7)  # noqa: E731
+    else:
+        candidato = inicio_mes(desde).replace(hour=hora)
+        paso = lambda f: sumar_meses(f, 1)  # noqa: E731
+    while candidato <= desde:
+        candidato = paso(candidato)
+    return candidato
+
+
+def periodo_anterior(frecuencia, momento):
+    """(desde, hasta) inclusivos del último día, semana (lunes a domingo) o mes completo antes de `momento`."""
+    dia = momento.date()
+    if frecuencia == 'diaria':
+        desde = hasta = dia - timedelta(days=1)
+    elif frecuencia == 'semanal':
+        hasta = dia - timedelta(days=dia.weekday() + 1)
+        desde = hasta - timedelta(days=6)
+    else:
+        hasta = dia.replace(day=1) - timedelta(days=1)
+        desde = hasta.replace(day=1)
+    return desde, hasta
+
+
+def describir_filtros(filtros):
+    partes = []
+    if filtros.get('archivo'):
+        partes.append(f"archivo {filtros['archivo']}")
+    if filtros.get('fecha_desde') or filtros.get('fecha_hasta'):
+        partes.append(f"{filtros.get('fecha_desde') or 'inicio'} a {filtros.get('fecha_hasta') or 'hoy'}")
+    if filtros.get('accion'):
+        partes.append(etiqueta_accion(filtros['accion']))
+    if filtros.get('entidad'):
+        partes.append(describir_entidad(filtros['entidad'], filtros.get('entidad_id')))
+    if filtros.get('usuario_id'):
+        partes.append(f"usuario #{filtros['usuario_id']}")
+    return ', '.join(partes) or 'Todos los logs'
+
+
+class GestorExportaciones:
+    """Reportes de logs (XLSX o CSV) generados fuera de la request.
+
+    solicitar() inserta un trabajo en exportaciones_logs y vuelve; un hilo
+    de fondo (EXPORTACIONES_HILOS por proceso) lo toma, lee los logs por
+    lotes y escribe el archivo en EXPORTACIONES_DIR, guardando el avance
+    cada CADA_FILAS filas para la página de exportaciones. El archivo
+    queda para descargar hasta expira_en; después se borra.
+
+    Un trabajo se toma con un UPDATE condicionado a sus intentos (como la
+    cola de correos) y `plazo` se renueva mientras avanza: si el proceso
+    muere, al vencer otro hilo lo retoma.
+
+    Las programaciones (diaria, semanal o mensual) se revisan en el mismo
+    bucle: a su hora, fuera del horario de uso, encolan el reporte del
+    período anterior completo, así el archivo ya está listo al pedirlo.
+    Con EXPORTACIONES_HILOS=0 ningún proceso web genera reportes y el
+    trabajo queda para `flask procesar-exportaciones` (cron o --continuo).
+    """
+
+    def __init__(self):
+        self.app = None
+        self.directorio = None
+        self.num_hilos = 1
+        self.dias_vigencia = 7
+        self.dias_vigencia_programadas = 40
+        self.max_intentos = 3
+        self.intervalo = 60.0
+        self.plazo = 600
+        self._hilos = []
+        self._pid = None
+        self._engine = None
+        self._lock = threading.Lock()
+        self._despertar = threading.Event()
+        self._detener = threading.Event()
+
+    def init_app(self, app):
+        self.app = app
+        config = app.config
+        self.directorio = config.get('EXPORTACIONES_DIR') or os.path.join(app.instance_path, 'exportaciones')
+        self.num_hilos = config.get('EXPORTACIONES_HILOS', self.num_hilos)
+        self.dias_vigencia = config.get('EXPORTACIONES_DIAS_VIGENCIA', self.dias_vigencia)
+        self.dias_vigencia_programadas = config.get('EXPORTACIONES_DIAS_VIGENCIA_PROGRAMADAS',
+                                                    self.dias_vigencia_programadas)
+        self.intervalo = config.get('EXPORTACIONES_INTERVALO', self.intervalo)
+        if self.num_hilos:
+            # Las programaciones necesitan el hilo vivo aunque nadie pida un reporte a mano
+            app.before_request(self._asegurar_hilos)
+        atexit.register(self.detener)
+
+    # --- API pública ---
+    def solicitar(self, formato, filtros, usuario_id=None, programacion_id=None, descripcion=None):
+        """Encola un reporte; `filtros` son los parámetros de ver_logs. Devuelve el ID del trabajo."""
+        if formato not in FORMATOS:
+            raise ValueError(f'Formato no soportado: {formato!r}')
+        filtros = {clave: str(valor) for clave, valor in filtros.items() if clave in CLAVES_FILTRO and valor}
+        with self._obtener_engine().begin() as conn:
+            exportacion_id = conn.execute(tabla.insert().values(
+                formato=formato, filtros=json.dumps(filtros, ensure_ascii=False),
+                descripcion=(descripcion or describir_filtros(filtros))[:255],
+                estado='pendiente', intentos=0, filas=0, solicitado_por=usuario_id,
+                programacion_id=programacion_id, creado_en=obtener_hora_chile(),
+            )).inserted_primary_key[0]
+        if self.num_hilos:
+            self._asegurar_hilos()
+            self._despertar.set()
+        return exportacion_id
+
+    def procesar_pendientes(self, limite=None):
+        """Genera los reportes en cola; devuelve cuántos se intentaron."""
+        procesados = 0
+        while limite is None or procesados < limite:
+            fila = self._reclamar()
+            if fila is None:
+                break
+            self._generar(fila)
+            procesados += 1
+        return procesados
+
+    def ejecutar_programaciones(self):
+        """Encola el reporte de cada programación a la que ya le tocó. Devuelve cuántas se encolaron."""
+        ahora = obtener_hora_chile()
+        t = tabla_programaciones
+        with self._obtener_engine().connect() as conn:
+            vencidas = conn.execute(select(t).where(t.c.activa.is_(True), t.c.proxima_ejecucion <= ahora)).all()
+
+        encoladas = 0
+        for p in vencidas:
+            # Si el servidor estuvo abajo varios períodos se genera solo el último, no uno por cada uno
+            momento = p.proxima_ejecucion
+            while (siguiente := proxima_ejecucion(p.frecuencia, p.hora, momento)) <= ahora:
+                momento = siguiente
+            with self._obtener_engine().begin() as conn:
+                tomada = conn.execute(
+                    update(t).where(t.c.id == p.id, t.c.proxima_ejecucion == p.proxima_ejecucion)
+                    .values(proxima_ejecucion=siguiente)
+                ).rowcount
+            if not tomada:
+                continue  # Otro hilo o proceso la encoló
+            desde, hasta = periodo_anterior(p.frecuencia, momento)
+            filtros = {'fecha_desde': desde.isoformat(), 'fecha_hasta': hasta.isoformat(),
+                       'accion': p.accion, 'usuario_id': p.usuario_id}
+            self.solicitar(p.formato, filtros, programacion_id=p.id,
+                           descripcion=f'{p.nombre}: {desde:%d-%m-%Y} a {hasta:%d-%m-%Y}')
+            encoladas += 1
+        return encoladas
+
+    def limpiar_vencidas(self):
+        """Borra los archivos cuyo plazo de descarga terminó. Devuelve cuántos se borraron."""
+        ahora = obtener_hora_chile()
+        with self._obtener_engine().connect() as conn:
+            vencidas = conn.execute(
+                select(tabla.c.id, tabla.c.archivo).where(tabla.c.estado == 'lista', tabla.c.expira_en < ahora)
+            ).all()
+        for exportacion_id, archivo in vencidas:
+            try:
+                os.remove(os.path.join(self.directorio, archivo))
+            except FileNotFoundError:
+                pass
+            with self._obtener_engine().begin() as conn:
+                conn.execute(update(tabla).where(tabla.c.id == exportacion_id).values(estado='vencida'))
+        return len(vencidas)
+
+    def ruta(self, exportacion):
+        """Ruta del archivo de una exportación lista, o None si ya no está."""
+        if exportacion.estado != 'lista' or not exportacion.archivo:
+            return None
+        ruta = os.path.join(self.directorio, exportacion.archivo)
+        return ruta if os.path.exists(ruta) else None
+
+    def resumen(self):
+        conteo = dict(db.session.execute(select(tabla.c.estado, func.count()).group_by(tabla.c.estado)).all())
+        return {
+            'por_estado': {estado: conteo.get(estado, 0) for estado in ESTADOS},
+            'hilos_vivos': sum(1 for h in self._hilos if h.is_alive()) if self._pid == os.getpid() else 0,
+        }
+
+    def ciclo(self):
+        """Una pasada completa: programaciones, cola y limpieza (lo que hace cada hilo en su bucle)."""
+        self.ejecutar_programaciones()
+        procesados = self.procesar_pendientes()
+        self.limpiar_vencidas()
+        return procesados
+
+    def detener(self, timeout=5):
+        self._detener.set()
+        self._despertar.set()
+        if self._pid == os.getpid():
+            for hilo in self._hilos:
+                hilo.join(timeout)
+
+    # --- Interno ---
+    def _asegurar_hilos(self):
+        # Se arrancan en el primer uso y de nuevo tras un fork (gunicorn --preload)
+        if self._hilos and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._hilos and self._pid == os.getpid():
+                return
+            self._engine = None
+            self._detener.clear()
+            self._pid = os.getpid()
+            self._hilos = [
+                threading.Thread(target=self._bucle, name=f'exportaciones-{i}', daemon=True)
+                for i in range(self.num_hilos)
+            ]
+            for hilo in self._hilos:
+                hilo.start()
+
+    def _bucle(self):
+        while not self._detener.is_set():
+            try:
+                self.ciclo()
+            except Exception as e:
+                print(f"Error en las exportaciones en segundo plano: {e}")
+            self._despertar.wait(self.intervalo)
+            self._despertar.clear()
+
+    def _obtener_engine(self):
+        if self._engine is None:
+            with self.app.app_context():
+                self._engine = db.engine
+        return self._engine
+
+    def _reclamar(self):
+        """Toma el próximo trabajo pendiente (o abandonado), o None si no hay."""
+        ahora = obtener_hora_chile()
+        disponible = or_(tabla.c.estado == 'pendiente', and_(tabla.c.estado == 'procesando', tabla.c.plazo < ahora))
+        with self._obtener_engine().begin() as conn:
+            candidatos = conn.execute(
+                select(tabla.c.id, tabla.c.intentos).where(disponible).order_by(tabla.c.id).limit(self.num_hilos + 1)
+            ).all()
+
+        for exportacion_id, intentos in candidatos:
+            with self._obtener_engine().begin() as conn:
+                condicion = and_(tabla.c.id == exportacion_id, tabla.c.intentos == intentos, disponible)
+                if intentos >= self.max_intentos:
+                    # Se cayó el proceso varias veces con este reporte: no se sigue insistiendo
+                    conn.execute(update(tabla).where(condicion).values(
+                        estado='fallida', error='El proceso se interrumpió en cada intento.', terminado_en=ahora))
+                    continue
+                tomado = conn.execute(update(tabla).where(condicion).values(
+                    estado='procesando', intentos=intentos + 1, filas=0, iniciado_en=ahora,
+                    plazo=ahora + timedelta(seconds=self.plazo),
+                )).rowcount
+                if tomado:
+                    return conn.execute(select(tabla).where(tabla.c.id == exportacion_id)).one()
+        return None
+
+    def _actualizar(self, fila, **valores):
+        # Condicionado a los intentos: si otro hilo lo retomó por plazo vencido, no lo pisamos
+        with self._obtener_engine().begin() as conn:
+            return conn.execute(update(tabla).where(tabla.c.id == fila.id, tabla.c.intentos == fila.intentos)
+                                .values(**valores)).rowcount
+
+    def _con_avance(self, fila, filas):
+        n = 0
+        for n, registro in enumerate(filas, 1):
+            yield registro
+            if n % CADA_FILAS == 0:
+                self._actualizar(fila, filas=n, plazo=obtener_hora_chile() + timedelta(seconds=self.plazo))
+        self._actualizar(fila, filas=n)
+
+    def _generar(self, fila):
+        escribir = FORMATOS[fila.formato][0]
+        nombre = f'logs_{fila.id}.{fila.formato}'
+        destino = os.path.join(self.directorio, nombre)
+        temporal = f'{destino}.{os.getpid()}.tmp'
+        os.makedirs(self.directorio, exist_ok=True)
+        try:
+            with self.app.app_context():
+                parametros = json.loads(fila.filtros)
+                filtros = leer_filtros(parametros)
+                mes = parametros.get('archivo')
+                if mes and mes in meses_archivados():
+                    filas = iterar_filas_archivo(mes, filtros)
+                else:
+                    self._actualizar(fila, total_estimado=contar_filas(filtros))
+                    filas = iterar_filas(filtros)
+                escribir(self._con_avance(fila, filas), temporal)
+            os.replace(temporal, destino)
+        except Exception as e:
+            if os.path.exists(temporal):
+                os.remove(temporal)
+            print(f"Error al generar la exportación {fila.id}: {e}")
+            self._actualizar(fila, estado='fallida', error=str(e), terminado_en=obtener_hora_chile(), plazo=None)
+            return
+
+        ahora = obtener_hora_chile()
+        dias = self.dias_vigencia_programadas if fila.programacion_id else self.dias_vigencia
+        if not self._actualizar(fila, estado='lista', archivo=nombre, tamano=os.path.getsize(destino),
+                                terminado_en=ahora, expira_en=ahora + timedelta(days=dias), plazo=None):
+            print(f"La exportación {fila.id} fue retomada por otro proceso antes de terminar.")
+
+
+gestor_exportaciones = GestorExportaciones()
@@ -0,0 +1,82 @@
+# fragmentos.py
+import threading
+import time
+from collections import OrderedDict
+from markupsafe import Markup
+
+
+class CacheFragmentos:
+    """Caché LRU de HTML ya renderizado, local a cada proceso.
+
+    La clave es (vista, grupo, huella de permisos, versión del catálogo):
+    todos los lectores con el mismo conjunto de permisos comparten la
+    misma entrada. Al crear/editar/activar grupos o dashboards se llama a
+    invalidar(), que sube la versión y vacía la caché; un render que
+    empezó antes queda guardado con la versión vieja y nunca se lee.
+
+    Está acotada por cantidad de entradas y por bytes. Como cada proceso
+    tiene su copia, las entradas vencen a los FRAGMENTOS_TTL segundos para
+    recoger cambios hechos desde otro worker.
+    """
+
+    def __init__(self, ttl=300, max_entradas=2000, max_bytes=32 * 1024 * 1024):
+        self.ttl = ttl
+        self.max_entradas = max_entradas
+        self.max_bytes = max_bytes
+        self.version = 0
+        self.aciertos = 0
+        self.fallos = 0
+        self._entradas = OrderedDict()   # clave -> (valor, bytes, expira)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.ttl = app.config.get('FRAGMENTOS_TTL', self.ttl)
+        self.max_entradas = app.config.get('FRAGMENTOS_MAX_ENTRADAS', self.max_entradas)
+        self.max_bytes = app.config.get('FRAGMENTOS_MAX_BYTES', self.max_bytes)
+
+    def obtener(self, vista, grupo_id, huella, generar):
+        """Devuelve el fragmento cacheado o lo genera con `generar()`.
+
+        `generar` devuelve un str o una tupla de str (p. ej. título y cuerpo);
+        se entregan como Markup para insertarlos sin escapar.
+        """
+        ahora = time.monotonic()
+        with self._lock:
+            clave = (vista, grupo_id, huella, self.version)
+            entrada = self._entradas.get(clave)
+            if entrada and entrada[2] > ahora:
+                self._entradas.move_to_end(clave)
+                self.aciertos += 1
+                return entrada[0]
+            self.fallos += 1
+
+        valor = generar()
+        valor = tuple(Markup(v) for v in valor) if isinstance(valor, tuple) else Markup(valor)
+        # Se cuentan caracteres: el HTML es casi todo ASCII, así que equivale a bytes
+        tamano = sum(len(v) for v in valor) if isinstance(valor, tuple) else len(valor)
+        if tamano > self.max_bytes // 10:
+            return valor  # Demasiado grande para que valga la pena ocupar la caché
+
+        with self._lock:
+            self._quitar(clave)
+            self._entradas[clave] = (valor, tamano, ahora + self.ttl)
+            self._bytes += tamano
+            while self._entradas and (len(self._entradas) > self.max_entradas or self._bytes > self.max_bytes):
+                self._quitar(next(iter(self._entradas)))
+        return valor
+
+    def invalidar(self):
+        """El catálogo cambió: nada de lo renderizado sirve."""
+        with self._lock:
+            self.version += 1
+            self._entradas.clear()
+            self._bytes = 0
+
+    def _quitar(self, clave):
+        entrada = self._entradas.pop(clave, None)
+        if entrada:
+            self._bytes -= entrada[1]
+
+
+cache_fragmentos = CacheFragmentos()
@@ -0,0 +1,140 @@
+# hashing.py
+import atexit
+import math
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from werkzeug.security import generate_password_hash, check_password_hash
+
+
+class HashOcupado(Exception):
+    """Hay demasiados hashes en espera; conviene pedir al usuario que reintente.
+
+    `reintentar_en` son los segundos sugeridos para la cabecera Retry-After.
+    """
+
+    def __init__(self, reintentar_en=1):
+        super().__init__('Hay demasiados hashes en espera; intenta nuevamente en unos segundos.')
+        self.reintentar_en = reintentar_en
+
+
+class ProcesadorHash:
+    """Calcula y verifica hashes de contraseñas en un pool de procesos.
+
+    scrypt/pbkdf2 son caros a propósito; hechos en el hilo de la request,
+    unas decenas de logins simultáneos dejan a todos los workers ocupados
+    y el resto de las páginas se traban. Aquí se mandan a un pool de
+    HASH_PROCESOS procesos y la request solo espera el resultado.
+
+    El pool es por proceso de la app: con gunicorn hay uno por worker, así
+    que en total corren HASH_PROCESOS × workers procesos de hash. Por eso
+    el valor por defecto es chico (2); conviene que el total no pase de la
+    cantidad de núcleos.
+
+    La cola es acotada (HASH_COLA_MAX): si se llena, generar() y verificar()
+    esperan hasta HASH_ESPERA_MAX segundos y luego lanzan HashOcupado, para
+    que la request responda "intenta de nuevo" (503 con Retry-After) en vez
+    de acumular requests.
+
+    HASH_METODO es la política de costo (formato de Werkzeug, p. ej.
+    'scrypt:32768:8:1' o 'pbkdf2:sha256:600000'); los hashes guardados
+    con otra política se recalculan al iniciar sesión.
+    """
+
+    def __init__(self):
+        self.procesos = 2
+        self.metodo = 'scrypt'
+        self.cola_max = self.procesos * 8
+        self.espera_max = 10.0
+        self._pool = None
+        self._pid = None
+        self._cupos = threading.BoundedSemaphore(self.cola_max)
+        self._prefijo = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.procesos = app.config.get('HASH_PROCESOS', self.procesos)
+        self.metodo = app.config.get('HASH_METODO', self.metodo)
+        self.cola_max = app.config.get('HASH_COLA_MAX') or max(self.procesos, 1) * 8
+        self.espera_max = app.config.get('HASH_ESPERA_MAX', self.espera_max)
+        self._cupos = threading.BoundedSemaphore(self.cola_max)
+        self._prefijo = None
+        atexit.register(self.cerrar)
+
+    # --- API pública ---
+    def generar(self, password):
+        return self._ejecutar(generate_password_hash, password, self.metodo, espera=self.espera_max)
+
+    def generar_lote(self, passwords):
+        """Hashea varias contraseñas repartiéndolas entre todos los procesos."""
+        pool = self._obtener_pool()
+        if pool is None:
+            return [generate_password_hash(p, self.metodo) for p in passwords]
+        return list(pool.map(generate_password_hash, passwords, [self.metodo] * len(passwords),
+                             chunksize=max(1, len(passwords) // (self.procesos * 4))))
+
+    def verificar(self, password_hash, password):
+        if not password_hash or password is None:
+            return False
+        return self._ejecutar(check_password_hash, password_hash, password, espera=self.espera_max)
+
+    def necesita_rehash(self, password_hash):
+        """True si el hash se generó con una política distinta a HASH_METODO."""
+        return password_hash.split('$', 1)[0] != self.prefijo()
+
+    def prefijo(self):
+        # Werkzeug completa los parámetros por defecto ('scrypt' -> 'scrypt:32768:8:1');
+        # la forma más fiel de saber cómo queda es generar un hash una vez.
+        if self._prefijo is None:
+            self._prefijo = self.generar('-').split('$', 1)[0]
+        return self._prefijo
+
+    def cerrar(self):
+        with self._lock:
+            if self._pool is not None and self._pid == os.getpid():
+                self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    # --- Interno ---
+    def _obtener_pool(self):
+        if not self.procesos:
+            return None  # HASH_PROCESOS=0: se calcula en el mismo hilo
+        if self._pool is not None and self._pid == os.getpid():
+            return self._pool
+        with self._lock:
+            if self._pool is None or self._pid != os.getpid():
+                # 'spawn': los procesos hijos no heredan hilos ni conexiones de la app
+                self._pool = ProcessPoolExecutor(max_workers=self.procesos,
+                                                 mp_context=multiprocessing.get_context('spawn'))
+                self._pid = os.getpid()
+            return self._pool
+
+    def _ejecutar(self, funcion, *args, espera=None):
+        pool = self._obtener_pool()
+        if pool is None:
+            return funcion(*args)
+
+        cupos = self._cupos
+        if not cupos.acquire(timeout=espera):
+            raise HashOcupado(max(1, math.ceil(espera)))
+        try:
+            try:
+                return pool.submit(funcion, *args).result()
+            except BrokenProcessPool:
+                # Un proceso hijo murió (OOM, kill): se cierra el pool roto y se reintenta una vez en uno
+                # nuevo, sin soltar el cupo (calcularlo aquí saltaría el límite de HASH_COLA_MAX)
+                self._descartar_pool(pool)
+                return self._obtener_pool().submit(funcion, *args).result()
+        finally:
+            cupos.release()
+
+    def _descartar_pool(self, pool):
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+procesador_hash = ProcesadorHash()
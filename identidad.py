@@ -0,0 +1,356 @@
+# identidad.py
+import atexit
+import os
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from sqlalchemy import MetaData, Table, Column, Integer, String, Boolean, select, insert, update, bindparam
+from sqlalchemy.exc import SQLAlchemyError
+from models import db, Usuario
+from hashing import procesador_hash
+from base_datos import BIND_GLOBAL
+from cache_usuarios import cache_usuarios
+
+# Lo que la BD global sabe de una persona; el rol y los permisos siguen siendo locales
+Identidad = namedtuple('Identidad', ['email', 'nombre_completo', 'password_hash', 'activo'])
+
+# motivo: None (ok) | 'credenciales' | 'inactivo' | 'sin_acceso'
+ResultadoLogin = namedtuple('ResultadoLogin', ['usuario', 'motivo'])
+
+
+class ErrorIdentidad(Exception):
+    """La BD global no respondió y no hay datos recientes del usuario para validar."""
+
+
+class ProveedorIdentidad:
+    """Valida credenciales contra la BD local o contra la BD de identidad global.
+
+    Sin DATABASE_URL_GLOBAL se comporta como siempre: la tabla `usuarios`
+    local es la identidad. Con ella (despliegue produccion-global) la
+    clave, el nombre y el estado se leen de la tabla global por un bind
+    con pool propio, y el rol y los permisos siguen saliendo de la tabla
+    local, que se busca por email.
+
+    Las consultas a la BD global se guardan en una caché por proceso:
+    IDENTIDAD_TTL segundos las encontradas y IDENTIDAD_TTL_NEGATIVO las
+    que no existen. Si la clave no coincide con la identidad en caché se
+    consulta una vez más (pudo cambiar hace poco). Si la BD global falla,
+    durante IDENTIDAD_ESPERA_FALLO segundos no se vuelve a intentar y se
+    usa lo último conocido (hasta IDENTIDAD_GRACIA segundos) o, con
+    IDENTIDAD_RESPALDO_LOCAL, la copia en la tabla local.
+
+    El nombre y el hash de la clave se copian a la tabla local por lotes
+    desde un hilo de fondo (o completos con `flask sincronizar-identidades`),
+    así los logins no escriben y la copia local sirve de respaldo.
+    """
+
+    def __init__(self):
+        self.app = None
+        self.global_ = False
+        self.ttl = 60
+        self.ttl_negativo = 15
+        self.gracia = 3600
+        self.espera_fallo = 30
+        self.respaldo_local = True
+        self.max_entradas = 5000
+        self.asincrono = True
+        self.intervalo = 5.0
+        self.lote_max = 500
+        self.tabla = None
+        self.fallos = 0
+        self._entradas = OrderedDict()  # email -> (identidad o None, momento de la consulta)
+        self._fallo_hasta = 0.0
+        self._pendientes = {}           # usuario_id -> Identidad por copiar a la tabla local
+        self._engine = None
+        self._hilo = None
+        self._pid = None
+        self._despertar = threading.Event()
+        self._detener = threading.Event()
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.app = app
+        self.global_ = bool(app.config.get('DATABASE_URL_GLOBAL'))
+        # Los formularios de usuarios no piden clave al crear si esta vive en la BD global
+        app.jinja_env.globals['identidad_global'] = self.global_
+        self.ttl = app.config.get('IDENTIDAD_TTL', self.ttl)
+        self.ttl_negativo = app.config.get('IDENTIDAD_TTL_NEGATIVO', self.ttl_negativo)
+        self.gracia = app.config.get('IDENTIDAD_GRACIA', self.gracia)
+        self.espera_fallo = app.config.get('IDENTIDAD_ESPERA_FALLO', self.espera_fallo)
+        self.respaldo_local = app.config.get('IDENTIDAD_RESPALDO_LOCAL', self.respaldo_local)
+        self.max_entradas = app.config.get('IDENTIDAD_CACHE_MAX', self.max_entradas)
+        self.asincrono = app.config.get('IDENTIDAD_ASINCRONO', self.asincrono)
+        self.intervalo = app.config.get('IDENTIDAD_INTERVALO_SINCRONIZACION', self.intervalo)
+        self.tabla = Table(
+            app.config.get('IDENTIDAD_TABLA', 'usuarios'), MetaData(),
+            Column('id', Integer, primary_key=True),
+            Column('email', String(255), unique=True, nullable=False),
+            Column('nombre_completo', String(255), nullable=False),
+            Column('password_hash', String(255), nullable=False),
+            Column('activo', Boolean, default=True),
+        )
+        atexit.register(self.detener)
+
+    # --- Login ---
+    def autenticar(self, email, password):
+        """Valida email y clave. Devuelve ResultadoLogin; puede lanzar HashOcupado o ErrorIdentidad."""
+        if not self.global_:
+            return self._autenticar_local(email, password)
+
+        usuario = None
+        try:
+            identidad, de_cache = self._buscar(email)
+        except ErrorIdentidad:
+            if not self.respaldo_local:
+                raise
+            usuario = Usuario.query.filter_by(email=email).first()
+            identidad, de_cache = (_identidad_de(usuario) if usuario else None), False
+
+        if identidad is None:
+            return ResultadoLogin(None, 'credenciales')
+        if not identidad.activo:
+            return ResultadoLogin(None, 'inactivo')
+
+        clave_correcta = procesador_hash.verificar(identidad.password_hash, password)
+        if not clave_correcta and de_cache:
+            # La clave pudo cambiar en la BD global después de guardarla en caché
+            try:
+                identidad, _ = self._buscar(email, fresca=True)
+            except ErrorIdentidad:
+                identidad = None
+            clave_correcta = identidad is not None and identidad.activo and \
+                procesador_hash.verificar(identidad.password_hash, password)
+        if not clave_correcta:
+            return ResultadoLogin(None, 'credenciales')
+
+        # Autorización local: sin fila en `usuarios` la persona no tiene acceso a este sistema
+        if usuario is None:
+            usuario = Usuario.query.filter_by(email=email).first()
+        if usuario is None:
+            return ResultadoLogin(None, 'sin_acceso')
+        if not usuario.activo:
+            return ResultadoLogin(None, 'inactivo')
+        self.sincronizar(usuario, identidad)
+        return ResultadoLogin(usuario, None)
+
+    def _autenticar_local(self, email, password):
+        usuario = Usuario.query.filter_by(email=email).first()
+        if usuario is None:
+            return ResultadoLogin(None, 'credenciales')
+        if not usuario.activo:
+            return ResultadoLogin(None, 'inactivo')
+        if not usuario.check_password(password):
+            return ResultadoLogin(None, 'credenciales')
+        # Si el hash se guardó con una política de costo anterior, lo actualizamos ahora que tenemos la clave
+        if usuario.rehash_si_corresponde(password):
+            db.session.commit()
+        return ResultadoLogin(usuario, None)
+
+    def cambiar_clave(self, usuario, password):
+        """Cambia la clave de `usuario` donde se valida el login. Puede lanzar HashOcupado o ErrorIdentidad.
+
+        Con la BD global la clave se escribe primero allá (si no, el login
+        seguiría aceptando la anterior y la sincronización pisaría la local)
+        y luego se deja la misma copia en la tabla local. El commit de la
+        sesión local queda para quien llama.
+        """
+        usuario.set_password(password)
+        if not self.global_:
+            return
+        t = self.tabla
+        try:
+            with self._obtener_engine().begin() as conn:
+                cambiadas = conn.execute(
+                    update(t).where(t.c.email == usuario.email).values(password_hash=usuario.password_hash)
+                ).rowcount
+        except SQLAlchemyError as e:
+            print(f"No se pudo cambiar la clave en la BD de identidad global ({e.__class__.__name__}).")
+            raise ErrorIdentidad('La BD de identidad global no está disponible.') from e
+        finally:
+            self.invalidar(usuario.email)
+        if not cambiadas:
+            raise ErrorIdentidad(f'{usuario.email} no existe en la BD de identidad global.')
+
+    # --- Caché de la BD global ---
+    def buscar(self, email):
+        """Identidad global de `email` (None si no existe), desde la caché si está vigente."""
+        return self._buscar(email)[0]
+
+    def _buscar(self, email, fresca=False):
+        ahora = time.monotonic()
+        with self._lock:
+            entrada = self._entradas.get(email)
+            if entrada is not None and not fresca:
+                identidad, momento = entrada
+                if ahora - momento < (self.ttl if identidad else self.ttl_negativo):
+                    self._entradas.move_to_end(email)
+                    return identidad, True
+
+        if ahora < self._fallo_hasta:
+            return self._ultima_conocida(entrada, ahora), True
+        try:
+            identidad = self._consultar(email)
+        except SQLAlchemyError as e:
+            # Se deja de intentar un rato: cada login no debe esperar el timeout de conexión
+            self.fallos += 1
+            self._fallo_hasta = ahora + self.espera_fallo
+            print(f"BD de identidad global no disponible ({e.__class__.__name__}): "
+                  f"se reintenta en {self.espera_fallo} s.")
+            return self._ultima_conocida(entrada, ahora), True
+
+        with self._lock:
+            self._entradas[email] = (identidad, ahora)
+            self._entradas.move_to_end(email)
+            while len(self._entradas) > self.max_entradas:
+                self._entradas.popitem(last=False)
+        return identidad, False
+
+    def _ultima_conocida(self, entrada, ahora):
+        if entrada is not None and entrada[0] is not None and ahora - entrada[1] < self.gracia:
+            return entrada[0]
+        raise ErrorIdentidad('La BD de identidad global no está disponible.')
+
+    def _consultar(self, email):
+        t = self.tabla
+        with self._obtener_engine().connect() as conn:
+            fila = conn.execute(
+                select(t.c.email, t.c.nombre_completo, t.c.password_hash, t.c.activo).where(t.c.email == email)
+            ).first()
+        return Identidad(*fila) if fila else None
+
+    def invalidar(self, email=None):
+        """Olvida la identidad de `email` (o todas) para que la próxima consulta vaya a la BD global."""
+        with self._lock:
+            if email is None:
+                self._entradas.clear()
+            else:
+                self._entradas.pop(email, None)
+        if email is None:
+            self._fallo_hasta = 0.0
+
+    # --- Copia a la tabla local ---
+    def sincronizar(self, usuario, identidad):
+        """Deja en cola la copia de nombre y hash a `usuario` si difieren de la identidad global."""
+        if usuario.nombre_completo == identidad.nombre_completo and usuario.password_hash == identidad.password_hash:
+            return
+        if not self.asincrono:
+            self._escribir({usuario.id: identidad})
+            return
+        self._asegurar_hilo()
+        with self._lock:
+            self._pendientes[usuario.id] = identidad
+            lleno = len(self._pendientes) >= self.lote_max
+        if lleno:
+            self._despertar.set()
+
+    def sincronizar_todo(self, lote=500, salida=print):
+        """Recorre la tabla global por lotes y copia a `usuarios` lo que cambió. Devuelve (revisados, copiados)."""
+        t, local = self.tabla, Usuario.__table__
+        revisados = copiados = 0
+        ultimo_id = 0
+        while True:
+            with self._obtener_engine().connect() as conn:
+                filas = conn.execute(
+                    select(t.c.id, t.c.email, t.c.nombre_completo, t.c.password_hash, t.c.activo)
+                    .where(t.c.id > ultimo_id).order_by(t.c.id).limit(lote)
+                ).all()
+            if not filas:
+                break
+            ultimo_id = filas[-1].id
+            globales = {f.email: Identidad(f.email, f.nombre_completo, f.password_hash, f.activo) for f in filas}
+            with db.engine.connect() as conn:
+                locales = conn.execute(
+                    select(local.c.id, local.c.email, local.c.nombre_completo, local.c.password_hash)
+                    .where(local.c.email.in_(list(globales)))
+                ).all()
+            cambios = {f.id: globales[f.email] for f in locales
+                       if (f.nombre_completo, f.password_hash) != (globales[f.email].nombre_completo,
+                                                                   globales[f.email].password_hash)}
+            if cambios:
+                self._escribir(cambios)
+            revisados += len(filas)
+            copiados += len(cambios)
+            salida(f'  {revisados} identidades revisadas, {copiados} copiadas')
+        return revisados, copiados
+
+    def poblar_desde_local(self):
+        """Crea la tabla global y la llena con los usuarios locales (solo para una BD global SQLite de pruebas)."""
+        engine = self._obtener_engine()
+        if engine.dialect.name != 'sqlite':
+            raise RuntimeError('Solo se puebla una BD global SQLite de pruebas, nunca la BD de identidad real.')
+        self.tabla.drop(engine, checkfirst=True)
+        self.tabla.create(engine)
+        local = Usuario.__table__
+        with db.engine.connect() as conn:
+            filas = [dict(f._mapping) for f in conn.execute(
+                select(local.c.id, local.c.email, local.c.nombre_completo, local.c.password_hash, local.c.activo))]
+        with engine.begin() as conn:
+            for desde in range(0, len(filas), self.lote_max):
+                conn.execute(insert(self.tabla), filas[desde:desde + self.lote_max])
+        self.invalidar()
+        return len(filas)
+
+    def vaciar(self):
+        """Escribe ahora las copias pendientes (útil en scripts y pruebas)."""
+        with self._lock:
+            pendientes, self._pendientes = self._pendientes, {}
+        if pendientes:
+            self._escribir(pendientes)
+
+    def detener(self, timeout=10):
+        self._detener.set()
+        self._despertar.set()
+        hilo = self._hilo
+        if hilo is not None and hilo.is_alive() and self._pid == os.getpid():
+            hilo.join(timeout)
+        self.vaciar()
+
+    # --- Interno ---
+    def _obtener_engine(self):
+        if self._engine is None:
+            with self.app.app_context():
+                self._engine = db.engines[BIND_GLOBAL]
+        return self._engine
+
+    def _asegurar_hilo(self):
+        # Se arranca en el primer uso y de nuevo tras un fork (gunicorn --preload)
+        if self._hilo is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._hilo is not None and self._pid == os.getpid():
+                return
+            self._pendientes = {}
+            self._detener.clear()
+            self._pid = os.getpid()
+            self._hilo = threading.Thread(target=self._bucle, name='sincronizador-identidades', daemon=True)
+            self._hilo.start()
+
+    def _bucle(self):
+        while not self._detener.is_set():
+            self._despertar.wait(self.intervalo)
+            self._despertar.clear()
+            self.vaciar()
+
+    def _escribir(self, cambios):
+        """UPDATE por lotes (executemany) de nombre y hash en la tabla local."""
+        local = Usuario.__table__
+        sentencia = update(local).where(local.c.id == bindparam('_id')).values(
+            nombre_completo=bindparam('_nombre'), password_hash=bindparam('_hash'))
+        filas = [{'_id': usuario_id, '_nombre': i.nombre_completo, '_hash': i.password_hash}
+                 for usuario_id, i in cambios.items()]
+        try:
+            with self.app.app_context(), db.engine.begin() as conn:
+                for desde in range(0, len(filas), self.lote_max):
+                    conn.execute(sentencia, filas[desde:desde + self.lote_max])
+        except Exception as e:
+            print(f"Error al copiar {len(filas)} identidad(es) a la tabla local: {e}")
+            return
+        for usuario_id in cambios:
+            cache_usuarios.invalidar(usuario_id)
+
+
+def _identidad_de(usuario):
+    return Identidad(usuario.email, usuario.nombre_completo, usuario.password_hash, usuario.activo)
+
+
+proveedor_identidad = ProveedorIdentidad()
@@ -0,0 +1,239 @@
+# imagenes.py
+import atexit
+import hashlib
+import io
+import json
+import os
+import queue
+import threading
+from flask import url_for
+from fragmentos import cache_fragmentos
+
+CARPETA = 'previews'   # dentro de static/
+FORMATOS = {'PNG': '.png', 'JPEG': '.jpg', 'WEBP': '.webp', 'GIF': '.gif'}
+
+
+class ErrorImagen(Exception):
+    """La imagen subida no es válida (formato, tamaño o archivo dañado)."""
+
+
+class ProcesadorImagenes:
+    """Guarda las imágenes de grupos y dashboards y genera sus variantes.
+
+    guardar() valida la imagen subida y la deja en static/previews con el
+    hash del contenido como nombre: dos archivos iguales quedan en uno
+    solo y dos distintos con el mismo nombre ya no se pisan.
+
+    Las variantes (un ancho por cada IMAGENES_ANCHOS menor que el original,
+    en WebP y en JPEG, o PNG si tiene transparencia) las genera un hilo de
+    fondo, así el POST del admin no espera. Al terminar escribe
+    <hash>.json con los anchos generados e invalida la caché de fragmentos
+    para que las tarjetas empiecen a usar el srcset.
+
+    Pillow se importa recién al procesar; si no está instalado se guarda
+    el original y las páginas lo siguen usando tal cual.
+    """
+
+    def __init__(self):
+        self.app = None
+        self.anchos = (200, 400, 800)
+        self.calidad = 80
+        self.max_bytes = 10 * 1024 * 1024
+        self.max_pixeles = 40_000_000
+        self.asincrono = True
+        self._variantes = {}   # nombre -> dict del .json (solo las que ya existen)
+        self._cola = queue.Queue()
+        self._lock = threading.Lock()
+        self._hilo = None
+        self._pid = None
+
+    def init_app(self, app):
+        self.app = app
+        self.anchos = tuple(sorted(app.config.get('IMAGENES_ANCHOS', self.anchos)))
+        self.calidad = app.config.get('IMAGENES_CALIDAD', self.calidad)
+        self.max_bytes = app.config.get('IMAGENES_MAX_BYTES', self.max_bytes)
+        self.max_pixeles = app.config.get('IMAGENES_MAX_PIXELES', self.max_pixeles)
+        self.asincrono = app.config.get('IMAGENES_ASINCRONO', self.asincrono)
+        app.jinja_env.globals['variantes_imagen'] = self.variantes
+        atexit.register(self.esperar)
+
+    # --- Subida ---
+    def guardar(self, archivo):
+        """Valida un FileStorage y lo guarda. Devuelve el nombre relativo a static/."""
+        contenido = archivo.read(self.max_bytes + 1)
+        if len(contenido) > self.max_bytes:
+            raise ErrorImagen(f'La imagen supera los {self.max_bytes // (1024 * 1024)} MB permitidos.')
+        return self.guardar_bytes(contenido)
+
+    def guardar_bytes(self, contenido):
+        extension = self._validar(contenido)
+        hash_ = hashlib.blake2b(contenido, digest_size=8).hexdigest()
+        nombre = f'{CARPETA}/{hash_}{extension}'
+        ruta = self._ruta(nombre)
+        if not os.path.exists(ruta):
+            os.makedirs(os.path.dirname(ruta), exist_ok=True)
+            _escribir(ruta, contenido)
+        if self.procesada(nombre) is None:
+            self.programar(nombre)
+        return nombre
+
+    def _validar(self, contenido):
+        if not contenido:
+            raise ErrorImagen('El archivo está vacío.')
+        try:
+            from PIL import Image
+        except ImportError:
+            return self._validar_sin_pillow(contenido)
+
+        try:
+            with Image.open(io.BytesIO(contenido)) as imagen:
+                formato = imagen.format
+                ancho, alto = imagen.size
+                imagen.verify()
+        except Image.DecompressionBombError:
+            raise ErrorImagen('La imagen tiene demasiados píxeles.')
+        except Exception:
+            raise ErrorImagen('El archivo no es una imagen válida o está dañado.')
+        if formato not in FORMATOS:
+            raise ErrorImagen('Formato no permitido. Usa PNG, JPG, WebP o GIF.')
+        if ancho * alto > self.max_pixeles:
+            raise ErrorImagen(f'La imagen es demasiado grande ({ancho}x{alto} píxeles).')
+        return FORMATOS[formato]
+
+    def _validar_sin_pillow(self, contenido):
+        # Sin Pillow solo se reconocen las firmas de los formatos permitidos
+        firmas = {b'\x89PNG\r\n\x1a\n': '.png', b'\xff\xd8\xff': '.jpg', b'GIF87a': '.gif', b'GIF89a': '.gif'}
+        for firma, extension in firmas.items():
+            if contenido.startswith(firma):
+                return extension
+        if contenido[:4] == b'RIFF' and contenido[8:12] == b'WEBP':
+            return '.webp'
+        raise ErrorImagen('Formato no permitido. Usa PNG, JPG, WebP o GIF.')
+
+    # --- Variantes ---
+    def procesada(self, nombre):
+        """Datos del <hash>.json ({'anchos', 'respaldo', 'ancho', 'alto'}) o None si aún no hay variantes."""
+        if not nombre or not nombre.startswith(CARPETA + '/'):
+            return None
+        datos = self._variantes.get(nombre)
+        if datos is None:
+            try:
+                with open(self._ruta(_nombre_indice(nombre)), encoding='utf-8') as f:
+                    datos = json.load(f)
+            except (OSError, ValueError):
+                return None
+            with self._lock:
+                self._variantes[nombre] = datos
+        return datos
+
+    def variantes(self, nombre):
+        """srcset listos para la plantilla, o None si la imagen aún no se procesó."""
+        datos = self.procesada(nombre)
+        if datos is None:
+            return None
+
+        base = os.path.splitext(nombre)[0]
+
+        def srcset(extension):
+            return ', '.join(f"{url_for('static', filename=f'{base}-{a}{extension}')} {a}w" for a in datos['anchos'])
+
+        return {
+            'webp': srcset('.webp'),
+            'respaldo': srcset(datos['respaldo']),
+            'src': url_for('static', filename=f"{base}-{datos['anchos'][0]}{datos['respaldo']}"),
+            'ancho': datos['ancho'],
+            'alto': datos['alto'],
+        }
+
+    def programar(self, nombre):
+        if not self.asincrono:
+            self.procesar(nombre)
+            return
+        self._asegurar_hilo()
+        self._cola.put(nombre)
+
+    def procesar(self, nombre):
+        """Genera las variantes de una imagen ya guardada y su .json."""
+        try:
+            from PIL import Image, ImageOps
+        except ImportError:
+            print("Pillow no está instalado: las imágenes se sirven sin variantes (pip install Pillow).")
+            return False
+
+        base = os.path.splitext(self._ruta(nombre))[0]
+        with Image.open(self._ruta(nombre)) as original:
+            original.seek(0)  # GIF animado: basta el primer cuadro para una vista previa
+            imagen = ImageOps.exif_transpose(original)
+            transparente = imagen.mode in ('RGBA', 'LA', 'PA') or 'transparency' in imagen.info
+            imagen = imagen.convert('RGBA' if transparente else 'RGB')
+
+        respaldo = '.png' if transparente else '.jpg'
+        # Nunca se agranda: los anchos mayores al original se reemplazan por el original
+        anchos = sorted({min(a, imagen.width) for a in self.anchos})
+        for ancho in anchos:
+            alto = max(1, round(imagen.height * ancho / imagen.width))
+            reducida = imagen if ancho == imagen.width else imagen.resize((ancho, alto), Image.LANCZOS)
+            _guardar_imagen(reducida, f'{base}-{ancho}.webp', 'WEBP', quality=self.calidad, method=6)
+            if transparente:
+                _guardar_imagen(reducida, f'{base}-{ancho}.png', 'PNG', optimize=True)
+            else:
+                _guardar_imagen(reducida, f'{base}-{ancho}.jpg', 'JPEG', quality=self.calidad,
+                                optimize=True, progressive=True)
+
+        datos = {'anchos': anchos, 'respaldo': respaldo, 'ancho': imagen.width, 'alto': imagen.height}
+        _escribir(self._ruta(_nombre_indice(nombre)), json.dumps(datos).encode('utf-8'))
+        with self._lock:
+            self._variantes[nombre] = datos
+        cache_fragmentos.invalidar()
+        return True
+
+    def esperar(self):
+        """Bloquea hasta que la cola quede vacía (al cerrar o desde comandos)."""
+        if self._hilo is not None and self._pid == os.getpid():
+            self._cola.join()
+
+    # --- Interno ---
+    def _ruta(self, nombre):
+        return os.path.join(self.app.static_folder, *nombre.split('/'))
+
+    def _asegurar_hilo(self):
+        if self._hilo is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._hilo is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._cola = queue.Queue()
+            self._hilo = threading.Thread(target=self._bucle, name='procesador-imagenes', daemon=True)
+            self._hilo.start()
+
+    def _bucle(self):
+        while True:
+            nombre = self._cola.get()
+            try:
+                self.procesar(nombre)
+            except Exception as e:
+                print(f"Error al generar variantes de {nombre}: {e}")
+            finally:
+                self._cola.task_done()
+
+
+def _nombre_indice(nombre):
+    return os.path.splitext(nombre)[0] + '.json'
+
+
+def _escribir(ruta, contenido):
+    # Archivo temporal + rename: un request nunca ve un archivo a medio escribir
+    temporal = f'{ruta}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(temporal, 'wb') as f:
+        f.write(contenido)
+    os.replace(temporal, ruta)
+
+
+def _guardar_imagen(imagen, ruta, formato, **opciones):
+    buffer = io.BytesIO()
+    imagen.save(buffer, formato, **opciones)
+    _escribir(ruta, buffer.getvalue())
+
+
+procesador_imagenes = ProcesadorImagenes()
@@ -0,0 +1,238 @@
+# importacion_usuarios.py
+import csv
+import io
+import re
+from openpyxl import load_workbook
+from sqlalchemy import select, insert
+from models import db, Usuario, Rol, Grupo, Dashboard, usuario_grupos, usuario_dashboards
+from buscador import normalizar
+from hashing import procesador_hash
+from utils import es_password_segura
+
+# Columnas reconocidas (el encabezado se compara sin acentos ni mayúsculas)
+COLUMNAS = {
+    'nombre_completo': ('nombre completo', 'nombre_completo', 'nombre'),
+    'email': ('email', 'correo', 'correo electronico'),
+    'rol': ('rol',),
+    'password': ('password', 'contrasena', 'clave'),
+    'grupos': ('grupos',),
+    'dashboards': ('dashboards', 'paneles'),
+}
+COLUMNAS_OBLIGATORIAS = ('nombre_completo', 'email', 'rol')
+
+PATRON_EMAIL = re.compile(r'^[^@\s]+@[^@\s]+\.[^@\s]+$')
+SEPARADOR_LISTA = re.compile(r'[;|]')
+
+
+class ErrorArchivo(Exception):
+    """El archivo no se puede leer (formato o encabezados)."""
+
+
+# --- LECTURA ---
+def _mapear_encabezados(encabezados):
+    normalizados = [normalizar(str(e or '')).replace('_', ' ') for e in encabezados]
+    mapa = {}
+    for campo, alias in COLUMNAS.items():
+        for i, nombre in enumerate(normalizados):
+            if nombre in {normalizar(a).replace('_', ' ') for a in alias}:
+                mapa[campo] = i
+                break
+    faltan = [c for c in COLUMNAS_OBLIGATORIAS if c not in mapa]
+    if faltan:
+        raise ErrorArchivo(f"Faltan columnas obligatorias: {', '.join(faltan)}.")
+    return mapa
+
+
+def _filas_csv(contenido):
+    texto = contenido.decode('utf-8-sig')
+    try:
+        dialecto = csv.Sniffer().sniff(texto[:4096], delimiters=',;\t')
+    except csv.Error:
+        dialecto = csv.excel
+    return list(csv.reader(io.StringIO(texto), dialecto))
+
+
+def _filas_xlsx(contenido):
+    wb = load_workbook(io.BytesIO(contenido), read_only=True, data_only=True)
+    try:
+        return [list(fila) for fila in wb.worksheets[0].iter_rows(values_only=True)]
+    finally:
+        wb.close()
+
+
+def leer_archivo(nombre_archivo, contenido):
+    """Devuelve [(numero_fila, {campo: texto})] a partir de un CSV o XLSX."""
+    extension = nombre_archivo.rsplit('.', 1)[-1].lower() if '.' in nombre_archivo else ''
+    if extension == 'csv':
+        filas = _filas_csv(contenido)
+    elif extension == 'xlsx':
+        filas = _filas_xlsx(contenido)
+    else:
+        raise ErrorArchivo('Formato no soportado: sube un archivo .csv o .xlsx.')
+
+    if not filas:
+        raise ErrorArchivo('El archivo está vacío.')
+
+    mapa = _mapear_encabezados(filas[0])
+    registros = []
+    for numero, fila in enumerate(filas[1:], start=2):
+        if not any(str(c or '').strip() for c in fila):
+            continue  # Fila en blanco
+        registro = {}
+        for campo, i in mapa.items():
+            valor = fila[i] if i < len(fila) else None
+            registro[campo] = str(valor).strip() if valor is not None else ''
+        registros.append((numero, registro))
+    return registros
+
+
+def _lista(texto):
+    return [parte.strip() for parte in SEPARADOR_LISTA.split(texto or '') if parte.strip()]
+
+
+# --- RESOLUCIÓN (una consulta IN por entidad) ---
+def _resolver(modelo, columna_nombre, referencias):
+    """Mapea cada referencia (ID o nombre) a un ID, con una sola consulta.
+
+    Los nombres se comparan normalizados (sin mayúsculas, acentos ni
+    espacios de más) en Python y no con IN en SQL, para no depender de la
+    intercalación de la base: si hay algún nombre se leen id y nombre de
+    toda la tabla (grupos y paneles son catálogos chicos).
+
+    Devuelve {referencia: id | None}; None si no existe o si el nombre es ambiguo.
+    """
+    if not referencias:
+        return {}
+    ids = {int(r) for r in referencias if r.isdigit()}
+    hay_nombres = any(not r.isdigit() for r in referencias)
+
+    consulta = select(modelo.id, columna_nombre)
+    if not hay_nombres:
+        consulta = consulta.where(modelo.id.in_(ids))
+    filas = db.session.execute(consulta).all()
+
+    por_id = {id_ for id_, _ in filas}
+    por_nombre = {}
+    for id_, nombre in filas:
+        por_nombre.setdefault(normalizar(nombre), []).append(id_)
+
+    resultado = {}
+    for ref in referencias:
+        if ref.isdigit():
+            resultado[ref] = int(ref) if int(ref) in por_id else None
+        else:
+            coincidencias = por_nombre.get(normalizar(ref), [])
+            resultado[ref] = coincidencias[0] if len(coincidencias) == 1 else None
+    return resultado
+
+
+# --- VALIDACIÓN E IMPORTACIÓN ---
+def validar(registros, clave_inicial=None):
+    """Valida todo en memoria. Devuelve (usuarios_listos, errores_por_fila).
+
+    errores_por_fila es [(numero_fila, email, [mensajes])]; si no está
+    vacío no se debe importar nada.
+    """
+    emails = [r['email'].lower() for _, r in registros if r['email']]
+    existentes = set(db.session.execute(
+        select(Usuario.email).where(Usuario.email.in_(emails))
+    ).scalars()) if emails else set()
+    existentes = {e.lower() for e in existentes}
+
+    roles = {normalizar(nombre): id_ for id_, nombre in db.session.execute(select(Rol.id, Rol.nombre))}
+    refs_grupos = {g for _, r in registros for g in _lista(r.get('grupos'))}
+    refs_dashboards = {d for _, r in registros for d in _lista(r.get('dashboards'))}
+    grupos = _resolver(Grupo, Grupo.nombre, refs_grupos)
+    dashboards = _resolver(Dashboard, Dashboard.titulo, refs_dashboards)
+
+    listos, errores, vistos = [], [], {}
+    for numero, r in registros:
+        problemas = []
+        email = r['email'].lower()
+
+        if not r['nombre_completo']:
+            problemas.append('Falta el nombre.')
+        if not email:
+            problemas.append('Falta el email.')
+        elif not PATRON_EMAIL.match(email):
+            problemas.append(f'Email inválido: {email}.')
+        elif email in existentes:
+            problemas.append('El email ya está registrado en el sistema.')
+        elif email in vistos:
+            problemas.append(f'Email repetido (también en la fila {vistos[email]}).')
+        vistos.setdefault(email, numero)
+
+        rol_id = roles.get(normalizar(r['rol']))
+        if rol_id is None:
+            problemas.append(f"Rol desconocido: '{r['rol']}'.")
+
+        if not r.get('password') and not clave_inicial:
+            problemas.append('Sin contraseña: agrega la columna o indica una clave inicial.')
+        elif r.get('password') and not es_password_segura(r['password']):
+            problemas.append('La contraseña debe tener al menos 8 caracteres, una mayúscula y un número.')
+
+        grupos_ids = []
+        for ref in _lista(r.get('grupos')):
+            if grupos.get(ref) is None:
+                problemas.append(f"Grupo no encontrado o ambiguo: '{ref}'.")
+            else:
+                grupos_ids.append(grupos[ref])
+        dashboards_ids = []
+        for ref in _lista(r.get('dashboards')):
+            if dashboards.get(ref) is None:
+                problemas.append(f"Panel no encontrado o ambiguo: '{ref}'.")
+            else:
+                dashboards_ids.append(dashboards[ref])
+
+        if problemas:
+            errores.append((numero, r['email'], problemas))
+        else:
+            listos.append({
+                'nombre_completo': r['nombre_completo'],
+                'email': email,
+                'rol_id': rol_id,
+                'password': r.get('password') or None,
+                'grupos': sorted(set(grupos_ids)),
+                'dashboards': sorted(set(dashboards_ids)),
+            })
+    return listos, errores
+
+
+def importar(listos, clave_inicial=None):
+    """Inserta usuarios y permisos con inserciones masivas en una sola transacción.
+
+    Los usuarios que usan la clave inicial comparten el mismo hash (se calcula
+    una vez) y quedan obligados a cambiarla al entrar.
+    """
+    hash_inicial = procesador_hash.generar(clave_inicial) if clave_inicial else None
+    # Las contraseñas propias se hashean en paralelo en todos los procesos del pool
+    propias = [u['password'] for u in listos if u['password']]
+    hashes = iter(procesador_hash.generar_lote(propias))
+
+    filas_usuarios = [{
+        'nombre_completo': u['nombre_completo'],
+        'email': u['email'],
+        'rol_id': u['rol_id'],
+        'password_hash': next(hashes) if u['password'] else hash_inicial,
+        'cambio_clave_requerido': not u['password'],
+        'activo': True,
+    } for u in listos]
+
+    try:
+        db.session.execute(insert(Usuario), filas_usuarios)
+        ids = dict(db.session.execute(
+            select(Usuario.email, Usuario.id).where(Usuario.email.in_([u['email'] for u in listos]))
+        ).all())
+
+        filas_grupos = [{'usuario_id': ids[u['email']], 'grupo_id': g} for u in listos for g in u['grupos']]
+        filas_dashboards = [{'usuario_id': ids[u['email']], 'dashboard_id': d} for u in listos for d in u['dashboards']]
+        if filas_grupos:
+            db.session.execute(usuario_grupos.insert(), filas_grupos)
+        if filas_dashboards:
+            db.session.execute(usuario_dashboards.insert(), filas_dashboards)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    return len(filas_usuarios), len(filas_grupos), len(filas_dashboards)
@@ -0,0 +1,146 @@
+# limites.py
+import math
+import threading
+import time
+from collections import OrderedDict
+
+
+def leer_limite(texto):
+    """'10/300' -> (10, 300): 10 intentos cada 300 segundos."""
+    cantidad, segundos = str(texto).split('/')
+    return int(cantidad), int(segundos)
+
+
+# --- BACKENDS ---
+# Un backend solo guarda contadores por ventana fija; el cálculo de la
+# ventana deslizante lo hace LimitadorIntentos, así cualquier backend sirve.
+
+class BackendMemoria:
+    """Contadores en un dict del proceso, acotados a `max_claves` (LRU).
+
+    Por clave se guardan tres enteros: [ventana, intentos_actual,
+    intentos_anterior]. Cuando se llena se descarta la clave que lleva
+    más tiempo sin intentos; una IP que sigue atacando se mantiene viva
+    porque cada intento la mueve al final.
+    """
+
+    def __init__(self, max_claves=100000):
+        self.max_claves = max_claves
+        self._datos = OrderedDict()
+        self._lock = threading.Lock()
+
+    def golpear(self, clave, ventana, ahora):
+        numero = int(ahora // ventana)
+        with self._lock:
+            entrada = self._datos.get(clave)
+            if entrada is None or numero - entrada[0] > 1:
+                entrada = [numero, 0, 0]       # Nueva o vencida hace más de una ventana
+                self._datos[clave] = entrada
+            elif numero != entrada[0]:
+                entrada[:] = [numero, 0, entrada[1]]
+            entrada[1] += 1
+            self._datos.move_to_end(clave)
+            while len(self._datos) > self.max_claves:
+                self._datos.popitem(last=False)
+            return entrada[1], entrada[2]
+
+    def limpiar(self):
+        with self._lock:
+            self._datos.clear()
+
+
+class BackendRedis:
+    """Contadores compartidos entre workers/servidores (requiere el paquete `redis`)."""
+
+    def __init__(self, url):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError('LIMITES_BACKEND apunta a Redis pero el paquete redis no está instalado '
+                               '(pip install redis).')
+        self.cliente = redis.Redis.from_url(url)
+
+    def golpear(self, clave, ventana, ahora):
+        numero = int(ahora // ventana)
+        actual = f'limite:{clave}:{numero}'
+        pipe = self.cliente.pipeline()
+        pipe.incr(actual)
+        pipe.expire(actual, ventana * 2)
+        pipe.get(f'limite:{clave}:{numero - 1}')
+        intentos, _, anteriores = pipe.execute()
+        return int(intentos), int(anteriores or 0)
+
+    def limpiar(self):
+        for clave in self.cliente.scan_iter('limite:*'):
+            self.cliente.delete(clave)
+
+
+# --- LIMITADOR ---
+class LimitadorIntentos:
+    """Limita intentos por IP y por email con ventanas deslizantes.
+
+    Usa la aproximación de dos ventanas fijas (la actual más la anterior
+    ponderada por lo que queda de ella): O(1) por intento y tres enteros
+    por clave, sin guardar cada timestamp. Cada intento cuenta, incluso
+    los rechazados, así un ataque sostenido no vuelve a ganar cupo.
+
+    Se llama antes de tocar la BD o calcular hashes. Los límites se
+    configuran como 'cantidad/segundos' en LIMITE_<REGLA>_IP y
+    LIMITE_<REGLA>_EMAIL.
+    """
+
+    REGLAS = {
+        'login': {'ip': '100/60', 'email': '10/300'},
+        'reseteo': {'ip': '10/600', 'email': '3/900'},
+    }
+
+    def __init__(self):
+        self.activo = True
+        self.reglas = {}
+        self.backend = BackendMemoria()
+
+    def init_app(self, app):
+        self.activo = app.config.get('LIMITES_ACTIVOS', self.activo)
+        self.reglas = {
+            regla: {dimension: leer_limite(app.config.get(f'LIMITE_{regla.upper()}_{dimension.upper()}', defecto))
+                    for dimension, defecto in dimensiones.items()}
+            for regla, dimensiones in self.REGLAS.items()
+        }
+
+        url = app.config.get('LIMITES_BACKEND') or 'memoria'
+        if url == 'memoria':
+            self.backend = BackendMemoria(app.config.get('LIMITES_MAX_CLAVES', 100000))
+        else:
+            self.backend = BackendRedis(url)
+
+    def verificar(self, regla, ip=None, email=None):
+        """Registra un intento. Devuelve 0 si se permite, o los segundos que faltan para reintentar."""
+        if not self.activo:
+            return 0
+
+        ahora = time.time()
+        valores = {'ip': ip, 'email': (email or '').strip().lower() or None}
+        espera = 0
+        for dimension, (limite, ventana) in self.reglas[regla].items():
+            valor = valores.get(dimension)
+            if not valor:
+                continue
+            try:
+                actuales, anteriores = self.backend.golpear(f'{regla}:{dimension}:{valor}', ventana, ahora)
+            except Exception as e:
+                # Si el backend compartido falla no bloqueamos a nadie, solo avisamos
+                print(f"Error en el limitador de intentos: {e}")
+                continue
+
+            restante = 1 - (ahora % ventana) / ventana   # fracción de la ventana actual que queda
+            if anteriores * restante + actuales <= limite:
+                continue
+            if actuales > limite:
+                faltan = restante  # Hay que esperar a que termine la ventana actual
+            else:
+                faltan = restante - (limite - actuales) / anteriores  # a que la anterior pese menos
+            espera = max(espera, math.ceil(ventana * faltan) or 1)
+        return espera
+
+
+limitador = LimitadorIntentos()
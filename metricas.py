@@ -0,0 +1,241 @@
+# metricas.py
+import hmac
+import threading
+import time
+from flask import g, request, has_request_context, before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Límites de las cubetas que se publican para Prometheus (segundos)
+CUBETAS_PROMETHEUS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PERCENTILES = (0.5, 0.9, 0.99)
+
+
+class HistogramaHDR:
+    """Histograma log-lineal al estilo HdrHistogram, en microsegundos.
+
+    Cada potencia de 2 se divide en 32 subcubetas, así el error relativo
+    de cualquier percentil queda bajo ~3% con memoria fija (~900 enteros
+    hasta una hora) y registrar un valor es O(1).
+    """
+
+    BITS = 5
+    SUB = 1 << BITS
+
+    def __init__(self, maximo_us=3600 * 10**6):
+        self.maximo = maximo_us
+        self.conteos = [0] * (self._indice(maximo_us) + 1)
+        self.total = 0
+        self.suma_us = 0
+
+    def _indice(self, valor):
+        if valor < 2 * self.SUB:
+            return valor
+        exponente = valor.bit_length() - self.BITS - 1
+        return exponente * self.SUB + (valor >> exponente)
+
+    def _limite_superior(self, indice):
+        if indice < 2 * self.SUB:
+            return indice
+        exponente = indice // self.SUB - 1
+        return ((indice % self.SUB + self.SUB + 1) << exponente) - 1
+
+    def registrar(self, valor_us):
+        valor = min(max(int(valor_us), 0), self.maximo)
+        self.conteos[self._indice(valor)] += 1
+        self.total += 1
+        self.suma_us += valor
+
+    def percentil(self, p):
+        if not self.total:
+            return 0
+        objetivo, acumulado = max(1, round(p * self.total)), 0
+        for indice, n in enumerate(self.conteos):
+            acumulado += n
+            if acumulado >= objetivo:
+                return self._limite_superior(indice)
+        return self.maximo
+
+    def acumulados(self, limites_us):
+        """Cantidad de valores <= cada límite (para las cubetas 'le' de Prometheus)."""
+        resultado, acumulado, i = [], 0, 0
+        for limite in limites_us:
+            while i < len(self.conteos) and self._limite_superior(i) <= limite:
+                acumulado += self.conteos[i]
+                i += 1
+            resultado.append(acumulado)
+        return resultado
+
+
+class EstadisticaEndpoint:
+    __slots__ = ('duracion', 'codigos', 'consultas', 'sql_us', 'render_us')
+
+    def __init__(self):
+        self.duracion = HistogramaHDR()
+        self.codigos = {}
+        self.consultas = 0
+        self.sql_us = 0
+        self.render_us = 0
+
+
+class Metricas:
+    """Tiempos por request: consultas SQL, render de plantillas y total.
+
+    Se engancha a los eventos del Engine de SQLAlchemy y a las señales de
+    render de Flask, acumula en `g` durante la request y al final:
+    - agrega el header Server-Timing (se ve en la pestaña Network del navegador);
+    - suma al histograma y contadores del endpoint.
+
+    Los datos viven en memoria de cada proceso y se publican en formato
+    Prometheus en /admin/metricas. Con METRICAS_ACTIVAS=0 no se registra
+    ningún hook, así que no hay costo alguno.
+    """
+
+    def __init__(self):
+        self.activo = True
+        self.token = None
+        self.inicio = time.time()
+        self._endpoints = {}   # endpoint -> EstadisticaEndpoint
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.activo = app.config.get('METRICAS_ACTIVAS', self.activo)
+        self.token = app.config.get('METRICAS_TOKEN')
+        if not self.activo:
+            return
+
+        # Sobre la clase Engine: cubre también engines que se creen después
+        if not event.contains(Engine, 'before_cursor_execute', self._antes_consulta):
+            event.listen(Engine, 'before_cursor_execute', self._antes_consulta)
+            event.listen(Engine, 'after_cursor_execute', self._despues_consulta)
+        before_render_template.connect(self._antes_render, app)
+        template_rendered.connect(self._despues_render, app)
+        app.before_request(self._inicio_request)
+        app.after_request(self._fin_request)
+
+    # --- Hooks ---
+    def _antes_consulta(self, conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context._metricas_inicio = time.perf_counter()
+
+    def _despues_consulta(self, conn, cursor, statement, parameters, context, executemany):
+        # Los hilos de fondo (logs, correos, vistas) no tienen request: no se cuentan
+        if context is None or not has_request_context() or 'metricas' not in g:
+            return
+        m = g.metricas
+        m[0] += 1
+        m[1] += time.perf_counter() - context._metricas_inicio
+
+    def _antes_render(self, sender, template, context, **extra):
+        if 'metricas' in g:
+            m = g.metricas
+            if m[3] == 0:
+                m[4] = time.perf_counter()
+            m[3] += 1   # Los fragmentos se renderizan dentro de otra plantilla: solo cuenta el exterior
+
+    def _despues_render(self, sender, template, context, **extra):
+        if 'metricas' in g:
+            m = g.metricas
+            m[3] -= 1
+            if m[3] == 0:
+                m[2] += time.perf_counter() - m[4]
+
+    def _inicio_request(self):
+        # [consultas, segundos_sql, segundos_render, profundidad_render, inicio_render, inicio]
+        g.metricas = [0, 0.0, 0.0, 0, 0.0, time.perf_counter()]
+
+    def _fin_request(self, response):
+        m = g.pop('metricas', None)
+        if m is None:
+            return response
+        consultas, sql, render = m[0], m[1], m[2]
+        total = time.perf_counter() - m[5]
+
+        response.headers['Server-Timing'] = (
+            f'sql;dur={sql * 1000:.1f};desc="{consultas} consultas", '
+            f'tpl;dur={render * 1000:.1f}, total;dur={total * 1000:.1f}'
+        )
+
+        endpoint = request.endpoint or 'sin_endpoint'
+        with self._lock:
+            est = self._endpoints.get(endpoint)
+            if est is None:
+                est = self._endpoints[endpoint] = EstadisticaEndpoint()
+            est.duracion.registrar(total * 1e6)
+            est.codigos[response.status_code] = est.codigos.get(response.status_code, 0) + 1
+            est.consultas += consultas
+            est.sql_us += int(sql * 1e6)
+            est.render_us += int(render * 1e6)
+        return response
+
+    # --- Publicación ---
+    def token_valido(self, cabecera):
+        """Permite que Prometheus lea /admin/metricas con 'Authorization: Bearer <METRICAS_TOKEN>'."""
+        if not self.token or not cabecera or not cabecera.startswith('Bearer '):
+            return False
+        return hmac.compare_digest(cabecera[7:].encode(), self.token.encode())
+
+    def limpiar(self):
+        with self._lock:
+            self._endpoints = {}
+
+    def exportar(self, extras=()):
+        """Texto en formato de exposición de Prometheus (0.0.4).
+
+        `extras` son tuplas (nombre, tipo, ayuda, valor) con otros contadores del proceso.
+        """
+        with self._lock:
+            copia = [(e, est.duracion.conteos[:], est.duracion.total, est.duracion.suma_us, dict(est.codigos),
+                      est.consultas, est.sql_us, est.render_us)
+                     for e, est in sorted(self._endpoints.items())]
+
+        limites_us = [int(s * 1e6) for s in CUBETAS_PROMETHEUS]
+        lineas = {
+            'requests': ['# HELP sistema_requests_total Requests atendidas por endpoint y código HTTP.',
+                         '# TYPE sistema_requests_total counter'],
+            'duracion': ['# HELP sistema_request_duracion_segundos Duración total de la request.',
+                         '# TYPE sistema_request_duracion_segundos histogram'],
+            'percentil': ['# HELP sistema_request_duracion_percentil_segundos Percentiles de la duración '
+                          '(histograma HDR, error < 3%).',
+                          '# TYPE sistema_request_duracion_percentil_segundos gauge'],
+            'consultas': ['# HELP sistema_sql_consultas_total Consultas SQL ejecutadas dentro de requests.',
+                          '# TYPE sistema_sql_consultas_total counter'],
+            'sql': ['# HELP sistema_sql_segundos_total Tiempo en consultas SQL dentro de requests.',
+                    '# TYPE sistema_sql_segundos_total counter'],
+            'render': ['# HELP sistema_render_segundos_total Tiempo renderizando plantillas.',
+                       '# TYPE sistema_render_segundos_total counter'],
+        }
+        for endpoint, conteos, total, suma_us, codigos, consultas, sql_us, render_us in copia:
+            etiqueta = f'endpoint="{_escapar(endpoint)}"'
+            for codigo, n in sorted(codigos.items()):
+                lineas['requests'].append(f'sistema_requests_total{{{etiqueta},codigo="{codigo}"}} {n}')
+
+            histograma = HistogramaHDR()
+            histograma.conteos, histograma.total = conteos, total
+            for limite, n in zip(CUBETAS_PROMETHEUS, histograma.acumulados(limites_us)):
+                lineas['duracion'].append(f'sistema_request_duracion_segundos_bucket{{{etiqueta},le="{limite}"}} {n}')
+            lineas['duracion'].append(f'sistema_request_duracion_segundos_bucket{{{etiqueta},le="+Inf"}} {total}')
+            lineas['duracion'].append(f'sistema_request_duracion_segundos_sum{{{etiqueta}}} {suma_us / 1e6:.6f}')
+            lineas['duracion'].append(f'sistema_request_duracion_segundos_count{{{etiqueta}}} {total}')
+            for p in PERCENTILES:
+                lineas['percentil'].append(f'sistema_request_duracion_percentil_segundos{{{etiqueta},quantile="{p}"}} '
+                                           f'{histograma.percentil(p) / 1e6:.6f}')
+
+            lineas['consultas'].append(f'sistema_sql_consultas_total{{{etiqueta}}} {consultas}')
+            lineas['sql'].append(f'sistema_sql_segundos_total{{{etiqueta}}} {sql_us / 1e6:.6f}')
+            lineas['render'].append(f'sistema_render_segundos_total{{{etiqueta}}} {render_us / 1e6:.6f}')
+
+        salida = [linea for grupo in lineas.values() for linea in grupo]
+        for nombre, tipo, ayuda, valor in extras:
+            salida += [f'# HELP {nombre} {ayuda}', f'# TYPE {nombre} {tipo}', f'{nombre} {valor}']
+        salida += ['# HELP sistema_proceso_inicio_segundos Momento en que arrancó este proceso (epoch).',
+                   '# TYPE sistema_proceso_inicio_segundos gauge',
+                   f'sistema_proceso_inicio_segundos {self.inicio:.0f}']
+        return '\n'.join(salida) + '\n'
+
+
+def _escapar(valor):
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+metricas = Metricas()
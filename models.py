@@ -1,10 +1,12 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
+from hashing import procesador_hash, HashOcupado
+from base_datos import SesionEnrutada
 from datetime import datetime
 import pytz
 
-db = SQLAlchemy()
+# La sesión enruta las lecturas de vistas marcadas con solo_lectura a la réplica (base_datos.py)
+db = SQLAlchemy(session_options={'class_': SesionEnrutada})
 
 # --- TABLAS INTERMEDIAS ---
 usuario_grupos = db.Table('usuario_grupos',
@@ -46,19 +48,29 @@ class Usuario(db.Model, UserMixin):
     rol = db.relationship('Rol', back_populates='usuarios')
 
     # Acceso a grupos permitidos
-    grupos_permitidos = db.relationship('Grupo', secondary=usuario_grupos, lazy='subquery',
+    grupos_permitidos = db.relationship('Grupo', secondary=usuario_grupos, lazy='select',
         backref=db.backref('usuarios_con_acceso', lazy=True))
     
     # Acceso a dashboards permitidos
-    dashboards_permitidos = db.relationship('Dashboard', secondary=usuario_dashboards, lazy='subquery',
+    dashboards_permitidos = db.relationship('Dashboard', secondary=usuario_dashboards, lazy='select',
         backref=db.backref('usuarios_con_acceso', lazy=True))
 
-    # Métodos password
+    # Métodos password (el cálculo se hace en el pool de procesos de hashing.py)
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = procesador_hash.generar(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return procesador_hash.verificar(self.password_hash, password)
+
+    def rehash_si_corresponde(self, password):
+        """Recalcula el hash con la política actual si se guardó con otra. Devuelve True si cambió."""
+        try:
+            if not procesador_hash.necesita_rehash(self.password_hash):
+                return False
+            self.set_password(password)
+        except HashOcupado:
+            return False  # La clave ya se validó; se recalcula en otro inicio de sesión
+        return True
 
 class Log(db.Model):
     __tablename__ = 'logs'
@@ -66,11 +78,24 @@ class Log(db.Model):
     timestamp = db.Column(db.DateTime, nullable=False, default=obtener_hora_chile) 
     usuario_id = db.Column(db.Integer, db.ForeignKey('usuarios.id'), nullable=True)
     usuario_nombre = db.Column(db.String(255))
-    accion = db.Column(db.String(255), nullable=False)
+    accion = db.Column(db.String(255), nullable=False)  # Código de eventos.ACCIONES ('sesion.inicio')
     detalles = db.Column(db.Text)
+    # Entidad afectada por la acción ('dashboard', 12), IP de quien la hizo y datos extra
+    entidad_tipo = db.Column(db.String(30), nullable=True)
+    entidad_id = db.Column(db.Integer, nullable=True)
+    ip = db.Column(db.String(45), nullable=True)
+    datos = db.Column(db.JSON, nullable=True)
     
     usuario = db.relationship('Usuario', backref=db.backref('logs', lazy=True))
 
+    # Índices alineados con los filtros de ver_logs y la paginación por (timestamp, id)
+    __table_args__ = (
+        db.Index('ix_logs_timestamp_id', 'timestamp', 'id'),
+        db.Index('ix_logs_usuario_timestamp', 'usuario_id', 'timestamp', 'id'),
+        db.Index('ix_logs_accion_timestamp', 'accion', 'timestamp', 'id'),
+        db.Index('ix_logs_entidad_timestamp', 'entidad_tipo', 'entidad_id', 'timestamp', 'id'),
+    )
+
 # --- MODELOS ESTADÍSTICAS ---
 
 class Grupo(db.Model):
@@ -96,4 +121,93 @@ class Dashboard(db.Model):
 
     # Llave foránea para saber a qué grupo pertenece
     grupo_id = db.Column(db.Integer, db.ForeignKey('grupos.id'), nullable=True)
-    grupo = db.relationship('Grupo', back_populates='dashboards')
\ No newline at end of file
+    grupo = db.relationship('Grupo', back_populates='dashboards')
+
+# --- USO DE PANELES (ROLLUPS) ---
+# Contadores pre-agregados de vistas; se llenan por lotes desde uso_dashboards.py.
+# El mensual existe para que los reportes de rangos largos no recorran cada día.
+
+class UsoDashboardDiario(db.Model):
+    __tablename__ = 'uso_dashboards_diario'
+    fecha = db.Column(db.Date, primary_key=True)
+    dashboard_id = db.Column(db.Integer, db.ForeignKey('dashboards.id'), primary_key=True)
+    usuario_id = db.Column(db.Integer, db.ForeignKey('usuarios.id'), primary_key=True)
+    vistas = db.Column(db.Integer, nullable=False, default=0)
+
+class UsoDashboardMensual(db.Model):
+    __tablename__ = 'uso_dashboards_mensual'
+    mes = db.Column(db.Date, primary_key=True) # Primer día del mes
+    dashboard_id = db.Column(db.Integer, db.ForeignKey('dashboards.id'), primary_key=True)
+    usuario_id = db.Column(db.Integer, db.ForeignKey('usuarios.id'), primary_key=True)
+    vistas = db.Column(db.Integer, nullable=False, default=0)
+
+# --- CORREOS SALIENTES ---
+# Cola persistente de correos; la despachan los hilos de correos.py.
+# estado: 'pendiente' -> 'enviando' -> 'enviado' | 'fallido'
+
+class CorreoPendiente(db.Model):
+    __tablename__ = 'correos_pendientes'
+    id = db.Column(db.Integer, primary_key=True)
+    destinatario = db.Column(db.String(255), nullable=False)
+    asunto = db.Column(db.String(255), nullable=False)
+    cuerpo_html = db.Column(db.Text, nullable=False)
+    estado = db.Column(db.String(20), nullable=False, default='pendiente')
+    intentos = db.Column(db.Integer, nullable=False, default=0)
+    proximo_intento = db.Column(db.DateTime, nullable=False, default=obtener_hora_chile)
+    ultimo_error = db.Column(db.Text)
+    creado_en = db.Column(db.DateTime, nullable=False, default=obtener_hora_chile)
+    enviado_en = db.Column(db.DateTime)
+
+    __table_args__ = (
+        # Los hilos buscan por estado y hora del próximo intento
+        db.Index('ix_correos_estado_proximo', 'estado', 'proximo_intento'),
+    )
+
+# --- EXPORTACIONES EN SEGUNDO PLANO ---
+# Reportes de logs que arman los hilos de exportaciones.py; el archivo queda en disco hasta expira_en.
+# estado: 'pendiente' -> 'procesando' -> 'lista' | 'fallida'; 'lista' -> 'vencida' al borrar el archivo
+
+class ProgramacionExportacion(db.Model):
+    __tablename__ = 'programaciones_exportacion'
+    id = db.Column(db.Integer, primary_key=True)
+    nombre = db.Column(db.String(100), nullable=False)
+    frecuencia = db.Column(db.String(10), nullable=False, default='mensual') # diaria | semanal | mensual
+    formato = db.Column(db.String(4), nullable=False, default='xlsx')
+    accion = db.Column(db.String(255)) # Filtro opcional
+    usuario_id = db.Column(db.Integer, db.ForeignKey('usuarios.id'), nullable=True) # Filtro opcional
+    hora = db.Column(db.Integer, nullable=False, default=3) # Hora del día en que se genera (fuera de horario)
+    activa = db.Column(db.Boolean, nullable=False, default=True)
+    proxima_ejecucion = db.Column(db.DateTime, nullable=False)
+    creado_en = db.Column(db.DateTime, nullable=False, default=obtener_hora_chile)
+
+    usuario = db.relationship('Usuario')
+
+class ExportacionLogs(db.Model):
+    __tablename__ = 'exportaciones_logs'
+    id = db.Column(db.Integer, primary_key=True)
+    formato = db.Column(db.String(4), nullable=False) # xlsx | csv
+    filtros = db.Column(db.Text, nullable=False, default='{}') # JSON con los parámetros de ver_logs
+    descripcion = db.Column(db.String(255))
+    estado = db.Column(db.String(20), nullable=False, default='pendiente')
+    intentos = db.Column(db.Integer, nullable=False, default=0)
+    filas = db.Column(db.Integer, nullable=False, default=0) # Progreso
+    total_estimado = db.Column(db.Integer)
+    archivo = db.Column(db.String(255)) # Nombre dentro de EXPORTACIONES_DIR
+    tamano = db.Column(db.BigInteger)
+    error = db.Column(db.Text)
+    solicitado_por = db.Column(db.Integer, db.ForeignKey('usuarios.id'), nullable=True)
+    programacion_id = db.Column(db.Integer, db.ForeignKey('programaciones_exportacion.id', ondelete='SET NULL'),
+                                nullable=True)
+    creado_en = db.Column(db.DateTime, nullable=False, default=obtener_hora_chile)
+    iniciado_en = db.Column(db.DateTime)
+    terminado_en = db.Column(db.DateTime)
+    expira_en = db.Column(db.DateTime)
+    plazo = db.Column(db.DateTime) # Mientras se procesa: si vence, otro hilo lo retoma
+
+    usuario = db.relationship('Usuario')
+    programacion = db.relationship('ProgramacionExportacion', backref=db.backref('exportaciones', lazy='dynamic'))
+
+    __table_args__ = (
+        db.Index('ix_exportaciones_estado_creado', 'estado', 'creado_en'),
+        db.Index('ix_exportaciones_programacion', 'programacion_id', 'id'),
+    )
@@ -0,0 +1,98 @@
+# paginacion.py
+import base64
+from datetime import datetime
+from sqlalchemy import and_, or_
+
+
+# --- CURSORES OPACOS ---
+# Un cursor es la posición (timestamp, id) de una fila codificada en base64,
+# así la URL no expone el formato y se puede cambiar sin romper enlaces.
+
+def codificar_cursor(timestamp, id_):
+    crudo = f'{timestamp.isoformat()}|{id_}'.encode()
+    return base64.urlsafe_b64encode(crudo).decode().rstrip('=')
+
+
+def decodificar_cursor(cursor):
+    """Devuelve (timestamp, id) o None si el cursor no es válido."""
+    if not cursor:
+        return None
+    try:
+        relleno = '=' * (-len(cursor) % 4)
+        texto = base64.urlsafe_b64decode(cursor + relleno).decode()
+        fecha, id_ = texto.split('|')
+        return datetime.fromisoformat(fecha), int(id_)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def posterior_a(col_ts, col_id, posicion):
+    """(col_ts, col_id) > posicion, escrito de forma que use el índice compuesto."""
+    ts, id_ = posicion
+    return or_(col_ts > ts, and_(col_ts == ts, col_id > id_))
+
+
+def anterior_a(col_ts, col_id, posicion):
+    ts, id_ = posicion
+    return or_(col_ts < ts, and_(col_ts == ts, col_id < id_))
+
+
+# --- PAGINACIÓN POR CURSOR (KEYSET) ---
+class PaginaCursor:
+    """Una página de resultados ordenados de lo más nuevo a lo más antiguo.
+
+    A diferencia de paginate() no usa OFFSET ni COUNT(*): cada página se
+    pide desde la posición de la anterior, así la página 1000 cuesta lo
+    mismo que la primera.
+    """
+
+    def __init__(self, items, cursor_siguiente=None, cursor_anterior=None, total=None):
+        self.items = items
+        self.cursor_siguiente = cursor_siguiente
+        self.cursor_anterior = cursor_anterior
+        self.total = total
+
+    @property
+    def has_next(self):
+        return self.cursor_siguiente is not None
+
+    @property
+    def has_prev(self):
+        return self.cursor_anterior is not None
+
+
+def paginar_por_cursor(query, col_ts, col_id, por_pagina, siguiente=None, anterior=None, contar=False):
+    """Pagina `query` por (col_ts, col_id) descendente.
+
+    `siguiente` pide la página de filas más antiguas que ese cursor y
+    `anterior` la de filas más nuevas. `contar` agrega el total exacto
+    (un COUNT sobre los filtros), que es opcional por su costo.
+    """
+    total = query.order_by(None).count() if contar else None
+    pos_siguiente = decodificar_cursor(siguiente)
+    pos_anterior = decodificar_cursor(anterior)
+
+    if pos_anterior:
+        # Hacia atrás: traemos en orden ascendente y damos vuelta
+        filas = query.filter(posterior_a(col_ts, col_id, pos_anterior)) \
+                     .order_by(col_ts.asc(), col_id.asc()).limit(por_pagina + 1).all()
+        hay_mas_nuevas = len(filas) > por_pagina
+        items = list(reversed(filas[:por_pagina]))
+        hay_mas_antiguas = True
+    else:
+        if pos_siguiente:
+            query = query.filter(anterior_a(col_ts, col_id, pos_siguiente))
+        filas = query.order_by(col_ts.desc(), col_id.desc()).limit(por_pagina + 1).all()
+        hay_mas_antiguas = len(filas) > por_pagina
+        items = filas[:por_pagina]
+        hay_mas_nuevas = pos_siguiente is not None
+
+    def _cursor(fila):
+        return codificar_cursor(getattr(fila, col_ts.key), getattr(fila, col_id.key))
+
+    return PaginaCursor(
+        items,
+        cursor_siguiente=_cursor(items[-1]) if items and hay_mas_antiguas else None,
+        cursor_anterior=_cursor(items[0]) if items and hay_mas_nuevas else None,
+        total=total,
+    )
@@ -0,0 +1,142 @@
+# permisos.py
+import hashlib
+from collections import namedtuple
+from flask import g
+from flask_login import current_user
+from sqlalchemy import select, delete, union_all, literal
+from models import db, Grupo, Dashboard, usuario_grupos, usuario_dashboards
+
+
+class IndicePermisos:
+    """IDs de grupos y dashboards que un usuario puede ver (inmutable).
+
+    `huella` resume el conjunto de permisos: dos usuarios con la misma
+    huella ven exactamente lo mismo (se usa como clave de caché).
+    """
+    __slots__ = ('es_admin', 'grupos', 'dashboards', 'huella')
+
+    def __init__(self, es_admin, grupos=(), dashboards=()):
+        object.__setattr__(self, 'es_admin', es_admin)
+        object.__setattr__(self, 'grupos', frozenset(grupos))
+        object.__setattr__(self, 'dashboards', frozenset(dashboards))
+        if es_admin:
+            huella = 'admin'
+        else:
+            crudo = f'{sorted(self.grupos)}|{sorted(self.dashboards)}'.encode()
+            huella = hashlib.blake2b(crudo, digest_size=12).hexdigest()
+        object.__setattr__(self, 'huella', huella)
+
+    def __setattr__(self, nombre, valor):
+        raise AttributeError('IndicePermisos es inmutable')
+
+    def puede_ver_grupo(self, grupo_id):
+        return self.es_admin or grupo_id in self.grupos
+
+    def puede_ver_dashboard(self, dashboard_id):
+        return self.es_admin or dashboard_id in self.dashboards
+
+
+def compilar_indice(usuario_id, es_admin):
+    """Construye el índice de permisos con una sola consulta (UNION de ambas tablas)."""
+    if es_admin:
+        # El admin ve todo, no necesitamos ir a la BD
+        return IndicePermisos(es_admin=True)
+
+    consulta = union_all(
+        select(literal('g').label('tipo'), usuario_grupos.c.grupo_id.label('ref_id'))
+            .where(usuario_grupos.c.usuario_id == usuario_id),
+        select(literal('d').label('tipo'), usuario_dashboards.c.dashboard_id.label('ref_id'))
+            .where(usuario_dashboards.c.usuario_id == usuario_id),
+    )
+
+    grupos, dashboards = [], []
+    for tipo, ref_id in db.session.execute(consulta):
+        (grupos if tipo == 'g' else dashboards).append(ref_id)
+
+    return IndicePermisos(es_admin=False, grupos=grupos, dashboards=dashboards)
+
+
+def indice_permisos():
+    """Índice del usuario actual, compilado una sola vez por request."""
+    # Si el usuario viene de la caché de sesión, el índice ya está compilado
+    permisos = getattr(current_user, 'permisos', None)
+    if permisos is not None:
+        return permisos
+
+    if '_indice_permisos' not in g:
+        es_admin = current_user.rol.nombre == 'Admin'
+        g._indice_permisos = compilar_indice(current_user.id, es_admin)
+    return g._indice_permisos
+
+
+# --- FILTROS SQL ---
+# En vez de traer todo y filtrar en Python, la restricción se resuelve
+# con un JOIN contra las tablas intermedias.
+
+def filtrar_grupos_permitidos(query, usuario_id):
+    return query.join(usuario_grupos, usuario_grupos.c.grupo_id == Grupo.id) \
+                .filter(usuario_grupos.c.usuario_id == usuario_id)
+
+
+def filtrar_dashboards_permitidos(query, usuario_id):
+    return query.join(usuario_dashboards, usuario_dashboards.c.dashboard_id == Dashboard.id) \
+                .filter(usuario_dashboards.c.usuario_id == usuario_id)
+
+
+# --- SINCRONIZACIÓN DE PERMISOS ---
+class CambiosPermisos(namedtuple('CambiosPermisos', [
+        'grupos_agregados', 'grupos_quitados', 'dashboards_agregados', 'dashboards_quitados'])):
+    """Diferencia aplicada por sincronizar_permisos (conjuntos de IDs)."""
+    __slots__ = ()
+
+    @property
+    def hay_cambios(self):
+        return any(self)
+
+    def resumen(self):
+        """Texto corto para el log: 'grupos +2/-1, paneles +0/-3'."""
+        return (f"grupos +{len(self.grupos_agregados)}/-{len(self.grupos_quitados)}, "
+                f"paneles +{len(self.dashboards_agregados)}/-{len(self.dashboards_quitados)}")
+
+
+def _ids_validos(ids):
+    return {int(i) for i in ids if str(i).strip().isdigit()}
+
+
+def _sincronizar_tabla(tabla, columna, modelo, usuario_id, deseados):
+    """Aplica la diferencia en una tabla intermedia: a lo más un DELETE y un INSERT."""
+    actuales = set(db.session.execute(
+        select(columna).where(tabla.c.usuario_id == usuario_id)
+    ).scalars())
+
+    agregar = deseados - actuales
+    if agregar:
+        # Se descartan IDs que ya no existen (formulario viejo o manipulado)
+        agregar = set(db.session.execute(select(modelo.id).where(modelo.id.in_(agregar))).scalars())
+    quitar = actuales - deseados
+
+    if quitar:
+        db.session.execute(delete(tabla).where(tabla.c.usuario_id == usuario_id, columna.in_(quitar)))
+    if agregar:
+        db.session.execute(tabla.insert(), [{'usuario_id': usuario_id, columna.key: i} for i in sorted(agregar)])
+    return agregar, quitar
+
+
+def sincronizar_permisos(usuario, grupos_ids, dashboards_ids):
+    """Deja los permisos del usuario iguales a los IDs recibidos.
+
+    En vez de borrar todo y volver a insertar fila por fila, compara con lo
+    que ya está guardado y solo toca las diferencias. No hace commit: queda
+    dentro de la transacción de quien llama. El usuario debe tener id
+    (hacer flush antes si es nuevo).
+    """
+    grupos_agregados, grupos_quitados = _sincronizar_tabla(
+        usuario_grupos, usuario_grupos.c.grupo_id, Grupo, usuario.id, _ids_validos(grupos_ids))
+    dashboards_agregados, dashboards_quitados = _sincronizar_tabla(
+        usuario_dashboards, usuario_dashboards.c.dashboard_id, Dashboard, usuario.id, _ids_validos(dashboards_ids))
+
+    # Las colecciones del ORM quedaron desactualizadas: se recargan al próximo acceso
+    if usuario in db.session:
+        db.session.expire(usuario, ['grupos_permitidos', 'dashboards_permitidos'])
+
+    return CambiosPermisos(grupos_agregados, grupos_quitados, dashboards_agregados, dashboards_quitados)
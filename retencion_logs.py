@@ -0,0 +1,204 @@
+# retencion_logs.py
+import gzip
+import heapq
+import json
+import os
+import re
+import shutil
+from collections import namedtuple
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import select, delete, func
+from models import db, Log, obtener_hora_chile
+from paginacion import PaginaCursor, codificar_cursor, decodificar_cursor
+from eventos import codigo_accion
+
+# Fila de un mes archivado; tiene los mismos atributos que usan las plantillas de Log
+LogArchivado = namedtuple('LogArchivado', ['id', 'timestamp', 'usuario_id', 'usuario_nombre', 'accion', 'detalles',
+                                           'entidad_tipo', 'entidad_id', 'ip', 'datos'])
+COLUMNAS_ARCHIVO = (Log.id, Log.timestamp, Log.usuario_id, Log.usuario_nombre, Log.accion, Log.detalles,
+                    Log.entidad_tipo, Log.entidad_id, Log.ip, Log.datos)
+
+PATRON_ARCHIVO = re.compile(r'^logs_(\d{4}-\d{2})\.jsonl\.gz$')
+TAM_LOTE = 5000
+
+
+# --- MESES ---
+def inicio_mes(fecha):
+    return fecha.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def sumar_meses(fecha, meses):
+    total = fecha.year * 12 + (fecha.month - 1) + meses
+    return fecha.replace(year=total // 12, month=total % 12 + 1)
+
+
+def directorio_archivo():
+    directorio = current_app.config.get('LOGS_DIR_ARCHIVO') or \
+        os.path.join(current_app.instance_path, 'archivo_logs')
+    os.makedirs(directorio, exist_ok=True)
+    return directorio
+
+
+def ruta_mes(mes):
+    return os.path.join(directorio_archivo(), f'logs_{mes}.jsonl.gz')
+
+
+def meses_archivados():
+    """Meses ('AAAA-MM') que ya salieron de la tabla caliente, del más reciente al más antiguo."""
+    meses = [m.group(1) for m in map(PATRON_ARCHIVO.match, os.listdir(directorio_archivo())) if m]
+    return sorted(meses, reverse=True)
+
+
+# --- ARCHIVADO ---
+def _a_json(fila):
+    d = fila._asdict()
+    d['timestamp'] = fila.timestamp.isoformat()
+    return json.dumps(d, ensure_ascii=False)
+
+
+def _ultimo_id_archivado(ruta):
+    if not os.path.exists(ruta):
+        return 0
+    return max((fila.id for fila in _leer(ruta)), default=0)
+
+
+def archivar_mes(desde, hasta, tam_lote=TAM_LOTE):
+    """Mueve los logs con timestamp en [desde, hasta) a logs_AAAA-MM.jsonl.gz.
+
+    Primero escribe y sincroniza el archivo y recién después borra de la
+    tabla. Si una ejecución anterior se cortó entre ambos pasos, las filas
+    que ya estaban en el archivo no se duplican.
+    """
+    mes = desde.strftime('%Y-%m')
+    ruta = ruta_mes(mes)
+    ya_archivado = _ultimo_id_archivado(ruta)
+    rango = (Log.timestamp >= desde, Log.timestamp < hasta)
+
+    consulta = select(*COLUMNAS_ARCHIVO).where(*rango, Log.id > ya_archivado).order_by(Log.id)
+
+    # 1. Copiamos el archivo existente (si hay) y le agregamos un nuevo miembro gzip
+    temporal = ruta + '.tmp'
+    escritas = 0
+    with open(temporal, 'wb') as destino:
+        if os.path.exists(ruta):
+            with open(ruta, 'rb') as original:
+                shutil.copyfileobj(original, destino)
+        with gzip.GzipFile(fileobj=destino, mode='wb') as comprimido, db.engine.connect() as conn:
+            resultado = conn.execution_options(stream_results=True, yield_per=tam_lote).execute(consulta)
+            for particion in resultado.partitions():
+                comprimido.write(''.join(_a_json(f) + '\n' for f in particion).encode())
+                escritas += len(particion)
+        destino.flush()
+        os.fsync(destino.fileno())
+    if escritas:
+        os.replace(temporal, ruta)
+    else:
+        os.remove(temporal)
+
+    # 2. Borramos de la tabla caliente por lotes (transacciones cortas)
+    borradas = 0
+    while True:
+        ids = db.session.execute(select(Log.id).where(*rango).limit(tam_lote)).scalars().all()
+        if not ids:
+            break
+        db.session.execute(delete(Log).where(Log.id.in_(ids)))
+        db.session.commit()
+        borradas += len(ids)
+
+    return mes, escritas, borradas
+
+
+def archivar_logs(meses_calientes=None, tam_lote=TAM_LOTE):
+    """Archiva todos los meses completos anteriores a la ventana caliente.
+
+    Devuelve una lista de (mes, filas_escritas, filas_borradas).
+    """
+    if meses_calientes is None:
+        meses_calientes = current_app.config.get('LOGS_MESES_CALIENTES', 12)
+    corte = sumar_meses(inicio_mes(obtener_hora_chile()), -meses_calientes)
+
+    mas_antiguo = db.session.execute(select(func.min(Log.timestamp)).where(Log.timestamp < corte)).scalar()
+    if mas_antiguo is None:
+        return []
+
+    resumen = []
+    mes = inicio_mes(mas_antiguo)
+    while mes < corte:
+        siguiente = sumar_meses(mes, 1)
+        resumen.append(archivar_mes(mes, siguiente, tam_lote))
+        mes = siguiente
+    return resumen
+
+
+# --- LECTURA DE MESES ARCHIVADOS ---
+def _leer(ruta):
+    with gzip.open(ruta, 'rt', encoding='utf-8') as f:
+        for linea in f:
+            d = json.loads(linea)
+            # Los meses archivados antes de los códigos de acción traen el texto y no traen entidad
+            yield LogArchivado(d['id'], datetime.fromisoformat(d['timestamp']), d['usuario_id'],
+                               d['usuario_nombre'], codigo_accion(d['accion']), d['detalles'],
+                               d.get('entidad_tipo'), d.get('entidad_id'), d.get('ip'), d.get('datos'))
+
+
+def _cumple(fila, filtros):
+    if filtros.get('usuario_id') and fila.usuario_id != filtros['usuario_id']:
+        return False
+    if filtros.get('accion') and fila.accion != filtros['accion']:
+        return False
+    if filtros.get('entidad') and fila.entidad_tipo != filtros['entidad']:
+        return False
+    if filtros.get('entidad_id') is not None and fila.entidad_id != filtros['entidad_id']:
+        return False
+    if filtros.get('desde') and fila.timestamp < filtros['desde']:
+        return False
+    if filtros.get('hasta') and fila.timestamp >= filtros['hasta']:
+        return False
+    return True
+
+
+def iterar_archivo(mes, filtros):
+    """Filas de un mes archivado que cumplen los filtros, en orden cronológico."""
+    for fila in _leer(ruta_mes(mes)):
+        if _cumple(fila, filtros):
+            yield fila
+
+
+def iterar_filas_archivo(mes, filtros):
+    """Igual que exportacion_logs.iterar_filas, pero leyendo un mes archivado."""
+    for fila in iterar_archivo(mes, filtros):
+        yield fila.id, fila.timestamp, fila.usuario_nombre, fila.accion, fila.entidad_tipo, fila.entidad_id, fila.detalles
+
+
+def paginar_archivo(mes, filtros, por_pagina, siguiente=None, anterior=None, contar=False):
+    """Paginación por cursor sobre un mes archivado.
+
+    Recorre el archivo una vez por página guardando solo las `por_pagina`
+    filas que tocan (heap), así la memoria no depende del tamaño del mes.
+    """
+    clave = lambda f: (f.timestamp, f.id)
+    pos_siguiente = decodificar_cursor(siguiente)
+    pos_anterior = decodificar_cursor(anterior)
+    total = sum(1 for _ in iterar_archivo(mes, filtros)) if contar else None
+
+    filas = iterar_archivo(mes, filtros)
+    if pos_anterior:
+        candidatas = heapq.nsmallest(por_pagina + 1, (f for f in filas if clave(f) > pos_anterior), key=clave)
+        hay_mas_nuevas = len(candidatas) > por_pagina
+        items = list(reversed(candidatas[:por_pagina]))
+        hay_mas_antiguas = True
+    else:
+        if pos_siguiente:
+            filas = (f for f in filas if clave(f) < pos_siguiente)
+        candidatas = heapq.nlargest(por_pagina + 1, filas, key=clave)
+        hay_mas_antiguas = len(candidatas) > por_pagina
+        items = candidatas[:por_pagina]
+        hay_mas_nuevas = pos_siguiente is not None
+
+    return PaginaCursor(
+        items,
+        cursor_siguiente=codificar_cursor(*clave(items[-1])) if items and hay_mas_antiguas else None,
+        cursor_anterior=codificar_cursor(*clave(items[0])) if items and hay_mas_nuevas else None,
+        total=total,
+    )
@@ -0,0 +1,102 @@
+// static/sugerencias.js
+// Autocompletado del buscador de paneles: consulta /estadisticas/sugerir mientras se escribe.
+
+document.addEventListener('DOMContentLoaded', () => {
+    const input = document.querySelector('input[data-sugerencias-url]');
+    if (!input) return;
+
+    const url = input.dataset.sugerenciasUrl;
+    const lista = document.createElement('ul');
+    lista.className = 'hidden absolute left-0 right-0 mt-1 bg-white border border-gray-200 rounded-lg shadow-lg z-50 overflow-hidden text-left';
+    input.parentElement.appendChild(lista);
+
+    let temporizador = null;
+    let ultimaConsulta = '';
+    let controlador = null;
+    let seleccionado = -1;
+
+    function ocultar() {
+        lista.classList.add('hidden');
+        lista.innerHTML = '';
+        seleccionado = -1;
+    }
+
+    function marcar(indice) {
+        const items = lista.querySelectorAll('a');
+        items.forEach((item, i) => item.classList.toggle('bg-blue-50', i === indice));
+        seleccionado = indice;
+    }
+
+    function mostrar(sugerencias) {
+        lista.innerHTML = '';
+        seleccionado = -1;
+        if (!sugerencias.length) {
+            ocultar();
+            return;
+        }
+        sugerencias.forEach((s) => {
+            const li = document.createElement('li');
+            const enlace = document.createElement('a');
+            enlace.href = s.url;
+            enlace.className = 'flex justify-between items-center px-4 py-2 text-sm text-gray-700 hover:bg-blue-50';
+
+            // Usamos textContent para no interpretar HTML venido del servidor
+            const texto = document.createElement('span');
+            texto.textContent = s.texto;
+            const detalle = document.createElement('span');
+            detalle.className = 'ml-3 text-xs text-gray-400';
+            detalle.textContent = s.detalle;
+
+            enlace.appendChild(texto);
+            enlace.appendChild(detalle);
+            li.appendChild(enlace);
+            lista.appendChild(li);
+        });
+        lista.classList.remove('hidden');
+    }
+
+    function consultar() {
+        const q = input.value.trim();
+        if (q === ultimaConsulta) return;
+        ultimaConsulta = q;
+        if (q.length < 2) {
+            ocultar();
+            return;
+        }
+        // Cancelamos la consulta anterior si aún no respondía
+        if (controlador) controlador.abort();
+        controlador = new AbortController();
+
+        fetch(`${url}?q=${encodeURIComponent(q)}`, { signal: controlador.signal, credentials: 'same-origin' })
+            .then((r) => (r.ok ? r.json() : { sugerencias: [] }))
+            .then((datos) => mostrar(datos.sugerencias))
+            .catch(() => {});
+    }
+
+    input.addEventListener('input', () => {
+        clearTimeout(temporizador);
+        temporizador = setTimeout(consultar, 120);
+    });
+
+    input.addEventListener('keydown', (e) => {
+        const items = lista.querySelectorAll('a');
+        if (!items.length) return;
+        if (e.key === 'ArrowDown') {
+            e.preventDefault();
+            marcar((seleccionado + 1) % items.length);
+        } else if (e.key === 'ArrowUp') {
+            e.preventDefault();
+            marcar((seleccionado - 1 + items.length) % items.length);
+        } else if (e.key === 'Enter' && seleccionado >= 0) {
+            e.preventDefault();
+            window.location.href = items[seleccionado].href;
+        } else if (e.key === 'Escape') {
+            ocultar();
+        }
+    });
+
+    // Cerrar al hacer clic fuera del buscador
+    document.addEventListener('click', (e) => {
+        if (!input.parentElement.contains(e.target)) ocultar();
+    });
+});
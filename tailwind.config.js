@@ -0,0 +1,10 @@
+// tailwind.config.js — lo usa `flask --app app construir-css` (CLI standalone de Tailwind 3.x)
+/** @type {import('tailwindcss').Config} */
+module.exports = {
+  // Solo se emiten las clases que aparecen en estos archivos
+  content: ['./templates/**/*.html', './static/**/*.js'],
+  theme: {
+    extend: {},
+  },
+  plugins: [],
+};
@@ -0,0 +1,151 @@
+# uso_dashboards.py
+import atexit
+import os
+import threading
+from collections import Counter
+from datetime import timedelta
+from sqlalchemy import select, func, union_all
+from sqlalchemy.dialects import mysql, sqlite, postgresql
+from models import db, UsoDashboardDiario, UsoDashboardMensual, obtener_hora_chile
+
+DIALECTOS_UPSERT = {'mysql': mysql, 'sqlite': sqlite, 'postgresql': postgresql}
+
+
+class ContadorVistas:
+    """Cuenta vistas de dashboards en memoria y las vuelca por lotes a los rollups.
+
+    ver_dashboard solo suma en un Counter; un hilo de fondo hace cada
+    VISTAS_INTERVALO_FLUSH segundos un upsert multi-fila en las tablas
+    diaria y mensual (fecha x dashboard x usuario), con su propia conexión.
+    """
+
+    def __init__(self):
+        self.app = None
+        self.intervalo = 30.0
+        self.max_claves = 10000
+        self._pendientes = Counter()   # (fecha, dashboard_id, usuario_id) -> vistas
+        self._lock = threading.Lock()
+        self._despertar = threading.Event()
+        self._hilo = None
+        self._pid = None
+        self._engine = None
+
+    def init_app(self, app):
+        self.app = app
+        self.intervalo = app.config.get('VISTAS_INTERVALO_FLUSH', self.intervalo)
+        self.max_claves = app.config.get('VISTAS_MAX_PENDIENTES', self.max_claves)
+        atexit.register(self.vaciar)
+
+    def registrar(self, dashboard_id, usuario_id):
+        """Suma una vista. No toca la base de datos."""
+        self._asegurar_hilo()
+        clave = (obtener_hora_chile().date(), dashboard_id, usuario_id)
+        with self._lock:
+            self._pendientes[clave] += 1
+            lleno = len(self._pendientes) >= self.max_claves
+        if lleno:
+            self._despertar.set()
+
+    def vaciar(self):
+        """Escribe lo acumulado hasta ahora."""
+        with self._lock:
+            lote, self._pendientes = self._pendientes, Counter()
+        if not lote:
+            return
+        try:
+            self._escribir(lote)
+        except Exception as e:
+            print(f"Error al guardar vistas de dashboards: {e}")
+            # Devolvemos las vistas al acumulador para el próximo intento
+            with self._lock:
+                self._pendientes.update(lote)
+
+    def _asegurar_hilo(self):
+        if self._hilo is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._hilo is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._engine = None
+            self._hilo = threading.Thread(target=self._bucle, name='contador-vistas', daemon=True)
+            self._hilo.start()
+
+    def _bucle(self):
+        while True:
+            self._despertar.wait(self.intervalo)
+            self._despertar.clear()
+            self.vaciar()
+
+    def _escribir(self, lote):
+        if self._engine is None:
+            with self.app.app_context():
+                self._engine = db.engine
+
+        diario = [{'fecha': f, 'dashboard_id': d, 'usuario_id': u, 'vistas': n}
+                  for (f, d, u), n in lote.items()]
+        mensual = Counter()
+        for (f, d, u), n in lote.items():
+            mensual[(f.replace(day=1), d, u)] += n
+        mensual = [{'mes': m, 'dashboard_id': d, 'usuario_id': u, 'vistas': n}
+                   for (m, d, u), n in mensual.items()]
+
+        with self._engine.begin() as conn:
+            conn.execute(_upsert_sumando(conn, UsoDashboardDiario.__table__, diario))
+            conn.execute(_upsert_sumando(conn, UsoDashboardMensual.__table__, mensual))
+
+
+def _upsert_sumando(conn, tabla, filas):
+    """INSERT multi-fila que, si la clave ya existe, suma las vistas en vez de fallar."""
+    dialecto = DIALECTOS_UPSERT.get(conn.dialect.name)
+    if dialecto is None:
+        raise RuntimeError(f'Upsert no soportado para {conn.dialect.name}')
+    stmt = dialecto.insert(tabla).values(filas)
+    if conn.dialect.name == 'mysql':
+        return stmt.on_duplicate_key_update(vistas=tabla.c.vistas + stmt.inserted.vistas)
+    claves = [c.name for c in tabla.primary_key.columns]
+    return stmt.on_conflict_do_update(index_elements=claves, set_={'vistas': tabla.c.vistas + stmt.excluded.vistas})
+
+
+# --- REPORTES ---
+def _primer_dia_mes_siguiente(dia):
+    return (dia.replace(day=1) + timedelta(days=32)).replace(day=1)
+
+
+def consultar_uso(desde, hasta):
+    """Vistas y usuarios únicos por dashboard entre `desde` y `hasta` (fechas inclusivas).
+
+    Los meses completos del rango salen del rollup mensual y solo los
+    bordes sueltos del diario, así un año son ~12 filas por usuario y panel.
+    Devuelve {dashboard_id: (vistas, usuarios_unicos)}.
+    """
+    inicio_meses = desde if desde.day == 1 else _primer_dia_mes_siguiente(desde)
+    es_fin_de_mes = (hasta + timedelta(days=1)).day == 1
+    fin_meses = _primer_dia_mes_siguiente(hasta) if es_fin_de_mes else hasta.replace(day=1)
+
+    partes = []
+    if inicio_meses < fin_meses:
+        m = UsoDashboardMensual
+        partes.append(select(m.dashboard_id, m.usuario_id, m.vistas)
+                      .where(m.mes >= inicio_meses, m.mes < fin_meses))
+        bordes = [(desde, inicio_meses - timedelta(days=1)), (fin_meses, hasta)]
+    else:
+        bordes = [(desde, hasta)]
+
+    d = UsoDashboardDiario
+    for ini, fin in bordes:
+        if ini <= fin:
+            partes.append(select(d.dashboard_id, d.usuario_id, d.vistas)
+                          .where(d.fecha >= ini, d.fecha <= fin))
+
+    if not partes:
+        return {}
+    sub = union_all(*partes).subquery() if len(partes) > 1 else partes[0].subquery()
+    filas = db.session.execute(
+        select(sub.c.dashboard_id, func.sum(sub.c.vistas), func.count(func.distinct(sub.c.usuario_id)))
+        .group_by(sub.c.dashboard_id)
+    ).all()
+    return {dash_id: (int(vistas), usuarios) for dash_id, vistas, usuarios in filas}
+
+
+contador_vistas = ContadorVistas()
@@ -1,52 +1,56 @@
 # utils.py
-import os
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from email.utils import formataddr
+import re
 from functools import wraps
-from flask import abort, redirect, url_for, flash
+from flask import abort, redirect, url_for, flash, request, has_request_context
 from flask_login import current_user
-from models import db, Log
+from models import obtener_hora_chile
+from auditoria import escritor_logs
+from eventos import codigo_accion
+from correos import despachador_correos
 
 # --- LOGGING ---
-def registrar_log(accion, detalles):
-    """Registra una acción en la base de datos."""
+def registrar_log(accion, detalles, entidad=None, entidad_id=None, datos=None):
+    """Registra una acción en la auditoría.
+
+    `accion` es un código de eventos.ACCIONES; `entidad`/`entidad_id` indican
+    sobre qué se hizo ('dashboard', 12) y `datos` es un dict opcional con
+    valores que convenga consultar después sin leer el texto de `detalles`.
+
+    El evento se encola y lo escribe en lote el hilo de fondo de auditoria.py,
+    así no se suma un commit a la request ni se confirma de paso lo que haya
+    pendiente en db.session.
+    """
     if current_user.is_authenticated:
-        try:
-            nuevo_log = Log(
-                usuario_id=current_user.id,
-                usuario_nombre=current_user.nombre_completo,
-                accion=accion,
-                detalles=detalles
-            )
-            db.session.add(nuevo_log)
-            db.session.commit()
-        except Exception as e:
-            # Si falla el log, no queremos que se caiga toda la app, 
-            # pero imprimimos el error en consola.
-            print(f"Error al registrar log: {e}")
-            db.session.rollback()
+        escritor_logs.registrar({
+            'timestamp': obtener_hora_chile(),
+            'usuario_id': current_user.id,
+            'usuario_nombre': current_user.nombre_completo,
+            'accion': codigo_accion(accion),
+            'detalles': detalles,
+            'entidad_tipo': entidad,
+            'entidad_id': entidad_id,
+            'ip': request.remote_addr if has_request_context() else None,
+            'datos': datos or None,
+        })
+
+# --- CONTRASEÑAS ---
+def es_password_segura(password):
+    """Valida que la contraseña cumpla con los requisitos de seguridad."""
+    if len(password) < 8:
+        return False
+    if not re.search(r"[A-Z]", password): # Busca al menos una mayúscula
+        return False
+    if not re.search(r"[0-9]", password): # Busca al menos un número
+        return False
+    return True
 
 # --- CORREOS ---
 def enviar_correo_reseteo(usuario, token):
-    """Envía el correo con el link de recuperación."""
-    remitente = os.getenv("EMAIL_USUARIO")
-    contrasena = os.getenv("EMAIL_CONTRASENA")
-    
-    if not remitente or not contrasena:
-        print("ERROR: Credenciales de correo faltantes en .env")
-        return
-
-    msg = MIMEMultipart()
-    msg['Subject'] = 'Restablecimiento de Contraseña - Sistema Estadísticas'
-    
-    # 2. CAMBIO AQUÍ: Usamos formataddr en lugar de f-string manual
-    # Esto genera un header estándar RFC 2822 que los clientes respetan más
-    msg['From'] = formataddr(('Sistema Estadísticas', remitente))
-    
-    msg['To'] = usuario.email
+    """Deja en cola el correo con el link de recuperación.
 
+    El envío lo hacen los hilos de correos.py, así la request no espera
+    al servidor SMTP.
+    """
     # Generamos el link apuntando a la ruta de auth
     url_reseteo = url_for('auth.resetear_clave', token=token, _external=True)
 
@@ -65,16 +69,13 @@ def enviar_correo_reseteo(usuario, token):
         <p style="font-size: 12px; color: #888;">Unidad de TICs - Departamento de Salud</p>
     </div>
     """
-    msg.attach(MIMEText(cuerpo_html, 'html'))
 
     try:
-        with smtplib.SMTP('smtp.gmail.com', 587) as server:
-            server.starttls()
-            server.login(remitente, contrasena)
-            server.send_message(msg)
-            print(f"Correo enviado a {usuario.email}")
+        despachador_correos.encolar(usuario.email,
+                                    'Restablecimiento de Contraseña - Sistema Estadísticas',
+                                    cuerpo_html)
     except Exception as e:
-        print(f"Error enviando correo: {e}")
+        print(f"Error encolando correo: {e}")
 
 # --- DECORADORES ---
 def check_password_change(f):